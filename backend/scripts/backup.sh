@@ -29,8 +29,10 @@ if [ $? -ne 0 ]; then
 fi
 
 # Create the backup
+# The database runs in WAL mode, so recent changes may live in the -wal file:
+# SQLite's online backup copies a consistent snapshot including them
 echo "Backing up '$DB_PATH' to '$BACKUP_FILE'..."
-cp "$DB_PATH" "$BACKUP_FILE"
+python3 -c 'import sqlite3, sys; sqlite3.connect(sys.argv[1]).backup(sqlite3.connect(sys.argv[2]))' "$DB_PATH" "$BACKUP_FILE"
 
 # Check if the backup was successful
 if [ $? -eq 0 ]; then
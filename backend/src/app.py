@@ -1,14 +1,38 @@
 from flask import Flask, jsonify, request, send_from_directory
 from flask_caching import Cache
 from flask_cors import CORS
+from contextlib import nullcontext
+from math import comb, isfinite
 import random
+import time
+import numpy as np
 from datetime import datetime, timedelta
 from utils.digest import load_latest_digest, get_latest_digest_dir
 from utils import db as db_utils
 import os
 from dotenv import load_dotenv
-from utils.spreadsheet import SheetScoreFetcher
-from utils.balance import Balancer
+from utils.spreadsheet import SCORES, SheetScoreFetcher
+from utils.executor import (
+    DeadlineExceededError,
+    InlineExecutor,
+    QueueFullError,
+    create_executor,
+    wait_for,
+)
+from utils.metrics import LatencyHistogram, traced_peak
+from utils.predict import WinPredictor, win_probability
+from utils.balance import (
+    Balancer,
+    HeuristicBalancer,
+    MultiTeamBalancer,
+    RankBalancer,
+    ResultCache,
+    SplitConstraints,
+    get_score_quantum,
+    min_swap_split,
+    quantize,
+    randomize_scores,
+)
 
 load_dotenv()
 
@@ -18,6 +42,19 @@ fetcher = SheetScoreFetcher(os.getenv("GOOGLE_API_KEY"), os.getenv("SPREADSHEET_
 REFRESH_INTERVAL_HOURS = 4  # Refresh interval in hours
 MIN_REFRESH_INTERVAL_SECONDS = 30  # Minimum interval in seconds for a forced refresh
 DEFAULT_RANDOMNESS = 0  # Default randomness value (0-100) for team balancing
+DEFAULT_TEAMS = 2  # Default number of teams for team balancing
+MAX_TEAMS = 8  # Maximum number of teams for team balancing
+HEURISTIC_MAX_MS = 250  # Time budget in ms for lobbies too large for exact balancing
+MAX_BATCH_LOBBIES = 32  # Maximum number of lobbies in one batch balance request
+MAX_OPTIONS = 16  # Maximum number of randomized team options per balance request
+DEFAULT_MAX_SWAPS = 2  # Swaps tried by a rebalance before balancing from scratch
+MAX_SWAPS = 3  # Maximum swaps a rebalance request may ask for
+MAX_PLAYERS = 64  # Maximum lobby size of a rebalance request
+MAX_SWAP_PAIRS = 1_000_000  # Subset pairs a rebalance compares per swap count
+BALANCE_DEADLINE_MS = int(os.getenv("BALANCE_DEADLINE_MS", 2000))  # Default and max
+BALANCE_RETRY_AFTER_SECONDS = 1  # Retry-After sent when the balance queue is full
+BALANCE_METRICS_WINDOW = int(os.getenv("BALANCE_METRICS_WINDOW", 1000))  # Per size
+EVEN_ODDS_CANDIDATES = 64  # Equally balanced splits compared by win probability
 
 # Global variables to store the score mappings and last refresh time
 score_mappings = {}
@@ -29,66 +66,477 @@ app.config["CACHE_TYPE"] = "SimpleCache"
 
 cache = Cache(app)
 
-balancer = Balancer()
+score_quantum = get_score_quantum(SCORES)
+balancer = Balancer(quantum=score_quantum)
+# Unrandomized lobbies repeat as organizers rebalance, so their searches are
+# cached by score multiset. Randomized scores never repeat and bypass it.
+balance_cache = ResultCache(
+    max_entries=int(os.getenv("BALANCE_CACHE_ENTRIES", 1024)),
+    ttl=float(os.getenv("BALANCE_CACHE_TTL_SECONDS", 3600)),
+)
+rank_balancer = RankBalancer(quantum=score_quantum, cache=balance_cache)
+heuristic_balancer = HeuristicBalancer(quantum=score_quantum)
+# Filled in the web process from the diagnostics every balance returns, so it
+# covers the executor workers too
+balance_histogram = LatencyHistogram(window=BALANCE_METRICS_WINDOW)
+# Fitted on the events table on first use and caught up before every balance
+win_predictor = WinPredictor()
+multi_team_balancer = MultiTeamBalancer(quantum=score_quantum)
+
+
+def warm_up_balancers():
+    """Map the balancer tables in a fresh executor worker before its first task."""
+    balancer.get_tables()
+
+
+# "inline" balances on the request thread, "process" on a pool of worker
+# processes so a large lobby does not stall the other requests of this worker
+balance_executor = create_executor(
+    os.getenv("BALANCE_EXECUTOR", "inline"),
+    max_workers=int(os.getenv("BALANCE_WORKERS", 2)),
+    max_queue=int(os.getenv("BALANCE_QUEUE_DEPTH", 8)),
+    initializer=warm_up_balancers,
+)
 
 db = db_utils.Database()
 
 
-def balance_teams(user_scores, randomness=DEFAULT_RANDOMNESS):
+def balance_teams(
+    user_scores,
+    randomness=DEFAULT_RANDOMNESS,
+    teams=DEFAULT_TEAMS,
+    max_ms=None,
+    options=1,
+    seed=None,
+    pins=None,
+    together=(),
+    apart=(),
+    diagnostics=False,
+    trace_memory=False,
+    ratings=None,
+    prefer_even_odds=False,
+):
     """
-    Balance players into two teams by pairing players from the sorted list and distributing each pair
-    between the two teams, with optional randomness applied to the scores.
+    Balance players into equally sized teams with the closest possible score totals,
+    with optional randomness applied to the scores.
 
     Args:
         user_scores (dict): Dictionary mapping usernames to their scores {'user1': 3, 'user2': 2, ...}
         randomness (int): Value between 0-100 that determines how much randomness to add to scores
                          0 = no randomness, 100 = maximum randomness
+        teams (int): Number of teams to split the players into
+        max_ms (int): Optional search time budget. The best split found within it
+                      is returned, with 'optimal' False if it was not proven best.
+                      The rank-count DP used without randomness is always exact.
+        options (int): Number of randomized draws to balance (two teams only). The
+                       distinct results are returned as 'options' with how often
+                       each came up, most frequent first.
+        seed (int): Optional seed that makes the result reproducible
+        pins (dict): Usernames locked to a team, mapping them to "A" or "B"
+        together (list): Groups of usernames that must play on the same team
+        apart (list): Pairs of usernames that must play on opposite teams.
+                      Constraints need two teams and are enforced by the exact
+                      search, for up to 30 free players or linked groups.
+        diagnostics (bool): Describe the cost of the search in 'diagnostics'
+        trace_memory (bool): Also trace the peak allocation of the search, which
+                             slows it down
+        ratings (list): Optional WinPredictor rating of every user, in the order
+                        of user_scores. Two-team results then carry
+                        'win_probability', the predicted chance that team A wins.
+        prefer_even_odds (bool): Among equally balanced splits, return the one
+                                 whose win probability is closest to 50%
+                                 (needs ratings and an exact engine)
 
     Returns:
-        dict: Dictionary with 'teamA' and 'teamB' lists of player objects
+        dict: For two teams, 'teamA' and 'teamB' lists of player objects; otherwise
+              'teams', a list of k lists of player objects. 'diff' is the achieved
+              gap between team totals (on the randomized scores) and 'optimal'
+              tells whether no better balanced split exists. Two-team results also
+              carry 'solution_count', the number of equally good splits the returned
+              one was drawn from (None for the heuristic engine). The rank-count DP
+              counts in float64, so counts above 2^53 are approximate.
+              With diagnostics, 'diagnostics' describes the search: 'players',
+              'engine', 'elapsed_ms', 'peak_bytes' (None without trace_memory),
+              'subsets_examined' (half-masks enumerated, None for engines that
+              do not enumerate them), 'cache_hit', 'min_diff' and
+              'solution_count'.
     """
-    # Convert the user_scores dictionary to a list of player objects
-    players = []
+    assert options == 1 or teams == 2, "Multiple options need two teams"
+    assert ratings is not None or not prefer_even_odds, "Even odds need ratings"
+    # Without a seed, draw from the random module so random.seed still applies
+    rng = np.random.default_rng(random.getrandbits(64) if seed is None else seed)
+
+    nicknames = list(user_scores)
+    scores = [user_scores[nickname] for nickname in nicknames]
+    draws = randomize_scores(scores, randomness, options, rng)
+    constraints = None
+    if pins or together or apart:
+        assert teams == 2, "Constraints need two teams"
+        constraints = make_constraints(nicknames, pins, together, apart)
+
+    def make_players(randomized_scores):
+        return [
+            {
+                "nickname": nickname,
+                "score": score,  # Keep original score for display
+                "randomized_score": float(randomized_score)
+                if randomness > 0
+                else score,  # Use randomized score for balancing
+            }
+            for nickname, score, randomized_score in zip(
+                nicknames, scores, randomized_scores
+            )
+        ]
 
-    for username, score in user_scores.items():
-        # Create a copy of the original score for balancing
-        original_score = score
+    budget_ms = HEURISTIC_MAX_MS if max_ms is None else max_ms
+    search = {"engine": "multi_team", "cache_hit": False, "examined": None}
+    start = time.perf_counter()
+    with traced_peak() if trace_memory else nullcontext({}) as memory:
+        if teams != 2:
+            result = balance_multiple_teams(
+                make_players(draws[0]), draws[0], teams, budget_ms, rng
+            )
+        else:
+            result = balance_draws(
+                make_players,
+                draws,
+                randomness,
+                max_ms,
+                budget_ms,
+                rng,
+                constraints,
+                search,
+                ratings,
+                prefer_even_odds,
+            )
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if not diagnostics:
+        return result
+
+    result["diagnostics"] = {
+        "players": len(nicknames),
+        "engine": search["engine"],
+        "elapsed_ms": elapsed_ms,
+        "peak_bytes": memory.get("peak_bytes"),
+        "subsets_examined": search["examined"],
+        "cache_hit": search["cache_hit"],
+        "min_diff": result["diff"],
+        "solution_count": result.get("solution_count"),
+    }
+    return result
+
+
+def balance_multiple_teams(players, nums, teams, budget_ms, rng):
+    """balance_teams for more than two teams, on one vector of scores."""
+    diff, assignment, optimal = multi_team_balancer.search(
+        nums, teams, budget_ms, rng=rng
+    )
+    team_lists = [[] for _ in range(teams)]
+    for team, player in zip(assignment, players):
+        team_lists[team].append(player)
+    for team_list in team_lists:
+        team_list.sort(key=lambda x: x["score"], reverse=True)
+    return {"teams": team_lists, "diff": float(diff), "optimal": optimal}
+
+
+def balance_draws(
+    make_players,
+    draws,
+    randomness,
+    max_ms,
+    budget_ms,
+    rng,
+    constraints,
+    search,
+    ratings=None,
+    prefer_even_odds=False,
+):
+    """
+    balance_teams for two teams: balance every vector of scores in draws and
+    return the most frequent split, listing all of them as 'options' when there
+    are several draws.
 
-        # Apply randomness if specified (value between 0-100)
-        if randomness > 0:
-            # Calculate the maximum random adjustment based on the randomness parameter
-            # Higher randomness = larger potential adjustment
-            max_adjustment = original_score * (randomness / 100)
+    Args:
+        search (dict): Receives the engine used and the half-masks it examined,
+                       summed over the draws
+    """
+    results = {}
+    frequencies = {}
+    examined = []
+    for nums in draws:
+        stats = {}
+        solution, result = balance_two_teams(
+            make_players(nums),
+            nums,
+            randomness,
+            max_ms,
+            budget_ms,
+            rng,
+            constraints,
+            stats,
+            ratings,
+            prefer_even_odds,
+        )
+        search["engine"] = stats["engine"]
+        search["cache_hit"] = stats.get("cache_hit", False)
+        examined.append(stats.get("examined"))
+        # Team sides are drawn at random, so key options by the side of the
+        # first player
+        key = (solution if solution[0] else ~solution).tobytes()
+        results.setdefault(key, result)
+        frequencies[key] = frequencies.get(key, 0) + 1
+    if None not in examined:
+        search["examined"] = sum(examined)
+
+    ranked = sorted(frequencies, key=frequencies.get, reverse=True)
+    result = results[ranked[0]]
+    if len(draws) > 1:
+        result["options"] = [
+            {
+                "teamA": results[key]["teamA"],
+                "teamB": results[key]["teamB"],
+                "score_diff": abs(
+                    sum(player["score"] for player in results[key]["teamA"])
+                    - sum(player["score"] for player in results[key]["teamB"])
+                ),
+                "frequency": frequencies[key],
+            }
+            for key in ranked
+        ]
+        if ratings is not None:
+            for option, key in zip(result["options"], ranked):
+                option["win_probability"] = results[key]["win_probability"]
+    return result
 
-            # Generate a random adjustment between -max_adjustment and +max_adjustment
-            random_adjustment = random.uniform(-max_adjustment, max_adjustment)
 
-            # Apply the random adjustment to create a randomized score for balancing
-            randomized_score = original_score + random_adjustment
+def make_constraints(nicknames, pins=None, together=(), apart=()):
+    """
+    SplitConstraints over the positions of nicknames from balance_teams style
+    pins, together and apart arguments.
 
-            # Ensure score doesn't go below 0
-            randomized_score = max(0, randomized_score)
-        else:
-            # No randomness, use original score
-            randomized_score = original_score
+    Raises:
+        ValueError: When the constraints contradict each other
+    """
+    index = {nickname: i for i, nickname in enumerate(nicknames)}
+    return SplitConstraints(
+        len(nicknames),
+        {index[nickname]: side == "A" for nickname, side in (pins or {}).items()},
+        [[index[nickname] for nickname in group] for group in together],
+        [(index[a], index[b]) for a, b in apart],
+    )
+
+
+def balance_two_teams(
+    players,
+    nums,
+    randomness,
+    max_ms,
+    budget_ms,
+    rng,
+    constraints=None,
+    stats=None,
+    ratings=None,
+    prefer_even_odds=False,
+):
+    """
+    Split players into two teams on one vector of (randomized) scores.
 
-        players.append(
-            {
-                "nickname": username,
-                "score": original_score,  # Keep original score for display
-                "randomized_score": randomized_score,  # Use randomized score for balancing
-            }
+    Args:
+        stats (dict): Optional, receives the 'engine' used and, from the exact
+                      engines, 'cache_hit' and 'examined' (see sample_cached)
+        ratings (list): Optional player ratings, see balance_teams
+        prefer_even_odds (bool): See balance_teams
+
+    Returns:
+        tuple: (solution, result) with the boolean team A mask and the
+               balance_teams result for it
+    """
+    stats = {} if stats is None else stats
+    # Compare a batch of equally balanced splits by their odds, or draw one
+    size = EVEN_ODDS_CANDIDATES if prefer_even_odds else None
+    if constraints is not None:
+        # Only the meet-in-the-middle search folds constraints into its items
+        stats["engine"] = "meet_in_the_middle"
+        diff, solution, solution_count, optimal = balancer.sample_solution(
+            nums,
+            rng=rng,
+            max_ms=max_ms,
+            constraints=constraints,
+            stats=stats,
+            size=size,
+        )
+    elif randomness == 0 and rank_balancer.supports(nums):
+        # Unrandomized scores sit on the small SCORES ladder, where the
+        # rank-count DP is exact and far cheaper than enumerating subsets.
+        # Scores off the ladder or too spread for its table fall through.
+        stats["engine"] = "rank_dp"
+        diff, solution, solution_count, optimal = rank_balancer.sample_solution(
+            nums, rng=rng, stats=stats, size=size
+        )
+    elif len(nums) <= 2 * balancer.max_team_size:
+        stats["engine"] = "meet_in_the_middle"
+        diff, solution, solution_count, optimal = balancer.sample_solution(
+            nums, rng=rng, max_ms=max_ms, stats=stats, size=size
         )
+    else:
+        stats["engine"] = "heuristic"
+        diff, solutions, optimal = heuristic_balancer.search(nums, budget_ms, rng=rng)
+        solution, solution_count = solutions[:1] if size else solutions[0], None
+    if size:
+        # Evaluated over every candidate at once
+        odds = win_probability(solution, ratings)
+        solution = solution[np.argmin(np.abs(odds - 0.5))]
+
+    # The engines return each split once with a fixed player always in team
+    # A, so pick the side at random unless players are pinned to a side
+    pinned = constraints is not None and constraints.pinned.any()
+    if not pinned and rng.random() < 0.5:
+        solution = ~solution
+    team_a = [player for team, player in zip(solution, players) if team]
+    team_b = [player for team, player in zip(solution, players) if not team]
+
+    team_a.sort(key=lambda x: x["score"], reverse=True)
+    team_b.sort(key=lambda x: x["score"], reverse=True)
+    # Engines may report the gap in quantum steps; the scores are the truth
+    diff = abs(nums[solution].sum() - nums[~solution].sum())
+    result = {
+        "teamA": team_a,
+        "teamB": team_b,
+        "diff": float(diff),
+        "optimal": optimal,
+        "solution_count": solution_count,
+    }
+    if ratings is not None:
+        result["win_probability"] = float(win_probability(solution, ratings))
+    return solution, result
+
+
+def full_split(nums):
+    """
+    Best split of nums from scratch for rebalance_teams: the rank-count DP
+    when it supports the scores, the meet-in-the-middle search up to its size
+    limit and the heuristic beyond it.
+
+    Returns:
+        tuple: (min_diff, solution, optimal)
+    """
+    if rank_balancer.supports(nums):
+        min_diff, solution, _, optimal = rank_balancer.sample_solution(nums)
+    elif len(nums) <= 2 * balancer.max_team_size:
+        min_diff, solution, _, optimal = balancer.sample_solution(nums)
+    else:
+        min_diff, solutions, optimal = heuristic_balancer.search(nums, HEURISTIC_MAX_MS)
+        solution = solutions[0]
+    return min_diff, solution, optimal
+
+
+def rebalance_teams(
+    team_a_scores, team_b_scores, added=None, removed=(), max_swaps=2, tolerance=0
+):
+    """
+    Rebalance two existing teams after players joined or left, keeping as many
+    players on their side as possible.
 
-    _, solutions = balancer.find_solutions([p["randomized_score"] for p in players])
+    Joining players go to the smaller team, players move across only while team
+    sizes differ, and then the fewest swaps that bring the gap within tolerance
+    of the optimum are searched. The full engine's split is used only when no
+    such swap sequence exists.
 
-    solution = random.choice(solutions)
+    Args:
+        team_a_scores (dict): Current team A, mapping usernames to scores
+        team_b_scores (dict): Current team B, mapping usernames to scores
+        added (dict): Joining players, mapping usernames to scores
+        removed (list): Usernames of leaving players
+        max_swaps (int): Most swaps to try before rebalancing from scratch,
+                         lowered until a swap count compares at most
+                         MAX_SWAP_PAIRS pairs of player subsets
+        tolerance (float): Accepted gap above the optimal one
+
+    Returns:
+        dict: 'teamA', 'teamB', 'diff' and 'optimal' like balance_teams, plus
+              'swaps' (players exchanged), 'moved' (usernames that changed
+              side) and 'full_rebalance' (whether the full engine's split was used)
+    """
+    removed = set(removed)
+    team_a = {
+        name: score for name, score in team_a_scores.items() if name not in removed
+    }
+    team_b = {
+        name: score for name, score in team_b_scores.items() if name not in removed
+    }
+    previous_side = {name: True for name in team_a} | {name: False for name in team_b}
+
+    # Seat joining players, strongest first, on the smaller or weaker team
+    for name, score in sorted((added or {}).items(), key=lambda x: -x[1]):
+        smaller_a = (len(team_a), sum(team_a.values())) <= (
+            len(team_b),
+            sum(team_b.values()),
+        )
+        (team_a if smaller_a else team_b)[name] = score
+
+    nicknames = list(team_a) + list(team_b)
+    nums = np.array([team_a.get(name, team_b.get(name)) for name in nicknames], float)
+    assert len(nums) > 1, "Number of players must be greater than 2"
+    assert len(nums) % 2 == 0, "Number of players must be even"
+    solution = np.arange(len(nums)) < len(team_a)
+
+    # Removals can leave the sizes apart: move the players that best close the gap
+    while solution.sum() != len(nums) // 2:
+        larger = solution if solution.sum() > len(nums) // 2 else ~solution
+        candidates = np.flatnonzero(larger)
+        diff = nums[solution].sum() - nums[~solution].sum()
+        sign = 1 if larger is solution else -1
+        mover = candidates[np.argmin(np.abs(sign * diff - 2 * nums[candidates]))]
+        solution[mover] = not solution[mover]
+
+    # Every swap count compares all pairs of equally sized subsets of the two
+    # teams, so large lobbies get fewer swaps
+    team_len = len(nums) // 2
+    while max_swaps > 0 and comb(team_len, max_swaps) ** 2 > MAX_SWAP_PAIRS:
+        max_swaps -= 1
+
+    # No split beats the parity bound of the total, so reaching it needs no
+    # search. Only when no cheap swap does is the exact optimum computed.
+    scaled, quantum = quantize(nums, score_quantum)
+    lower_bound = 0 if quantum is None else (int(scaled.sum()) % 2) * quantum
+    found = min_swap_split(nums, solution, lower_bound, max_swaps, score_quantum)
+    optimal, full_rebalance = True, False
+    if found is None:
+        min_diff, full_solution, exact = full_split(nums)
+        found = min_swap_split(
+            nums, solution, min_diff + tolerance, max_swaps, score_quantum
+        )
+        if found is not None:
+            optimal = exact and found[1] <= min_diff + 1e-9
+        else:
+            optimal = exact
+            # Keep the orientation that leaves the most players on their side
+            if (full_solution == solution).sum() < len(nums) / 2:
+                full_solution = ~full_solution
+            swaps = int((full_solution & ~solution).sum())
+            found = (swaps, min_diff, full_solution)
+            full_rebalance = True
+
+    swaps, diff, solution = found
+    scores = team_a | team_b
+    players = [{"nickname": name, "score": scores[name]} for name in nicknames]
     team_a = [player for team, player in zip(solution, players) if team]
     team_b = [player for team, player in zip(solution, players) if not team]
-
     team_a.sort(key=lambda x: x["score"], reverse=True)
     team_b.sort(key=lambda x: x["score"], reverse=True)
-    return {"teamA": team_a, "teamB": team_b}
+    return {
+        "teamA": team_a,
+        "teamB": team_b,
+        "diff": float(diff),
+        "optimal": bool(optimal),
+        "swaps": swaps,
+        "moved": [
+            name
+            for name, side in zip(nicknames, solution)
+            if name in previous_side and previous_side[name] != side
+        ],
+        "full_rebalance": full_rebalance,
+    }
 
 
 @app.route("/")
@@ -190,63 +638,513 @@ def get_users():
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
 
 
+def balance_lobbies(params):
+    """
+    Run balance_teams over several lobbies.
+
+    Args:
+        params (list): balance_teams keyword arguments per lobby
+
+    Returns:
+        list: A balance_teams result per lobby, or {'error': '...'} for a lobby
+              that cannot be balanced
+    """
+    results = []
+    for lobby in params:
+        try:
+            results.append(balance_teams(**lobby))
+        except AssertionError as e:
+            results.append({"error": f"An error occurred: {str(e)}"})
+    return results
+
+
+def parse_balance_request(data):
+    """
+    Validate the body of a balance request.
+
+    Args:
+        data (dict): Request body with 'users' and optional 'randomness', 'teams',
+                     'max_ms', 'options', 'seed', 'diagnostics' and the
+                     constraints 'pins', 'together' and 'apart'
+
+    Returns:
+        dict: Keyword arguments for balance_teams
+
+    Raises:
+        ValueError: With a message for the client when the body is invalid
+    """
+    if not isinstance(data, dict) or "users" not in data:
+        raise ValueError("Invalid request. Please provide a users object with scores.")
+
+    user_scores = data["users"]
+
+    # Validate that user_scores is a dictionary
+    if not isinstance(user_scores, dict):
+        raise ValueError(
+            "Invalid format. 'users' should be an object mapping usernames to scores."
+        )
+
+    # Get randomness parameter if provided, otherwise use default
+    randomness = DEFAULT_RANDOMNESS
+    if "randomness" in data:
+        try:
+            randomness = int(data["randomness"])
+        except (ValueError, TypeError):
+            raise ValueError("Randomness must be a valid integer between 0 and 100.")
+        # Ensure randomness is within valid range (0-100)
+        if randomness < 0 or randomness > 100:
+            raise ValueError("Randomness must be a value between 0 and 100.")
+
+    # Get number of teams if provided, otherwise use default
+    teams = DEFAULT_TEAMS
+    if "teams" in data:
+        try:
+            teams = int(data["teams"])
+        except (ValueError, TypeError):
+            raise ValueError(
+                f"Teams must be a valid integer between 2 and {MAX_TEAMS}."
+            )
+        if teams < 2 or teams > MAX_TEAMS:
+            raise ValueError(f"Teams must be a value between 2 and {MAX_TEAMS}.")
+
+    # Get the search time budget if provided
+    max_ms = None
+    if "max_ms" in data:
+        try:
+            max_ms = int(data["max_ms"])
+        except (ValueError, TypeError):
+            raise ValueError("max_ms must be a valid integer.")
+        if max_ms < 1 or max_ms > BALANCE_DEADLINE_MS:
+            raise ValueError(
+                f"max_ms must be a value between 1 and {BALANCE_DEADLINE_MS}."
+            )
+
+    # Get the number of randomized options if provided
+    options = 1
+    if "options" in data:
+        try:
+            options = int(data["options"])
+        except (ValueError, TypeError):
+            raise ValueError(
+                f"Options must be a valid integer between 1 and {MAX_OPTIONS}."
+            )
+        if options < 1 or options > MAX_OPTIONS:
+            raise ValueError(f"Options must be a value between 1 and {MAX_OPTIONS}.")
+        if options > 1 and teams != 2:
+            raise ValueError("Options are only supported for two teams.")
+
+    # Get the seed if provided
+    seed = None
+    if data.get("seed") is not None:
+        try:
+            seed = int(data["seed"])
+        except (ValueError, TypeError):
+            raise ValueError("Seed must be a valid integer.")
+        if seed < 0:
+            raise ValueError("Seed must be a non-negative integer.")
+
+    params = {
+        "user_scores": user_scores,
+        "randomness": randomness,
+        "teams": teams,
+        "max_ms": max_ms,
+        "options": options,
+        "seed": seed,
+    }
+    # Get the diagnostics flag if provided. Diagnostics are collected for the
+    # latency histogram either way; the flag returns them with the allocation
+    # peak, whose tracing slows the search down.
+    trace_memory = data.get("diagnostics", False)
+    if not isinstance(trace_memory, bool):
+        raise ValueError("Diagnostics must be true or false.")
+    params["diagnostics"] = True
+    params["trace_memory"] = trace_memory
+
+    # Get the even odds flag if provided
+    prefer_even_odds = data.get("prefer_even_odds", False)
+    if not isinstance(prefer_even_odds, bool):
+        raise ValueError("prefer_even_odds must be true or false.")
+    if prefer_even_odds and teams != 2:
+        raise ValueError("prefer_even_odds is only supported for two teams.")
+    params["prefer_even_odds"] = prefer_even_odds
+
+    params.update(parse_constraints(data, user_scores, teams))
+    return params
+
+
+def parse_constraints(data, user_scores, teams):
+    """
+    Validate the optional 'pins', 'together' and 'apart' fields of a balance
+    request.
+
+    Returns:
+        dict: The constraint keyword arguments for balance_teams that were given
+
+    Raises:
+        ValueError: With a message for the client when the constraints are
+                    invalid or contradict each other
+    """
+    constraints = {}
+    if data.get("pins"):
+        pins = data["pins"]
+        if not isinstance(pins, dict) or any(
+            side not in ("A", "B") for side in pins.values()
+        ):
+            raise ValueError("Pins must map usernames to 'A' or 'B'.")
+        constraints["pins"] = pins
+    for field, size in (("together", None), ("apart", 2)):
+        if not data.get(field):
+            continue
+        groups = data[field]
+        if not isinstance(groups, list) or any(
+            not isinstance(group, list) or len(group) < 2 for group in groups
+        ):
+            raise ValueError(f"'{field}' must be a list of lists of usernames.")
+        if size is not None and any(len(group) != size for group in groups):
+            raise ValueError(f"Every '{field}' entry must name {size} usernames.")
+        constraints[field] = groups
+
+    if not constraints:
+        return constraints
+    if teams != 2:
+        raise ValueError("Constraints are only supported for two teams.")
+    named = list(constraints.get("pins", {}))
+    for field in ("together", "apart"):
+        named.extend(name for group in constraints.get(field, []) for name in group)
+    unknown = [name for name in named if name not in user_scores]
+    if unknown:
+        raise ValueError(f"Constrained users are not in the lobby: {unknown}")
+    # Catches contradictions now rather than as a failed balance
+    make_constraints(list(user_scores), **constraints)
+    return constraints
+
+
+def parse_deadline(data):
+    """
+    Seconds a balance request may take, from the optional 'deadline_ms' field.
+
+    Raises:
+        ValueError: With a message for the client when the field is invalid
+    """
+    deadline_ms = BALANCE_DEADLINE_MS
+    if isinstance(data, dict) and "deadline_ms" in data:
+        try:
+            deadline_ms = int(data["deadline_ms"])
+        except (ValueError, TypeError):
+            raise ValueError("deadline_ms must be a valid integer.")
+        if deadline_ms < 1 or deadline_ms > BALANCE_DEADLINE_MS:
+            raise ValueError(
+                f"deadline_ms must be a value between 1 and {BALANCE_DEADLINE_MS}."
+            )
+    return deadline_ms / 1000
+
+
+def balance_unavailable(e):
+    """503 response for a full balance queue or 504 for a missed deadline."""
+    if isinstance(e, QueueFullError):
+        response = jsonify({"error": "The balancer is busy, please retry."})
+        response.headers["Retry-After"] = str(BALANCE_RETRY_AFTER_SECONDS)
+        return response, 503
+    return jsonify({"error": "Balancing did not finish within the deadline."}), 504
+
+
+def record_diagnostics(balanced_teams, params):
+    """
+    Add a balance to the latency histogram and drop its diagnostics from the
+    response unless the client asked for them.
+    """
+    if params["trace_memory"]:
+        diagnostics = balanced_teams["diagnostics"]
+    else:
+        diagnostics = balanced_teams.pop("diagnostics")
+    balance_histogram.record(diagnostics["players"], diagnostics)
+    return balanced_teams
+
+
+def add_ratings(params, map_ids):
+    """Give balance_teams the win predictor ratings of a two-team lobby."""
+    if params["teams"] == 2:
+        player_ids = [map_ids[nickname] for nickname in params["user_scores"]]
+        params["ratings"] = win_predictor.ratings(player_ids).tolist()
+    return params
+
+
+def assign_player_ids(balanced_teams, map_ids):
+    """Add the database id of every player in a balance_teams result."""
+    team_lists = balanced_teams.get("teams") or [
+        balanced_teams["teamA"],
+        balanced_teams["teamB"],
+    ]
+    for option in balanced_teams.get("options", []):
+        team_lists.extend([option["teamA"], option["teamB"]])
+    for team in team_lists:
+        for player in team:
+            player["id"] = map_ids[player["nickname"]]
+    return balanced_teams
+
+
 @app.route("/api/balance", methods=["POST"])
 def balance():
     """
-    Endpoint to balance players into two teams based on their scores.
+    Endpoint to balance players into two or more teams based on their scores.
 
     Expected request body: {
         'users': {'user1': 3, 'user2': 2, ...},
-        'randomness': 50  # Optional, value between 0-100
+        'randomness': 50,  # Optional, value between 0-100
+        'teams': 3,  # Optional, number of teams (default 2)
+        'max_ms': 50,  # Optional, search time budget in milliseconds
+        'pins': {'user1': 'A'},  # Optional, users locked to a team
+        'together': [['user2', 'user3']],  # Optional, groups kept on one team
+        'apart': [['user1', 'user4']],  # Optional, pairs kept on opposite teams
+        'diagnostics': true,  # Optional, add search cost to the response
+        'prefer_even_odds': true  # Optional, break ties toward a 50% win chance
     }
-    Returns: {'teamA': [...], 'teamB': [...]}
+    Returns: {'teamA': [...], 'teamB': [...], 'diff': 0.5, 'optimal': True/False,
+              'solution_count': 12, 'win_probability': 0.52} for two teams,
+             {'teams': [[...], [...], ...], 'diff': 0.5, 'optimal': True/False}
+             otherwise, plus 'diagnostics' (see balance_teams) when requested
     """
     try:
         data = request.get_json()
+        try:
+            params = parse_balance_request(data)
+            timeout = parse_deadline(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        map_ids = db.get_or_create_player_ids(list(params["user_scores"]))
+        win_predictor.refresh(db)
+        add_ratings(params, map_ids)
+
+        try:
+            balanced_teams = balance_executor.run(
+                balance_teams, timeout=timeout, **params
+            )
+        except (QueueFullError, DeadlineExceededError) as e:
+            return balance_unavailable(e)
+        record_diagnostics(balanced_teams, params)
+
+        return jsonify(assign_player_ids(balanced_teams, map_ids))
 
-        if not data or "users" not in data:
+    except Exception as e:
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+
+
+@app.route("/api/balance/batch", methods=["POST"])
+def balance_batch():
+    """
+    Endpoint to balance many lobbies in one request.
+
+    Expected request body: {
+        'lobbies': [
+            {'users': {'user1': 3, ...}, 'randomness': 50, 'teams': 2},
+            ...
+        ]
+    }
+    Returns: {'results': [...]} with one /api/balance response per lobby, in
+             request order. A lobby that cannot be balanced (e.g. an odd number
+             of players) gets {'error': '...'} without failing the others.
+    """
+    try:
+        data = request.get_json()
+        lobbies = data.get("lobbies") if isinstance(data, dict) else None
+        if not isinstance(lobbies, list) or not lobbies:
             return jsonify(
-                {"error": "Invalid request. Please provide a users object with scores."}
+                {"error": "Invalid request. Please provide a list of lobbies."}
             ), 400
+        if len(lobbies) > MAX_BATCH_LOBBIES:
+            return jsonify(
+                {"error": f"A batch can hold at most {MAX_BATCH_LOBBIES} lobbies."}
+            ), 400
+
+        params = []
+        for index, lobby in enumerate(lobbies):
+            try:
+                params.append(parse_balance_request(lobby))
+            except ValueError as e:
+                return jsonify({"error": f"Lobby {index}: {e}"}), 400
+        try:
+            deadline = time.monotonic() + parse_deadline(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # One transaction resolves the players of every lobby
+        map_ids = db.get_or_create_player_ids(
+            [nickname for lobby in params for nickname in lobby["user_scores"]]
+        )
+        win_predictor.refresh(db)
+        for lobby in params:
+            add_ratings(lobby, map_ids)
+
+        # Lobbies are dealt round-robin into one task per executor worker, so
+        # a batch runs in parallel without taking more than its share of the
+        # queue. Inline, the single task reuses this thread's buffers.
+        chunks = min(balance_executor.max_workers, len(params))
+        futures = []
+        try:
+            for chunk in range(chunks):
+                futures.append(
+                    balance_executor.submit(balance_lobbies, params[chunk::chunks])
+                )
+            chunk_results = [
+                wait_for(future, max(0, deadline - time.monotonic()))
+                for future in futures
+            ]
+        except (QueueFullError, DeadlineExceededError) as e:
+            for future in futures:
+                future.cancel()
+            return balance_unavailable(e)
+
+        results = [
+            chunk_results[index % chunks][index // chunks]
+            for index in range(len(params))
+        ]
+        for balanced_teams, lobby in zip(results, params):
+            if "error" not in balanced_teams:
+                record_diagnostics(balanced_teams, lobby)
+                assign_player_ids(balanced_teams, map_ids)
+        return jsonify({"results": results})
+
+    except Exception as e:
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+
+
+def is_score(score):
+    """Whether a score from a request body is a finite number (not a bool)."""
+    return (
+        isinstance(score, (int, float))
+        and not isinstance(score, bool)
+        and isfinite(score)
+    )
 
-        user_scores = data["users"]
 
-        # Validate that user_scores is a dictionary
-        if not isinstance(user_scores, dict):
+@app.route("/api/balance/rebalance", methods=["POST"])
+def rebalance():
+    """
+    Endpoint to rebalance existing teams after players joined or left.
+
+    Expected request body: {
+        'teamA': {'user1': 3, 'user2': 2, ...},
+        'teamB': {'user3': 3, 'user4': 2, ...},
+        'added': {'user5': 4},  # Optional, joining players with their scores
+        'removed': ['user2'],  # Optional, leaving players
+        'max_swaps': 2,  # Optional, swaps to try before rebalancing from scratch
+        'tolerance': 0.5  # Optional, accepted gap above the optimal one
+    }
+    Returns: {'teamA': [...], 'teamB': [...], 'diff': 0.5, 'optimal': True/False,
+              'swaps': 1, 'moved': ['user1', 'user4'], 'full_rebalance': False}
+    """
+    try:
+        data = request.get_json()
+        if (
+            not isinstance(data, dict)
+            or not isinstance(data.get("teamA"), dict)
+            or not isinstance(data.get("teamB"), dict)
+        ):
             return jsonify(
                 {
-                    "error": "Invalid format. 'users' should be an object mapping usernames to scores."
+                    "error": "Invalid request. Please provide teamA and teamB objects mapping usernames to scores."
                 }
             ), 400
 
-        # Get randomness parameter if provided, otherwise use default
-        randomness = DEFAULT_RANDOMNESS
-        if "randomness" in data:
-            try:
-                randomness = int(data["randomness"])
-                # Ensure randomness is within valid range (0-100)
-                if randomness < 0 or randomness > 100:
-                    return jsonify(
-                        {"error": "Randomness must be a value between 0 and 100."}
-                    ), 400
-            except (ValueError, TypeError):
+        added = data.get("added", {})
+        removed = data.get("removed", [])
+        if (
+            not isinstance(added, dict)
+            or not isinstance(removed, list)
+            or not all(isinstance(name, str) for name in removed)
+        ):
+            return jsonify(
+                {
+                    "error": "Invalid format. 'added' should map usernames to scores and 'removed' should list usernames."
+                }
+            ), 400
+        for field, scores in (
+            ("teamA", data["teamA"]),
+            ("teamB", data["teamB"]),
+            ("added", added),
+        ):
+            if not all(is_score(score) for score in scores.values()):
                 return jsonify(
-                    {"error": "Randomness must be a valid integer between 0 and 100."}
+                    {"error": f"Every score in '{field}' must be a finite number."}
                 ), 400
+        staying = (data["teamA"].keys() | data["teamB"].keys()) - set(removed)
+        if data["teamA"].keys() & data["teamB"].keys() or staying & added.keys():
+            return jsonify(
+                {
+                    "error": "Players cannot be on both teams or join a team they are already on."
+                }
+            ), 400
+        lobby = staying | added.keys()
+        if len(lobby) > MAX_PLAYERS:
+            return jsonify(
+                {"error": f"Lobbies can have at most {MAX_PLAYERS} players."}
+            ), 400
+        if len(lobby) < 2 or len(lobby) % 2:
+            return jsonify(
+                {
+                    "error": "The rebalanced lobby must have an even number of players, at least 2."
+                }
+            ), 400
 
-        balanced_teams = balance_teams(user_scores, randomness)
-        map_ids = db.get_or_create_player_ids(list(user_scores.keys()))
+        try:
+            max_swaps = int(data.get("max_swaps", DEFAULT_MAX_SWAPS))
+            tolerance = float(data.get("tolerance", 0))
+        except (ValueError, TypeError):
+            return jsonify(
+                {"error": "max_swaps must be an integer and tolerance a number."}
+            ), 400
+        if max_swaps < 0 or max_swaps > MAX_SWAPS or tolerance < 0:
+            return jsonify(
+                {
+                    "error": f"max_swaps must be between 0 and {MAX_SWAPS} and tolerance non-negative."
+                }
+            ), 400
 
-        for team in ["teamA", "teamB"]:
-            for player in balanced_teams[team]:
-                player["id"] = map_ids[player["nickname"]]
+        rebalanced = rebalance_teams(
+            data["teamA"], data["teamB"], added, removed, max_swaps, tolerance
+        )
+        map_ids = db.get_or_create_player_ids(
+            [player["nickname"] for player in rebalanced["teamA"] + rebalanced["teamB"]]
+        )
 
-        return jsonify(balanced_teams)
+        return jsonify(assign_player_ids(rebalanced, map_ids))
 
     except Exception as e:
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
 
 
+@app.route("/api/balance/cache", methods=["GET"])
+def balance_cache_stats():
+    """
+    Endpoint to monitor the balance result cache of this worker.
+
+    Only available with the inline executor: with BALANCE_EXECUTOR=process the
+    searches run, and are cached, in the executor processes, so this worker's
+    cache stays empty and the endpoint answers 404.
+
+    Returns: {'entries': 12, 'max_entries': 1024, 'ttl': 3600.0, 'hits': 40, 'misses': 12}
+    """
+    if not isinstance(balance_executor, InlineExecutor):
+        return jsonify(
+            {"error": "The balance cache lives in the executor processes"}
+        ), 404
+    return jsonify(balance_cache.stats())
+
+
+@app.route("/api/balance/metrics", methods=["GET"])
+def balance_metrics():
+    """
+    Endpoint to monitor balancing cost over the recent balances of this worker.
+
+    Returns: {'10': {'count': 40, 'p50_ms': 1.2, 'p90_ms': 2.5, 'p99_ms': 4.0,
+              'max_ms': 4.1, 'buckets': {'1': 12, '2': 20, ..., 'inf': 0},
+              'engines': {'rank_dp': 40}, 'mean_subsets_examined': None}, ...}
+              keyed by lobby size
+    """
+    return jsonify(balance_histogram.snapshot())
+
+
 @app.route("/api/submit_game", methods=["POST"])
 def submit_game():
     """
@@ -318,7 +1216,10 @@ def submit_game():
             game_name=data["gameName"],
             wins=all_wins,
             admin_passcode=data["adminPasscode"],
+            winner=data["winningTeam"],
         )
+        # Fold the new game into the win probabilities right away
+        win_predictor.refresh(db)
 
         return jsonify(
             {"count": events_added, "message": "Game results recorded successfully"}
@@ -1,59 +1,1413 @@
-import bisect
+from collections import OrderedDict
+import heapq
+from itertools import combinations
+from math import comb
+import logging
+import os
+from pathlib import Path
+import threading
+import time
 import numpy as np
-import itertools
 
 
 MAX_TEAM_SIZE = 15
+MULTI_TEAM_EXACT_MAX_PLAYERS = 16
+DEFAULT_CACHE_ENTRIES = 1024
+DEFAULT_CACHE_TTL = 3600  # seconds
+RANK_DP_MAX_CELLS = 4_000_000  # float64 DP states, 32 MiB
 
+logger = logging.getLogger(__name__)
 
-def generate_bitmasks(n):
-    masks = np.array(list(itertools.product([False, True], repeat=n)), dtype=np.bool)
-    return np.flip(masks, axis=1)
+
+def default_tables_dir():
+    """
+    BALANCER_TABLES_DIR if set, otherwise a directory next to the database,
+    falling back to the user's cache directory when DB_PATH is not set.
+    """
+    if os.getenv("BALANCER_TABLES_DIR"):
+        return Path(os.getenv("BALANCER_TABLES_DIR"))
+    if os.getenv("DB_PATH"):
+        return Path(os.getenv("DB_PATH")).resolve().parent / "balancer"
+    return Path.home() / ".cache" / "balancer"
+
+
+TABLES_DIR = default_tables_dir()
 
 
 def get_mask(mask, n):
     return [bool((mask >> i) & 1) for i in range(n)]
 
 
+def get_score_quantum(scores, max_decimals=4):
+    """
+    Largest power-of-ten step (1, 0.1, 0.01, ...) that every score in the
+    ladder is a multiple of, e.g. 0.1 for [-1, 0, 1, 1.5, 2.7].
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    for decimals in range(max_decimals + 1):
+        scaled = scores * 10**decimals
+        if np.allclose(scaled, np.rint(scaled), rtol=0, atol=1e-6):
+            return 10.0**-decimals
+    return 10.0**-max_decimals
+
+
+def quantize(nums, quantum):
+    """
+    Scores as int32 multiples of the quantum when every score is one and the
+    sums fit, otherwise as float64, so off-ladder and randomized scores are
+    never rounded.
+
+    Returns:
+        tuple: (values, quantum) where quantum is None for float64 values
+    """
+    nums = np.asarray(nums, dtype=np.float64)
+    if quantum is None:
+        return nums, None
+
+    scaled = np.rint(nums / quantum)
+    exact = np.allclose(scaled * quantum, nums, rtol=0, atol=1e-6 * quantum)
+    # Half sums range over +/- the total, their differences over twice that
+    if not exact or np.abs(scaled).sum() > np.iinfo(np.int32).max // 2:
+        return nums, None
+    return scaled.astype(np.int32), quantum
+
+
+def randomize_scores(scores, randomness, draws=1, rng=None):
+    """
+    Draw randomized copies of the scores in one vectorized operation. Every
+    score moves uniformly within +/- randomness% of itself, floored at 0.
+
+    Args:
+        scores (list): Player scores
+        randomness (int): Value between 0-100, 0 returns the scores unchanged
+        draws (int): Number of randomized score vectors
+        rng (np.random.Generator): Source of randomness
+
+    Returns:
+        np.ndarray: (draws, len(scores)) randomized scores
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    if randomness == 0:
+        return np.tile(scores, (draws, 1))
+    rng = rng if rng is not None else np.random.default_rng()
+    max_adjustment = np.abs(scores) * (randomness / 100)
+    adjustment = rng.uniform(-1, 1, size=(draws, len(scores))) * max_adjustment
+    return np.maximum(scores + adjustment, 0)
+
+
+def generate_gray_codes(n):
+    """
+    Reflected Gray code over n bits and the popcount of every code.
+
+    Any prefix of length 2^k is the Gray code over k bits, so one table
+    serves every half size up to n.
+    """
+    index = np.arange(1 << n, dtype=np.uint16)
+    codes = index ^ (index >> 1)
+    popcounts = ((codes[:, None] >> np.arange(n, dtype=np.uint16)) & 1).sum(axis=1)
+    return codes, popcounts.astype(np.uint8)
+
+
+def write_tables(path, n):
+    """
+    Store the Gray-code and popcount tables as one packed file: 2^n uint16
+    codes followed by 2^n uint8 popcounts.
+
+    The file is written under a temporary name and renamed into place, so
+    workers racing on first use never read a partial table.
+    """
+    codes, popcounts = generate_gray_codes(n)
+    path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    check_tables_dir(path.parent)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(codes.tobytes())
+        f.write(popcounts.tobytes())
+    os.replace(tmp_path, path)
+
+
+def check_tables_dir(tables_dir):
+    """
+    Refuse a tables directory that another user owns or could write to,
+    since anyone able to swap the files could steer every split.
+    """
+    st = os.stat(tables_dir)
+    if st.st_uid != os.getuid() or st.st_mode & 0o022:
+        raise PermissionError(f"{tables_dir} is writable by other users")
+
+
+def load_tables(n, tables_dir=TABLES_DIR):
+    """
+    Memory-map the tables for n-bit half-masks read-only, generating the
+    file on first use. Every worker maps the same file, so the pages are
+    shared through the OS page cache instead of being rebuilt per process.
+
+    Returns:
+        tuple: (codes, popcounts) arrays of length 2^n
+    """
+    size = 1 << n
+    path = Path(tables_dir) / f"gray_codes_{n}.bin"
+    try:
+        if not path.exists() or path.stat().st_size != 3 * size:
+            write_tables(path, n)
+        check_tables_dir(path.parent)
+        codes = np.memmap(path, dtype=np.uint16, mode="r", shape=(size,))
+        popcounts = np.memmap(
+            path, dtype=np.uint8, mode="r", offset=2 * size, shape=(size,)
+        )
+        return codes, popcounts
+    except OSError as e:
+        logger.warning("Could not map balancer tables at %s: %s", path, e)
+        return generate_gray_codes(n)
+
+
+def gray_code_sums(nums, out):
+    """
+    Fill out[: 2 ** len(nums)] with sum(team A) - sum(team B) for every split,
+    walking the splits in Gray-code order.
+
+    Consecutive entries differ by moving a single player from team B to team A
+    (or back), so each sum costs one addition instead of len(nums).
+    """
+    out[0] = -nums.sum()
+    size = 1
+    for num in nums:
+        # The second half of the reflected code is the first one reversed
+        # with the new bit set, i.e. the new player moved to team A.
+        np.add(out[size - 1 :: -1], 2 * num, out=out[size : 2 * size])
+        size *= 2
+    return out[:size]
+
+
+def unpack_masks(masks, n):
+    """Expand integer half-masks into an (len(masks), n) boolean matrix."""
+    return ((masks[:, None] >> np.arange(n)) & 1).astype(bool)
+
+
+def sort_by_popcount(counts, values):
+    """
+    Order half-masks by (popcount, value).
+
+    Returns:
+        tuple: (order, bounds) where order[bounds[k]:bounds[k + 1]] are the
+               masks with popcount k, sorted by value
+    """
+    order = np.argsort(values)
+    order = order[np.argsort(counts[order], kind="stable")]
+    bounds = np.searchsorted(counts[order], np.arange(counts.max() + 2))
+    return order, bounds
+
+
+def bucket_lower_bound(left_values, right_values):
+    """
+    Lower bound on |left + right| over one popcount bucket, from the value
+    ranges of its sorted halves.
+    """
+    low = left_values[0] + right_values.min()
+    high = left_values[-1] + right_values.max()
+    if low <= 0 <= high:
+        return 0
+    return min(abs(low), abs(high))
+
+
+def bucket_order(left_value, left_bounds, right_value, right_bounds, team_count):
+    """
+    Count buckets of match_halves, most promising first: by increasing lower
+    bound, then the largest buckets, which hold most of the splits near the
+    middle of the value range.
+
+    Returns:
+        list: (lower_bound, right_count) for every pair of non-empty buckets
+              whose team A counts add up to team_count
+    """
+    keys = []
+    for count in range(len(right_bounds) - 1):
+        left_count = team_count - count
+        if not 0 <= left_count < len(left_bounds) - 1:
+            continue
+        lo, hi = left_bounds[left_count], left_bounds[left_count + 1]
+        right = right_value[right_bounds[count] : right_bounds[count + 1]]
+        if hi == lo or len(right) == 0:
+            continue
+        bound = bucket_lower_bound(left_value[lo:hi], right)
+        keys.append((bound, -(hi - lo) * len(right), count))
+    return [(bound, count) for bound, _, count in sorted(keys)]
+
+
+def match_halves(
+    left_count, left_value, right_count, right_value, team_count, tolerance, deadline
+):
+    """
+    Meet-in-the-middle core: pair left and right half-masks whose team A
+    counts add up to team_count, minimizing |left_value + right_value|.
+
+    Both halves are sorted by (count, value) so every count bucket is a
+    contiguous slice: the left one is searched, the right one supplies the
+    search targets in ascending order. Buckets run most promising first and
+    stop once their lower bound exceeds the best difference, or after the
+    bucket that passes the deadline.
+
+    Args:
+        tolerance: Slack under which two differences count as equal
+        deadline (float): Optional time.perf_counter() limit
+
+    Returns:
+        tuple: (min_diff, left_order, right_order, found, windows, optimal) where
+               found are the positions in right_order of the right half-masks
+               reaching min_diff, and left_order[windows[i, run, 0]:
+               windows[i, run, 1]] their partners for each of two runs
+    """
+    left_order, left_bounds = sort_by_popcount(left_count, left_value)
+    right_order, right_bounds = sort_by_popcount(right_count, -right_value)
+    left_value = left_value[left_order]
+    right_value = right_value[right_order]
+
+    unsearched = np.inf if tolerance else np.iinfo(np.int32).max
+    best_diff = np.full(len(right_value), unsearched, dtype=right_value.dtype)
+    min_diff = unsearched
+    optimal = True
+    buckets = bucket_order(
+        left_value, left_bounds, right_value, right_bounds, team_count
+    )
+    assert buckets, "No split satisfies the team sizes"
+    for position, (bound, count) in enumerate(buckets):
+        if bound > min_diff + tolerance:
+            # Buckets come in increasing bound order, none can do better
+            break
+        # The first bucket always runs, so there is a split to return
+        if position and deadline is not None and time.perf_counter() > deadline:
+            optimal = False
+            break
+
+        right = slice(right_bounds[count], right_bounds[count + 1])
+        lo = left_bounds[team_count - count]
+        bucket = left_value[lo : left_bounds[team_count - count + 1]]
+
+        # The best partner for -right_value is one of its two neighbours
+        idx = np.searchsorted(bucket, -right_value[right])
+        below = np.maximum(idx - 1, 0)
+        above = np.minimum(idx, len(bucket) - 1)
+        diff_below = np.abs(bucket[below] + right_value[right])
+        diff_above = np.abs(bucket[above] + right_value[right])
+        best_diff[right] = np.minimum(diff_below, diff_above)
+        min_diff = min(min_diff, best_diff[right].min())
+
+    found = np.flatnonzero(best_diff <= min_diff + tolerance)
+
+    # Partners of a right mask reaching min_diff form at most two runs of
+    # its sorted bucket, around -right_value - min_diff and
+    # -right_value + min_diff. A single run covers both when they meet.
+    windows = np.zeros((len(found), 2, 2), dtype=np.int64)
+    found_bounds = np.searchsorted(found, right_bounds)
+    for _, count in buckets:
+        rows = slice(found_bounds[count], found_bounds[count + 1])
+        lo = left_bounds[team_count - count]
+        bucket = left_value[lo : left_bounds[team_count - count + 1]]
+        target = -right_value[found[rows]]
+        if min_diff <= tolerance:
+            runs = [(target - min_diff, target + min_diff)]
+        else:
+            runs = [(target - min_diff, target - min_diff)]
+            runs.append((target + min_diff, target + min_diff))
+        for run, (low, high) in enumerate(runs):
+            windows[rows, run, 0] = lo + np.searchsorted(bucket, low - tolerance)
+            windows[rows, run, 1] = lo + np.searchsorted(
+                bucket, high + tolerance, side="right"
+            )
+
+    return min_diff, left_order, right_order, found, windows, optimal
+
+
+class SplitConstraints:
+    """
+    Pinned players and must-pair / must-separate links for two teams, folded
+    into independent components that the search moves as blocks.
+
+    Every component has a root; parity[p] is 0 when player p plays on the
+    root's team and 1 otherwise, so a "together" link joins equal parities
+    and an "apart" link opposite ones. A pinned member fixes the side of its
+    whole component.
+    """
+
+    def __init__(self, n, pins=None, together=(), apart=()):
+        """
+        Args:
+            n (int): Number of players
+            pins (dict): Player index -> True for team A, False for team B
+            together (list): Groups of player indices kept on one team
+            apart (list): Pairs of player indices kept on opposite teams
+
+        Raises:
+            ValueError: When the constraints contradict each other or leave no
+                        split into two equal teams
+        """
+        self.n = n
+        parent = list(range(n))
+        parity = [0] * n
+
+        def find(player):
+            path = []
+            while parent[player] != player:
+                path.append(player)
+                player = parent[player]
+            # Compress the path, folding the parities into each link
+            for node in reversed(path):
+                if parent[node] != player:
+                    parity[node] ^= parity[parent[node]]
+                    parent[node] = player
+            return player
+
+        def link(a, b, apart):
+            root_a, root_b = find(a), find(b)
+            relation = parity[a] ^ parity[b] ^ apart
+            if root_a == root_b:
+                if relation:
+                    raise ValueError("Together and apart constraints contradict")
+                return
+            parent[root_b] = root_a
+            parity[root_b] = relation
+
+        for group in together:
+            for a, b in zip(group, group[1:]):
+                link(a, b, 0)
+        for a, b in apart:
+            if a == b:
+                raise ValueError("A player cannot be kept apart from themselves")
+            link(a, b, 1)
+
+        roots = [find(player) for player in range(n)]
+        _, component = np.unique(roots, return_inverse=True)
+        self.component = component.reshape(-1)
+        self.parity = np.array([bool(parity[player]) for player in range(n)])
+        self.components = int(self.component.max()) + 1 if n else 0
+
+        # root_in_a[c] is the side of component c's root, for pinned ones
+        self.pinned = np.zeros(self.components, dtype=bool)
+        self.root_in_a = np.zeros(self.components, dtype=bool)
+        for player, in_a in (pins or {}).items():
+            c = self.component[player]
+            root_in_a = bool(in_a) != self.parity[player]
+            if self.pinned[c] and self.root_in_a[c] != root_in_a:
+                raise ValueError("Pins contradict the together and apart constraints")
+            self.pinned[c] = True
+            self.root_in_a[c] = root_in_a
+
+        if n % 2 == 0 and not self.team_len_reachable(n // 2):
+            raise ValueError("Constraints leave no split into equal teams")
+
+    def component_sizes(self):
+        """(root side, other side) member counts of every component."""
+        other = np.bincount(self.component[self.parity], minlength=self.components)
+        root = np.bincount(self.component, minlength=self.components) - other
+        return root, other
+
+    def team_len_reachable(self, team_len):
+        """Whether some split that honours the constraints has team_len in A."""
+        root, other = self.component_sizes()
+        # Bit k is set when k players can be in team A
+        reachable = 1
+        for c in range(self.components):
+            if self.pinned[c]:
+                reachable <<= int(root[c] if self.root_in_a[c] else other[c])
+            else:
+                reachable = (reachable << int(root[c])) | (reachable << int(other[c]))
+        return bool((reachable >> team_len) & 1)
+
+
 class Balancer:
-    def __init__(self, max_team_size=MAX_TEAM_SIZE):
+    def __init__(
+        self,
+        max_team_size=MAX_TEAM_SIZE,
+        tables_dir=TABLES_DIR,
+        quantum=None,
+        cache=None,
+    ):
+        """
+        Args:
+            max_team_size (int): Largest team the balancer has to handle
+            tables_dir (Path): Where the shared lookup tables are stored
+            quantum (float): Score step, see get_score_quantum. When set, scores
+                             are rounded to multiples of it and balanced on exact
+                             int32 sums; otherwise float64 sums are used.
+            cache (ResultCache): Optional cache of searches by score multiset
+        """
         assert max_team_size <= MAX_TEAM_SIZE, f"Max team size is {MAX_TEAM_SIZE}"
-        self.masks = generate_bitmasks(max_team_size)
+        self.max_team_size = max_team_size
+        self.tables_dir = tables_dir
+        self.quantum = quantum
+        self.cache = cache
+        self.tables = None
+        self._local = threading.local()
+
+    def get_tables(self):
+        """(codes, popcounts) tables, mapped lazily on the first balance."""
+        if self.tables is None:
+            self.tables = load_tables(self.max_team_size, self.tables_dir)
+        return self.tables
+
+    def get_buffers(self, dtype):
+        """Per-thread sum buffers for the two halves, reused across calls."""
+        if not hasattr(self._local, "buffers"):
+            self._local.buffers = {}
+        buffers = self._local.buffers.get(dtype)
+        if buffers is None:
+            buffers = np.empty((2, 1 << self.max_team_size), dtype=dtype)
+            self._local.buffers[dtype] = buffers
+        return buffers
+
+    def get_pairs(self, nums, out):
+        """
+        Enumerate every split of `nums` into team A / team B.
+
+        Returns:
+            tuple: (mask_sum, value_sum) arrays in Gray-code order, where entry i
+                   is the half-mask get_tables()[0][i], mask_sum is the number
+                   of team A players and value_sum is sum(team A) - sum(team B)
+        """
+        value_sum = gray_code_sums(nums, out)
+        mask_sum = self.get_tables()[1][: len(value_sum)]
+
+        return mask_sum, value_sum
+
+    def find_optimal_splits(self, nums, max_ms=None, constraints=None):
+        """
+        Find the minimum difference and every split that reaches it, without
+        materializing the splits.
+
+        Args:
+            nums (list): Player scores
+            max_ms (float): Optional time budget. The popcount buckets are
+                            searched most promising first and the search stops
+                            after the bucket that exhausts the budget.
+            constraints (SplitConstraints): Optional pins and links, see
+                                            find_constrained_splits
+
+        Returns:
+            tuple: (min_diff, splits) where splits is an OptimalSplits. When the
+                   budget ran out, min_diff and splits are the best seen so far
+                   and splits.optimal is False.
+        """
+        assert len(nums) > 1, "Number of players must be greater than 2"
+        assert len(nums) % 2 == 0, "Number of players must be even"
+        deadline = None if max_ms is None else time.perf_counter() + max_ms / 1000
+        if constraints is not None:
+            return self.find_constrained_splits(nums, constraints, deadline)
+        assert len(nums) <= 2 * self.max_team_size, (
+            f"Number of players must be no more than {2 * self.max_team_size}"
+        )
+
+        nums, quantum = quantize(nums, self.quantum)
+        team_len = len(nums) // 2
+        left_buffer, right_buffer = self.get_buffers(nums.dtype)
+        left_count, left_value = self.get_pairs(nums[:team_len], left_buffer)
+        # Every split would be found twice, as A/B and as B/A. Pinning the
+        # last player (the anchor) to team A keeps one of them and halves the
+        # right half, which supplies one search and one solution per mask.
+        right_count, right_value = self.get_pairs(nums[team_len:-1], right_buffer)
+        right_count, right_value = right_count + 1, right_value + nums[-1]
+
+        # Float sums are accumulated in a different order per mask, so equal
+        # splits may differ by float noise.
+        tolerance = 1e-9 if quantum is None else 0
+        min_diff, left_order, right_order, found, windows, optimal = match_halves(
+            left_count,
+            left_value,
+            right_count,
+            right_value,
+            team_len,
+            tolerance,
+            deadline,
+        )
+
+        codes = self.get_tables()[0]
+        splits = OptimalSplits(
+            team_len,
+            team_len,
+            codes[left_order],
+            codes[right_order[found]] | (1 << (team_len - 1)),
+            windows,
+            optimal,
+            examined=len(left_value) + len(right_value),
+        )
+        if quantum is not None:
+            min_diff = min_diff * quantum
+        return float(min_diff), splits
 
-    def get_pairs(self, nums):
-        masks = self.masks[: 1 << len(nums), : len(nums)]
-        value_sum = (masks * nums).sum(axis=1) - (~masks * nums).sum(axis=1)
-        mask_sum = masks.sum(axis=1)
+    def find_constrained_splits(self, nums, constraints, deadline=None):
+        """
+        find_optimal_splits over the splits that honour the constraints.
 
-        return zip(mask_sum, value_sum, np.arange(len(masks)))
+        The constraints are enforced by the search itself: every free
+        component becomes one item of the meet-in-the-middle, worth the score
+        difference it adds when its root plays in team A and counting the
+        team A players that puts there, while pinned components are folded
+        into a constant. Items can be larger than one player, so the halves
+        are matched on team A counts rather than popcounts. Up to
+        2 * max_team_size free components are supported, which covers lobbies
+        larger than the unconstrained limit when players are linked.
+
+        Returns:
+            tuple: (min_diff, splits) where splits is a ConstrainedSplits
+        """
+        assert constraints.n == len(nums), "Constraints do not match the lobby"
+        nums, quantum = quantize(nums, self.quantum)
+        team_len = len(nums) // 2
+        root, other = constraints.component_sizes()
+        sign = np.where(constraints.parity, -1, 1).astype(nums.dtype)
+        value = np.zeros(constraints.components, dtype=nums.dtype)
+        np.add.at(value, constraints.component, sign * nums)
+
+        pinned = constraints.pinned
+        in_a = constraints.root_in_a[pinned]
+        const_value = np.where(in_a, value[pinned], -value[pinned]).sum()
+        const_count = np.where(in_a, root[pinned], other[pinned]).sum()
+
+        # Orient every free item so that switching it on adds players to team
+        # A: its count is then the extra players over the switched-off side.
+        free = np.flatnonzero(~pinned)
+        flip = root[free] < other[free]
+        item_value = np.where(flip, -value[free], value[free])
+        item_count = np.abs(root[free] - other[free]).astype(np.int32)
+        team_count = team_len - const_count - np.minimum(root, other)[free].sum()
+        assert len(free) <= 2 * self.max_team_size, (
+            f"Number of free players or groups must be no more than "
+            f"{2 * self.max_team_size}"
+        )
+
+        # Without pins, the mirror of every split honours the constraints too.
+        # Anchoring the last item keeps one of the two, as in the plain search.
+        anchored = not pinned.any() and len(free) > 0
+        half = len(free) // 2
+        right_end = len(free) - 1 if anchored else len(free)
+
+        def enumerate_half(items, value_out):
+            count_out = np.empty(1 << len(items), dtype=np.int32)
+            counts = gray_code_sums(item_count[items], count_out)
+            # A mask's count sums the items switched on
+            counts = (counts + item_count[items].sum()) // 2
+            return counts, gray_code_sums(item_value[items], value_out)
+
+        left_buffer, right_buffer = self.get_buffers(nums.dtype)
+        left_count, left_value = enumerate_half(np.arange(half), left_buffer)
+        right_count, right_value = enumerate_half(
+            np.arange(half, right_end), right_buffer
+        )
+        right_value = right_value + const_value
+        if anchored:
+            right_count = right_count + item_count[-1]
+            right_value = right_value + item_value[-1]
+
+        tolerance = 1e-9 if quantum is None else 0
+        min_diff, left_order, right_order, found, windows, optimal = match_halves(
+            left_count,
+            left_value,
+            right_count,
+            right_value,
+            team_count,
+            tolerance,
+            deadline,
+        )
+
+        codes = self.get_tables()[0]
+        right_len = len(free) - half
+        right_masks = codes[right_order[found]]
+        if anchored:
+            right_masks = right_masks | (1 << (right_len - 1))
+        item = np.full(constraints.components, -1)
+        item[free] = np.arange(len(free))
+        # Pinned components read as switched off, so their side goes here
+        invert = constraints.root_in_a.copy()
+        invert[free] = flip
+        splits = ConstrainedSplits(
+            half,
+            right_len,
+            codes[left_order],
+            right_masks,
+            windows,
+            optimal,
+            examined=len(left_value) + len(right_value),
+            item=item[constraints.component],
+            invert=constraints.parity ^ invert[constraints.component],
+        )
+        if quantum is not None:
+            min_diff = min_diff * quantum
+        return float(min_diff), splits
 
     def find_solutions(self, nums):
+        """
+        Returns:
+            tuple: (min_diff, solutions) where solutions is a boolean matrix
+                   with one team A mask per row, one optimal split for every
+                   right half-mask that takes part in one. Use
+                   find_optimal_splits to count or draw from all of them.
+        """
+        min_diff, splits = self.find_optimal_splits(nums)
+        return min_diff, splits.first_per_right()
+
+    def sample_solution(
+        self, nums, rng=None, max_ms=None, constraints=None, stats=None, size=None
+    ):
+        """
+        Draw one optimal split uniformly at random.
+
+        Args:
+            max_ms (float): Optional time budget, see find_optimal_splits
+            constraints (SplitConstraints): Optional pins and links, see
+                                            find_constrained_splits
+            stats (dict): Optional, filled in like sample_cached
+            size (int): Optional number of draws, see sample_cached
+
+        Returns:
+            tuple: (min_diff, solution, count, optimal) where solution is a
+                   boolean team A mask, count is the number of optimal splits
+                   and optimal is False when the budget cut the search short
+        """
+        return sample_cached(
+            self, nums, rng, stats, size, max_ms=max_ms, constraints=constraints
+        )
+
+
+class OptimalSplits:
+    """
+    All optimal splits of one lobby, kept as runs of partner half-masks.
+
+    Entry i pairs the right half-mask right_masks[i] with every left
+    half-mask in left_masks[start:end] for each (start, end) run in
+    windows[i]. Tie-heavy lobbies have millions of optimal splits, so they
+    are counted and sampled from the runs and only expanded on iteration.
+    """
+
+    def __init__(
+        self,
+        left_len,
+        right_len,
+        left_masks,
+        right_masks,
+        windows,
+        optimal=True,
+        examined=0,
+    ):
+        self.left_len = left_len
+        self.right_len = right_len
+        self.left_masks = left_masks
+        self.right_masks = right_masks
+        self.windows = windows
+        # False when a time budget stopped the search before proving min_diff
+        self.optimal = optimal
+        # Half-masks the search enumerated on both sides
+        self.examined = examined
+        self.counts = (windows[:, :, 1] - windows[:, :, 0]).sum(axis=1)
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    @property
+    def count(self):
+        """Number of optimal splits, like len() but shared with RankSplits."""
+        return len(self)
+
+    def __iter__(self):
+        """Yield every optimal split as a boolean team A mask, lazily."""
+        for right_mask, runs in zip(self.right_masks, self.windows):
+            right = unpack_masks(right_mask[None], self.right_len)
+            for start, end in runs:
+                for chunk in range(start, end, 4096):
+                    left = unpack_masks(
+                        self.left_masks[chunk : min(end, chunk + 4096)], self.left_len
+                    )
+                    right_rows = np.broadcast_to(right, (len(left), self.right_len))
+                    yield from self.to_players(np.concatenate([left, right_rows], 1))
+
+    def get(self, rows, partners):
+        """Team A masks of the partners[k]-th split of entry rows[k]."""
+        first_run = self.windows[rows, 0, 1] - self.windows[rows, 0, 0]
+        in_first = partners < first_run
+        left = np.where(
+            in_first,
+            self.windows[rows, 0, 0] + partners,
+            self.windows[rows, 1, 0] + partners - first_run,
+        )
+        return self.to_players(
+            np.concatenate(
+                [
+                    unpack_masks(self.left_masks[left], self.left_len),
+                    unpack_masks(self.right_masks[rows], self.right_len),
+                ],
+                axis=1,
+            )
+        )
+
+    def to_players(self, masks):
+        """Team A masks over players for rows of half-mask bits."""
+        return masks
+
+    def first_per_right(self):
+        rows = np.arange(len(self.right_masks))
+        return self.get(rows, np.zeros_like(rows))
+
+    def sample(self, rng=None, size=None):
+        """
+        One optimal split drawn uniformly, as a boolean team A mask, or a
+        (size, n) matrix of independent draws.
+        """
+        rng = rng if rng is not None else np.random.default_rng()
+        # Drawing an index into the runs is what reservoir sampling over the
+        # stream of splits would return, without walking the stream.
+        index = np.atleast_1d(rng.integers(len(self), size=size))
+        cumulative = np.cumsum(self.counts)
+        rows = np.searchsorted(cumulative, index, side="right")
+        partners = index - (cumulative[rows] - self.counts[rows])
+        solutions = self.get(rows, partners)
+        return solutions if size is not None else solutions[0]
+
+
+class ConstrainedSplits(OptimalSplits):
+    """
+    OptimalSplits whose half-masks switch constraint components instead of
+    single players.
+
+    Player p plays in team A when item item[p] is switched on XOR invert[p].
+    Players of pinned components have item -1, which reads as switched off.
+    """
+
+    def __init__(self, *args, item, invert, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.item = item
+        self.invert = invert
+
+    def to_players(self, masks):
+        return np.pad(masks, ((0, 0), (0, 1)))[:, self.item] ^ self.invert
+
+
+class RankBalancer:
+    """
+    Exact balancer for scores drawn from a small ladder of ranks.
+
+    Instead of enumerating player subsets it enumerates how many players of
+    each rank join team A, which is polynomial in the lobby size: a DP over
+    (ranks seen, players taken, team A sum) on integer multiples of the
+    score quantum that counts the team A subsets reaching every state. An
+    optimal split is then drawn uniformly by walking the counts back.
+    """
+
+    def __init__(self, quantum, cache=None, max_cells=RANK_DP_MAX_CELLS):
+        """
+        Args:
+            quantum (float): Score step, see get_score_quantum
+            cache (ResultCache): Optional cache of searches by score multiset
+            max_cells (int): Largest DP table accepted, see supports
+        """
+        self.quantum = quantum
+        self.cache = cache
+        self.max_cells = max_cells
+
+    def table_shape(self, nums):
+        """
+        Shape of the DP table for nums, or None when there are none or they
+        are not multiples of the quantum. The table grows with the spread of the scores in quantum
+        steps, so a few large scores can make it huge.
+        """
+        scaled, quantum = quantize(nums, self.quantum)
+        if quantum is None or len(scaled) == 0:
+            return None
+        ranks = np.unique(scaled)
+        team_len = len(nums) // 2
+        max_sum = team_len * (int(ranks[-1]) - int(ranks[0]))
+        return len(ranks) + 1, team_len + 1, max_sum + 1
+
+    def supports(self, nums):
+        """Whether nums sit on the quantum with a table of at most max_cells."""
+        shape = self.table_shape(nums)
+        return shape is not None and np.prod(shape, dtype=np.int64) <= self.max_cells
+
+    def find_optimal_splits(self, nums):
+        """
+        Returns:
+            tuple: (min_diff, splits) where splits is a RankSplits
+        """
         assert len(nums) > 1, "Number of players must be greater than 2"
         assert len(nums) % 2 == 0, "Number of players must be even"
-        assert len(nums) <= 30, (
-            f"Number of players must be no more than {2 * MAX_TEAM_SIZE}"
+
+        if not self.supports(nums):
+            raise ValueError("Scores are off the quantum or too spread for the DP")
+        scaled = quantize(nums, self.quantum)[0].astype(np.int64)
+        ranks, player_ranks, rank_counts = np.unique(
+            scaled, return_inverse=True, return_counts=True
+        )
+        team_len = len(nums) // 2
+
+        # Team size is fixed, so shifting every rank by the lowest one shifts
+        # both team sums equally and keeps the DP on non-negative sums.
+        shifted = ranks - ranks[0]
+        total = int(shifted @ rank_counts)
+        max_sum = team_len * int(shifted[-1])
+
+        # ways[r, p, s]: team A subsets of the first r ranks with p players
+        # summing to s
+        ways = np.zeros((len(ranks) + 1, team_len + 1, max_sum + 1))
+        ways[0, 0, 0] = 1
+        # Only states reachable by the ranks seen so far can be non-zero
+        seen_players, seen_sum = 0, 0
+        for rank, (value, count) in enumerate(zip(shifted, rank_counts)):
+            for players in range(min(count, team_len) + 1):
+                offset = players * int(value)
+                if offset > max_sum:
+                    break
+                source = ways[
+                    rank,
+                    : min(seen_players, team_len - players) + 1,
+                    : min(seen_sum, max_sum - offset) + 1,
+                ]
+                rows, cols = source.shape
+                target = ways[
+                    rank + 1, players : players + rows, offset : offset + cols
+                ]
+                target += comb(count, players) * source
+            seen_players += int(count)
+            seen_sum += int(count * value)
+
+        sums = np.flatnonzero(ways[-1, team_len])
+        team_a_sum = int(sums[np.argmin(np.abs(2 * sums - total))])
+        min_diff = abs(2 * team_a_sum - total)
+
+        splits = RankSplits(ways, shifted, rank_counts, player_ranks, team_a_sum)
+        # Both teams sum to team_a_sum on a tie, so each split is counted twice
+        if min_diff == 0:
+            splits.count /= 2
+        return min_diff * self.quantum, splits
+
+    def sample_solution(self, nums, rng=None, stats=None, size=None):
+        """
+        Draw one optimal split uniformly at random.
+
+        Args:
+            stats (dict): Optional, filled in like sample_cached
+            size (int): Optional number of draws, see sample_cached
+
+        Returns:
+            tuple: (min_diff, solution, count, optimal) like
+                   Balancer.sample_solution. Counts are float64 DP sums, exact
+                   up to 2^53 splits, and the DP is always optimal.
+        """
+        return sample_cached(self, nums, rng, stats, size)
+
+    def find_solutions(self, nums, rng=None):
+        """
+        Returns:
+            tuple: (min_diff, solutions) like Balancer.find_solutions, with a
+                   single solution mask
+        """
+        min_diff, solution, _, _ = self.sample_solution(nums, rng)
+        return min_diff, solution[None, :]
+
+
+class RankSplits:
+    """All optimal splits of one lobby, as the RankBalancer DP counts."""
+
+    optimal = True
+    # The DP counts splits by rank totals instead of enumerating half-masks
+    examined = None
+
+    def __init__(self, ways, shifted, rank_counts, player_ranks, team_a_sum):
+        self.ways = ways
+        self.shifted = shifted
+        self.rank_counts = rank_counts
+        self.player_ranks = player_ranks
+        self.team_a_sum = team_a_sum
+        # A float64 DP sum: exact up to 2^53, approximate above it and
+        # possibly beyond the index-sized integers len() could return
+        self.count = ways[-1, -1, team_a_sum]
+
+    def sample(self, rng=None, size=None):
+        """
+        One optimal split drawn uniformly, as a boolean team A mask, or a
+        (size, n) matrix of independent draws.
+        """
+        rng = rng if rng is not None else np.random.default_rng()
+        if size is not None:
+            return np.array([self.sample(rng) for _ in range(size)])
+        solution = np.zeros(len(self.player_ranks), dtype=bool)
+        players_left, sum_left = len(solution) // 2, self.team_a_sum
+        for rank in reversed(range(len(self.shifted))):
+            value, rank_count = int(self.shifted[rank]), int(self.rank_counts[rank])
+            options = np.arange(min(rank_count, players_left) + 1)
+            options = options[options * value <= sum_left]
+            weights = np.array(
+                [
+                    comb(rank_count, players)
+                    * self.ways[
+                        rank, players_left - players, sum_left - players * value
+                    ]
+                    for players in options
+                ]
+            )
+            players = int(rng.choice(options, p=weights / weights.sum()))
+            members = np.flatnonzero(self.player_ranks == rank)
+            solution[rng.choice(members, size=players, replace=False)] = True
+            players_left -= players
+            sum_left -= players * value
+        return solution
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache with a bounded entry count and a time to live,
+    counting hits and misses for monitoring.
+    """
+
+    def __init__(self, max_entries=DEFAULT_CACHE_ENTRIES, ttl=DEFAULT_CACHE_TTL):
+        """
+        Args:
+            max_entries (int): Entries kept before the least recently used one
+                               is evicted
+            ttl (float): Seconds an entry stays valid
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """The cached value for key, or None when missing or expired."""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def sample_cached(engine, nums, rng=None, stats=None, size=None, **options):
+    """
+    Draw one optimal split with engine.sample_solution semantics, reusing the
+    engine's cached search for lobbies with the same score multiset.
+
+    The search runs on the scores sorted ascending and is cached under the
+    sorted quantized vector, so it is independent of nicknames and player
+    order. Every call still draws its own split, which is mapped back to the
+    caller's player order. Searches cut short by a time budget are not cached,
+    nor are constrained ones, whose constraints refer to the caller's order.
+
+    Args:
+        stats (dict): Optional, receives 'cache_hit' and 'examined', the
+                      half-masks enumerated by the search, cached or not
+                      (None for engines that do not enumerate them)
+        size (int): Optional number of independent draws, returned as a
+                    (size, n) matrix instead of a single mask
+        options: Passed on to engine.find_optimal_splits
+    """
+    stats = {} if stats is None else stats
+    if engine.cache is None or options.get("constraints") is not None:
+        min_diff, splits = engine.find_optimal_splits(nums, **options)
+        stats.update(cache_hit=False, examined=splits.examined)
+        return min_diff, splits.sample(rng, size), int(splits.count), splits.optimal
+
+    nums = np.asarray(nums, dtype=np.float64)
+    scaled, _ = quantize(nums, engine.quantum)
+    order = np.argsort(scaled, kind="stable")
+    key = (scaled.dtype.str, scaled[order].tobytes())
+    result = engine.cache.get(key)
+    stats["cache_hit"] = result is not None
+    if result is None:
+        result = engine.find_optimal_splits(nums[order], **options)
+        if result[1].optimal:
+            engine.cache.set(key, result)
+
+    min_diff, splits = result
+    stats["examined"] = splits.examined
+    solution = np.empty((1 if size is None else size, len(nums)), dtype=bool)
+    solution[:, order] = splits.sample(rng, 1 if size is None else size)
+    if size is None:
+        solution = solution[0]
+    return min_diff, solution, int(splits.count), splits.optimal
+
+
+def differencing_split(nums):
+    """
+    Balanced Karmarkar-Karp seed: pair neighbours in sorted order, then run
+    largest differencing on the pair differences to decide which member of
+    each pair joins team A. Teams always get the same size.
+
+    Returns:
+        np.ndarray: Boolean team A mask
+    """
+    order = np.argsort(nums)[::-1]
+    first, second = order[0::2], order[1::2]
+
+    # Every heap entry is a group of pairs whose orientation is fixed
+    # relative to each other; merging two groups puts them on opposite sides.
+    heap = [
+        (-(nums[a] - nums[b]), pair) for pair, (a, b) in enumerate(zip(first, second))
+    ]
+    groups = {pair: [(pair, True)] for pair in range(len(first))}
+    heapq.heapify(heap)
+    while len(heap) > 1:
+        larger, larger_id = heapq.heappop(heap)
+        smaller, smaller_id = heapq.heappop(heap)
+        groups[larger_id].extend(
+            (pair, not side) for pair, side in groups.pop(smaller_id)
         )
+        heapq.heappush(heap, (larger - smaller, larger_id))
+
+    solution = np.zeros(len(nums), dtype=bool)
+    for pair, side in groups[heap[0][1]]:
+        solution[first[pair] if side else second[pair]] = True
+    return solution
+
+
+def improve_by_swaps(nums, solution):
+    """
+    Repeatedly apply the single A/B swap that reduces |sum(A) - sum(B)| the
+    most, until no swap helps. Updates `solution` in place.
 
+    Returns:
+        number: The final sum(team A) - sum(team B)
+    """
+    diff = nums[solution].sum() - nums[~solution].sum()
+    while diff != 0:
+        team_a, team_b = np.flatnonzero(solution), np.flatnonzero(~solution)
+        # Swapping a and b changes the difference by 2 * (b - a)
+        new_diff = np.abs(diff + 2 * (nums[team_b][None, :] - nums[team_a][:, None]))
+        best = np.argmin(new_diff)
+        if new_diff.flat[best] >= abs(diff):
+            break
+        a, b = np.unravel_index(best, new_diff.shape)
+        solution[team_a[a]], solution[team_b[b]] = False, True
+        diff += 2 * (nums[team_b[b]] - nums[team_a[a]])
+    return diff
+
+
+def subset_sums(values, size):
+    """
+    Sums of every size-element subset of values, with the subsets.
+
+    Returns:
+        tuple: (sums, members) where members[i] are the indices summed in sums[i]
+    """
+    members = np.array(list(combinations(range(len(values)), size)), dtype=np.int64)
+    return values[members].sum(axis=1), members
+
+
+def min_swap_split(nums, solution, target, max_swaps, quantum=None):
+    """
+    Fewest A/B swaps that bring |sum(A) - sum(B)| to at most target.
+
+    Swapping k players of team A with k of team B changes the difference by
+    2 * (sum of the B players - sum of the A players), so every swap count is
+    one vectorized search over subset sums, cheapest first.
+
+    Args:
+        nums (list): Player scores
+        solution (np.ndarray): Current boolean team A mask
+        target (float): Largest acceptable difference
+        max_swaps (int): Most swaps to try
+        quantum (float): Score step, see get_score_quantum
+
+    Returns:
+        tuple: (swaps, diff, solution) for the best split with the fewest swaps,
+               or None when no split within max_swaps reaches the target
+    """
+    nums, quantum = quantize(nums, quantum)
+    solution = np.asarray(solution, dtype=bool)
+    target = target if quantum is None else round(target / quantum)
+    tolerance = 1e-9 if quantum is None else 0
+    team_a, team_b = np.flatnonzero(solution), np.flatnonzero(~solution)
+    diff = nums[team_a].sum() - nums[team_b].sum()
+
+    for swaps in range(min(max_swaps, len(team_a), len(team_b)) + 1):
+        sums_a, members_a = subset_sums(nums[team_a], swaps)
+        sums_b, members_b = subset_sums(nums[team_b], swaps)
+        new_diff = np.abs(diff + 2 * (sums_b[None, :] - sums_a[:, None]))
+        best = np.argmin(new_diff)
+        if new_diff.flat[best] <= target + tolerance:
+            a, b = np.unravel_index(best, new_diff.shape)
+            solution = solution.copy()
+            solution[team_a[members_a[a]]] = False
+            solution[team_b[members_b[b]]] = True
+            best_diff = new_diff.flat[best]
+            if quantum is not None:
+                best_diff = best_diff * quantum
+            return swaps, float(best_diff), solution
+    return None
+
+
+class HeuristicBalancer:
+    """
+    Anytime balancer for lobbies too large for the exact engines.
+
+    A Karmarkar-Karp differencing split is polished by greedy swaps, then
+    perturbed with random swaps and re-polished until the time budget runs
+    out or the split is provably optimal.
+    """
+
+    def __init__(self, quantum=None):
+        self.quantum = quantum
+
+    def search(self, nums, max_ms, rng=None):
+        """
+        Args:
+            nums (list): Player scores
+            max_ms (float): Time budget in milliseconds
+            rng (np.random.Generator): Source of the random perturbations
+
+        Returns:
+            tuple: (min_diff, solutions, optimal) where solutions holds the
+                   single best split found and optimal tells whether no
+                   better split can exist
+        """
+        assert len(nums) > 1, "Number of players must be greater than 2"
+        assert len(nums) % 2 == 0, "Number of players must be even"
+        deadline = time.perf_counter() + max_ms / 1000
+        rng = rng if rng is not None else np.random.default_rng()
+
+        nums, quantum = quantize(nums, self.quantum)
+        if quantum is not None:
+            nums = nums.astype(np.int64)
+            # Equal team sizes keep the diff's parity equal to the total's
+            lower_bound = int(nums.sum()) % 2
+        else:
+            lower_bound = 1e-9
+
+        best = differencing_split(nums)
+        best_diff = abs(improve_by_swaps(nums, best))
         team_len = len(nums) // 2
-        keys = [
-            (team_len - mask_sum, -value_sum, mask)
-            for mask_sum, value_sum, mask in self.get_pairs(nums[:team_len])
-        ]
-        keys.sort()
-
-        min_diff = float("inf")
-        solutions = []
-        for mask_sum, value_sum, mask in self.get_pairs(nums[team_len:]):
-            idx = bisect.bisect_left(keys, (mask_sum, value_sum, mask))
-            if idx < len(keys) and keys[idx][0] == mask_sum:
-                diff = abs(keys[idx][1] - value_sum)
-                if diff == min_diff:
-                    solutions.append((keys[idx][2], mask))
-                elif diff < min_diff:
-                    solutions = [(keys[idx][2], mask)]
-                min_diff = min(min_diff, diff)
-
-        return min_diff, [
-            get_mask(half1, team_len) + get_mask(half2, team_len)
-            for half1, half2 in solutions
-        ]
+        while best_diff > lower_bound and time.perf_counter() < deadline:
+            candidate = best.copy()
+            swaps = rng.integers(1, max(1, team_len // 4), endpoint=True)
+            team_a = rng.choice(np.flatnonzero(candidate), swaps, replace=False)
+            team_b = rng.choice(np.flatnonzero(~candidate), swaps, replace=False)
+            candidate[team_a], candidate[team_b] = False, True
+
+            diff = abs(improve_by_swaps(nums, candidate))
+            if diff < best_diff:
+                best, best_diff = candidate, diff
+
+        optimal = best_diff <= lower_bound
+        if quantum is not None:
+            best_diff = best_diff * quantum
+        return float(best_diff), best[None, :], bool(optimal)
+
+
+def greedy_teams(nums, teams):
+    """
+    Longest-processing-time seed for k teams of equal size: players in
+    descending order each join the lightest team that still has room.
+
+    Returns:
+        np.ndarray: Team index of every player
+    """
+    team_len = len(nums) // teams
+    assignment = np.empty(len(nums), dtype=np.int64)
+    sums = np.zeros(teams)
+    sizes = np.zeros(teams, dtype=np.int64)
+    for player in np.argsort(nums)[::-1]:
+        open_teams = np.flatnonzero(sizes < team_len)
+        team = open_teams[np.argmin(sums[open_teams])]
+        assignment[player] = team
+        sums[team] += nums[player]
+        sizes[team] += 1
+    return assignment
+
+
+def improve_team_swaps(nums, assignment, teams):
+    """
+    Repeatedly apply the single swap between two teams that reduces the
+    spread (max team total - min team total) the most, until none does.
+    Updates `assignment` in place.
+
+    Returns:
+        number: The final spread
+    """
+    sums = np.bincount(assignment, weights=nums, minlength=teams)
+    spread = sums.max() - sums.min()
+    while spread > 0:
+        best_spread, best_swap = spread, None
+        for first in range(teams):
+            for second in range(first + 1, teams):
+                others = np.delete(sums, [first, second])
+                others_max = others.max() if len(others) else -np.inf
+                others_min = others.min() if len(others) else np.inf
+
+                members_first = np.flatnonzero(assignment == first)
+                members_second = np.flatnonzero(assignment == second)
+                # Swapping a and b moves b - a from the second team to the first
+                delta = nums[members_second][None, :] - nums[members_first][:, None]
+                new_first, new_second = sums[first] + delta, sums[second] - delta
+                new_spread = np.maximum(
+                    np.maximum(new_first, new_second), others_max
+                ) - np.minimum(np.minimum(new_first, new_second), others_min)
+
+                best = np.argmin(new_spread)
+                if new_spread.flat[best] < best_spread:
+                    a, b = np.unravel_index(best, new_spread.shape)
+                    best_spread = new_spread.flat[best]
+                    best_swap = (members_first[a], members_second[b], first, second)
+
+        if best_swap is None:
+            break
+        a, b, first, second = best_swap
+        assignment[a], assignment[b] = second, first
+        sums[first] += nums[b] - nums[a]
+        sums[second] += nums[a] - nums[b]
+        spread = best_spread
+    return spread
+
+
+def exact_teams(nums, teams, best_spread, deadline):
+    """
+    Branch and bound over k-team assignments of equal size, looking for a
+    spread below `best_spread`. Players are placed in descending order, teams
+    in identical states are tried once, and a branch is cut when even giving
+    every team its largest remaining players cannot beat the incumbent.
+
+    Returns:
+        tuple: (spread, assignment, completed) where assignment is None if no
+               better split exists and completed is False if the deadline
+               stopped the search early
+    """
+    order = np.argsort(nums)[::-1]
+    # Teams have equal sizes, so shifting every score keeps the spread and
+    # makes partial team totals monotone
+    values = (nums[order] - nums.min()).tolist()
+    prefix = np.concatenate([[0], np.cumsum(values)]).tolist()
+    team_len = len(nums) // teams
+
+    sums = [0] * teams
+    sizes = [0] * teams
+    current = [0] * len(nums)
+    best = {"spread": best_spread, "assignment": None, "completed": True}
+
+    def search(position):
+        if time.perf_counter() > deadline:
+            best["completed"] = False
+            return
+        if position == len(values):
+            spread = max(sums) - min(sums)
+            if spread < best["spread"]:
+                best["spread"], best["assignment"] = spread, current.copy()
+            return
+
+        highest_min = min(
+            total + prefix[position + team_len - size] - prefix[position]
+            for total, size in zip(sums, sizes)
+        )
+        if max(sums) - highest_min >= best["spread"]:
+            return
+
+        tried = set()
+        for team in range(teams):
+            state = (sums[team], sizes[team])
+            if sizes[team] == team_len or state in tried:
+                continue
+            tried.add(state)
+            sums[team] += values[position]
+            sizes[team] += 1
+            current[position] = team
+            search(position + 1)
+            sums[team] -= values[position]
+            sizes[team] -= 1
+            if not best["completed"] or best["spread"] == 0:
+                return
+
+    search(0)
+    assignment = None
+    if best["assignment"] is not None:
+        assignment = np.empty(len(nums), dtype=np.int64)
+        assignment[order] = best["assignment"]
+    return best["spread"], assignment, best["completed"]
+
+
+class MultiTeamBalancer:
+    """
+    Balancer for k >= 2 teams of equal size, minimizing the spread between
+    the strongest and the weakest team total.
+
+    A greedy split is polished by pairwise swaps. Lobbies of up to
+    MULTI_TEAM_EXACT_MAX_PLAYERS are then solved exactly by branch and bound
+    seeded with it; larger ones keep perturbing and re-polishing the best
+    split until the time budget runs out.
+    """
+
+    def __init__(self, quantum=None):
+        self.quantum = quantum
+
+    def search(self, nums, teams, max_ms, rng=None):
+        """
+        Args:
+            nums (list): Player scores
+            teams (int): Number of teams
+            max_ms (float): Time budget in milliseconds
+            rng (np.random.Generator): Source of the random perturbations
+
+        Returns:
+            tuple: (spread, assignment, optimal) where assignment holds the
+                   team index of every player and optimal tells whether no
+                   smaller spread can exist
+        """
+        assert teams >= 2, "Number of teams must be at least 2"
+        assert len(nums) >= teams, "Every team needs at least one player"
+        assert len(nums) % teams == 0, (
+            f"Number of players must be divisible by the number of teams ({teams})"
+        )
+        deadline = time.perf_counter() + max_ms / 1000
+        rng = rng if rng is not None else np.random.default_rng()
+
+        nums, quantum = quantize(nums, self.quantum)
+        if quantum is not None:
+            nums = nums.astype(np.int64)
+            # Integer team totals can only all be equal if k divides the total
+            lower_bound = int(int(nums.sum()) % teams != 0)
+        else:
+            lower_bound = 1e-9
+
+        best = greedy_teams(nums, teams)
+        best_spread = improve_team_swaps(nums, best, teams)
+        optimal = best_spread <= lower_bound
+
+        if not optimal and len(nums) <= MULTI_TEAM_EXACT_MAX_PLAYERS:
+            spread, assignment, optimal = exact_teams(
+                nums, teams, best_spread, deadline
+            )
+            if assignment is not None:
+                best, best_spread = assignment, spread
+
+        team_len = len(nums) // teams
+        while not optimal and time.perf_counter() < deadline:
+            candidate = best.copy()
+            for _ in range(rng.integers(1, max(1, team_len // 2), endpoint=True)):
+                first, second = rng.choice(teams, size=2, replace=False)
+                a = rng.choice(np.flatnonzero(candidate == first))
+                b = rng.choice(np.flatnonzero(candidate == second))
+                candidate[a], candidate[b] = second, first
+
+            spread = improve_team_swaps(nums, candidate, teams)
+            if spread < best_spread:
+                best, best_spread = candidate, spread
+                optimal = best_spread <= lower_bound
+
+        if quantum is not None:
+            best_spread = best_spread * quantum
+        return float(best_spread), best, bool(optimal)
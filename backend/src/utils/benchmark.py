@@ -0,0 +1,554 @@
+#!/usr/bin/env python3
+"""
+Script to benchmark the team balancer.
+
+Usage:
+    python benchmark.py startup
+    python benchmark.py engines
+    python benchmark.py suite --save baseline.json
+    python benchmark.py suite --baseline baseline.json
+    python benchmark.py database --events 1000000
+"""
+
+from datetime import datetime, timedelta
+import json
+from pathlib import Path
+import platform
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+import tracemalloc
+
+import numpy as np
+import typer
+
+from utils.balance import Balancer, RankBalancer, get_score_quantum, randomize_scores
+from utils.db import MIGRATIONS, Database, add_event_indexes, create_base_tables
+from utils.spreadsheet import SCORES
+
+app = typer.Typer(help="Benchmark the team balancer")
+
+# Every snippet runs in a fresh interpreter and prints "<seconds> <max RSS KiB>"
+# for the measured block, so import and allocation costs are not shared.
+MEASURE_TEMPLATE = """
+import resource
+import time
+import numpy as np
+
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+STARTUP_CASES = {
+    # What every worker did at import before the tables were memory-mapped
+    "itertools.product masks": """
+import itertools
+masks = np.array(list(itertools.product([False, True], repeat=15)), dtype=np.bool)
+masks = np.flip(masks, axis=1)
+""",
+    "Balancer()": """
+from utils.balance import Balancer
+balancer = Balancer()
+""",
+    "Balancer() + first balance": """
+from utils.balance import Balancer
+balancer = Balancer()
+balancer.find_solutions(np.linspace(1, 4, 30))
+""",
+}
+
+
+FIXTURES_PATH = Path(__file__).resolve().parents[2] / "tests/files/balance_tests.json"
+SUITE_DISTRIBUTIONS = ("tie-heavy", "ladder", "fixtures", "tie-free")
+SUITE_SIZES = range(2, 31, 2)
+SUITE_RANDOMNESS = (0, 25, 50)
+# Latency under this many ms is within timer noise and never a regression
+SUITE_NOISE_MS = 0.2
+# Allocation peaks under this many KiB are never a regression
+SUITE_NOISE_KIB = 64
+
+# Players per synthetic game, half of them winning
+DATABASE_GAME_SIZE = 8
+DATABASE_PLAYERS = 2000
+DATABASE_ADMINS = 10
+# Queries joining admins, and the 30-day stats of /api/users, as written
+# against the events-only schema (v2, with events.admin a TEXT column) and
+# against the current one
+DATABASE_QUERIES = {
+    "player stats": (
+        """
+        SELECT
+            p.id,
+            SUM(CASE WHEN e.win = 1 THEN 1 ELSE 0 END) as wins,
+            SUM(CASE WHEN e.win = 0 THEN 1 ELSE 0 END) as losses
+        FROM players AS p
+        LEFT JOIN events AS e ON p.id = e.player_id AND e.game_datetime >= ?
+        GROUP BY p.id
+        """,
+        """
+        SELECT
+            p.id,
+            COALESCE(SUM(s.wins), 0) as wins,
+            COALESCE(SUM(s.losses), 0) as losses
+        FROM players AS p
+        LEFT JOIN player_daily_stats AS s ON p.id = s.player_id AND s.day >= ?
+        GROUP BY p.id
+        """,
+    ),
+    "game history": (
+        """
+        SELECT game_datetime, game_name, win, a.name as admin_name
+        FROM events e
+        JOIN admins a ON e.admin = CAST(a.id AS TEXT)
+        WHERE e.player_id = ? and e.game_datetime >= ?
+        ORDER BY e.game_datetime DESC
+        """,
+        """
+        SELECT g.game_datetime, g.game_name, e.win, a.name as admin_name
+        FROM events e
+        JOIN games g ON g.id = e.game_id
+        JOIN admins a ON a.id = g.admin_id
+        WHERE e.player_id = ? and e.game_datetime >= ?
+        ORDER BY e.game_datetime DESC
+        """,
+    ),
+    "unique games": (
+        """
+        SELECT DISTINCT e.game_name, e.game_datetime, a.name AS admin_name
+        FROM events e
+        JOIN admins a ON e.admin = CAST(a.id AS TEXT)
+        WHERE game_datetime >= ? AND game_datetime <= ?
+        ORDER BY e.game_datetime DESC
+        """,
+        """
+        SELECT g.game_name, g.game_datetime, a.name AS admin_name
+        FROM games g
+        JOIN admins a ON a.id = g.admin_id
+        WHERE game_datetime >= ? AND game_datetime <= ?
+        ORDER BY g.game_datetime DESC
+        """,
+    ),
+    "top admins": (
+        """
+        SELECT
+            a.name AS admin_name,
+            COUNT(DISTINCT e.game_name || '|' || e.game_datetime) AS games
+        FROM events e
+        JOIN admins a ON e.admin = CAST(a.id AS TEXT)
+        WHERE game_datetime >= ? AND game_datetime <= ?
+        GROUP BY a.name ORDER BY games DESC LIMIT 10
+        """,
+        """
+        SELECT a.name AS admin_name, COUNT(*) AS games
+        FROM games g
+        JOIN admins a ON a.id = g.admin_id
+        WHERE game_datetime >= ? AND game_datetime <= ?
+        GROUP BY a.name ORDER BY games DESC LIMIT 10
+        """,
+    ),
+    "games of one admin": (
+        """
+        SELECT COUNT(DISTINCT e.game_name || '|' || e.game_datetime)
+        FROM events e
+        JOIN admins a ON e.admin = CAST(a.id AS TEXT)
+        WHERE a.name = ?
+        """,
+        """
+        SELECT COUNT(*)
+        FROM games g
+        JOIN admins a ON a.id = g.admin_id
+        WHERE a.name = ?
+        """,
+    ),
+}
+
+
+def measure(code):
+    script = MEASURE_TEMPLATE.format(code=textwrap.dedent(code))
+    result = subprocess.run(
+        [sys.executable, "-c", script], check=True, capture_output=True, text=True
+    )
+    elapsed, max_rss = result.stdout.split()[-2:]
+    return float(elapsed), int(max_rss)
+
+
+def time_call(func, repeat):
+    """Best wall time of `repeat` calls in milliseconds, after one warm-up."""
+    func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def suite_lobbies(distribution, players, count, rng, fixtures):
+    """
+    Base scores of `count` lobbies for one suite case.
+
+    Distributions:
+        tie-heavy: Integer ranks 1-5, where optimal splits tie by the thousands
+        ladder: The SCORES ladder the production lobbies are drawn from
+        fixtures: Lobbies of tests/files/balance_tests.json of this size
+        tie-free: Distinct scores on a 0.001 grid, mostly a single optimum
+    """
+    if distribution == "tie-heavy":
+        return rng.integers(1, 6, size=(count, players)).astype(float)
+    if distribution == "ladder":
+        return rng.choice(SCORES, size=(count, players))
+    if distribution == "fixtures":
+        lobbies = [test["nums"] for test in fixtures if len(test["nums"]) == players]
+        if not lobbies:
+            return None
+        return np.array([lobbies[i % len(lobbies)] for i in range(count)])
+    if distribution == "tie-free":
+        grid = np.arange(1000, 5000) / 1000
+        return np.array(
+            [rng.choice(grid, players, replace=False) for _ in range(count)]
+        )
+    raise ValueError(f"Unknown distribution: {distribution}")
+
+
+def build_event_database(path, events, seed):
+    """
+    Write a synthetic database of `events` player events at schema v2, the
+    last one storing games and admins on every event, spread over the two
+    years up to now.
+
+    Returns:
+        dict: Parameters of the DATABASE_QUERIES: the start of the 30-day
+              stats, a player id with the start of the 60-day game history,
+              the last month and an admin name
+    """
+    rng = np.random.default_rng(seed)
+    games = events // DATABASE_GAME_SIZE
+    nicknames = [f"Player{i}" for i in range(1, DATABASE_PLAYERS + 1)]
+    now = datetime.now().replace(microsecond=0)
+    starts = rng.integers(0, 2 * 365 * 24 * 3600, size=games)
+    datetimes = [str(now - timedelta(seconds=int(start))) for start in starts]
+    lobbies = rng.integers(0, DATABASE_PLAYERS, size=(games, DATABASE_GAME_SIZE))
+    admins = rng.integers(1, DATABASE_ADMINS + 1, size=games)
+    half = DATABASE_GAME_SIZE // 2
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    create_base_tables(conn.cursor())
+    add_event_indexes(conn.cursor())
+    conn.executemany(
+        "INSERT INTO players (nickname) VALUES (?)", [(name,) for name in nicknames]
+    )
+    conn.executemany(
+        "INSERT INTO admins (name, hash) VALUES (?, 'x:y')",
+        [(f"admin{i}",) for i in range(1, DATABASE_ADMINS + 1)],
+    )
+
+    def rows():
+        for game_datetime, lobby, admin in zip(datetimes, lobbies, admins):
+            names = [nicknames[player] for player in lobby]
+            name = ",".join(names[:half]) + "|VS|" + ",".join(names[half:])
+            for i, player in enumerate(lobby):
+                yield int(player) + 1, game_datetime, name, i < half, str(admin)
+
+    conn.executemany(
+        "INSERT INTO events (player_id, game_datetime, game_name, win, admin) "
+        "VALUES (?, ?, ?, ?, ?)",
+        rows(),
+    )
+    conn.execute("PRAGMA user_version = 2")
+    conn.commit()
+    conn.close()
+
+    month_start = now - timedelta(days=30)
+    month = (f"{month_start:%Y-%m-%d} 00:00:00", f"{now:%Y-%m-%d} 23:59:59")
+    return {
+        "player stats": (f"{now - timedelta(days=30):%Y-%m-%d}",),
+        "game history": (1, str(now - timedelta(days=60))),
+        "unique games": month,
+        "top admins": month,
+        "games of one admin": ("admin1",),
+    }
+
+
+@app.callback()
+def main():
+    pass
+
+
+@app.command()
+def startup(
+    repeat: int = typer.Option(5, "-r", "--repeat", help="Runs per case"),
+):
+    """Measure worker boot cost of the balancer tables in fresh processes."""
+    _, baseline_rss = measure("pass")
+    typer.echo(f"Interpreter with numpy: {baseline_rss / 1024:.1f} MiB max RSS")
+
+    for name, code in STARTUP_CASES.items():
+        runs = [measure(code) for _ in range(repeat)]
+        elapsed = min(run[0] for run in runs)
+        max_rss = min(run[1] for run in runs)
+        typer.echo(
+            f"{name:<30} {elapsed * 1000:8.2f} ms"
+            f"  +{(max_rss - baseline_rss) / 1024:6.1f} MiB RSS"
+        )
+
+
+@app.command()
+def engines(
+    repeat: int = typer.Option(20, "-r", "--repeat", help="Runs per lobby"),
+    seed: int = typer.Option(0, "-s", "--seed", help="Seed for the lobbies"),
+):
+    """Compare meet-in-the-middle and rank-count DP on lobbies from SCORES."""
+    quantum = get_score_quantum(SCORES)
+    balancer = Balancer(quantum=quantum)
+    rank_balancer = RankBalancer(quantum=quantum)
+    rng = np.random.default_rng(seed)
+
+    typer.echo(f"{'players':>7} {'meet-in-middle':>15} {'rank DP':>10} {'speedup':>8}")
+    for players in range(10, 31, 2):
+        nums = rng.choice(SCORES, size=players)
+        mitm = time_call(lambda: balancer.find_solutions(nums), repeat)
+        dp = time_call(lambda: rank_balancer.find_solutions(nums), repeat)
+        typer.echo(f"{players:>7} {mitm:>12.2f} ms {dp:>7.2f} ms {mitm / dp:>7.1f}x")
+
+
+def suite_engine(distribution, randomness, quantum):
+    """
+    The engine /api/balance would use: the rank-count DP for unrandomized
+    ladder scores, the meet-in-the-middle search otherwise. Tie-free scores are
+    balanced on float sums, as they do not sit on the quantum.
+    """
+    if distribution == "tie-free":
+        return "meet_in_the_middle", Balancer()
+    if randomness == 0:
+        return "rank_dp", RankBalancer(quantum=quantum)
+    return "meet_in_the_middle", Balancer(quantum=quantum)
+
+
+def run_suite(repeat, seed, distributions, only=None):
+    """
+    Balance `repeat` lobbies of every suite case and measure them.
+
+    Args:
+        only (set): Optional case keys to limit the run to
+
+    Returns:
+        dict: Results keyed by "<distribution>/r<randomness>/n<players>", each
+              with the engine, latency percentiles in ms over the lobbies (best
+              of 5 runs each) and the peak traced allocation of one balance in
+              KiB, plus the max RSS of this process in KiB once the suite ran
+    """
+    quantum = get_score_quantum(SCORES)
+    fixtures = json.loads(FIXTURES_PATH.read_text())
+
+    cases = {}
+    for distribution in distributions:
+        for randomness in SUITE_RANDOMNESS:
+            engine, balancer = suite_engine(distribution, randomness, quantum)
+            for players in SUITE_SIZES:
+                key = f"{distribution}/r{randomness}/n{players}"
+                if only is not None and key not in only:
+                    continue
+                # Every case draws the same lobbies whichever cases run
+                rng = np.random.default_rng(
+                    [seed, SUITE_DISTRIBUTIONS.index(distribution), randomness, players]
+                )
+                lobbies = suite_lobbies(distribution, players, repeat, rng, fixtures)
+                if lobbies is None:
+                    continue
+                draws = [
+                    randomize_scores(lobby, randomness, rng=rng)[0] for lobby in lobbies
+                ]
+                # Best of a few runs per lobby, so the percentiles spread over
+                # lobbies rather than over scheduler noise
+                timings = [
+                    time_call(lambda: balancer.sample_solution(nums, rng=rng), 5)
+                    for nums in draws
+                ]
+
+                # Traced separately, tracing slows every allocation down
+                tracemalloc.start()
+                balancer.sample_solution(draws[-1], rng=rng)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+                p50, p90, p99 = np.percentile(timings, [50, 90, 99])
+                cases[key] = {
+                    "engine": engine,
+                    "players": players,
+                    "p50_ms": round(float(p50), 4),
+                    "p90_ms": round(float(p90), 4),
+                    "p99_ms": round(float(p99), 4),
+                    "peak_kib": round(peak / 1024, 1),
+                }
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "cases": cases,
+    }
+
+
+def compare_results(results, baseline, threshold):
+    """
+    Regressions of results against a baseline run of the suite.
+
+    A case regresses when its p50 or p90 latency or its allocation peak grows
+    by more than `threshold` (a fraction) and by more than the noise floor;
+    the run regresses when its max RSS grows by more than `threshold`.
+    Cases missing from either run are not compared.
+
+    Returns:
+        list: (case key, message) per regression, with a None key for the RSS
+    """
+    regressions = []
+    for key, case in results["cases"].items():
+        base = baseline["cases"].get(key)
+        if base is None:
+            continue
+        for field in ("p50_ms", "p90_ms"):
+            if (
+                case[field] > base[field] * (1 + threshold)
+                and case[field] - base[field] > SUITE_NOISE_MS
+            ):
+                regressions.append(
+                    (key, f"{key} {field}: {base[field]:.3f} -> {case[field]:.3f}")
+                )
+        if (
+            case["peak_kib"] > base["peak_kib"] * (1 + threshold)
+            and case["peak_kib"] - base["peak_kib"] > SUITE_NOISE_KIB
+        ):
+            regressions.append(
+                (
+                    key,
+                    f"{key} peak_kib: {base['peak_kib']:.1f} -> {case['peak_kib']:.1f}",
+                )
+            )
+    if results["max_rss_kib"] > baseline["max_rss_kib"] * (1 + threshold):
+        regressions.append(
+            (
+                None,
+                f"max_rss_kib: {baseline['max_rss_kib']} -> {results['max_rss_kib']}",
+            )
+        )
+    return regressions
+
+
+@app.command()
+def suite(
+    repeat: int = typer.Option(30, "-r", "--repeat", help="Lobbies per case"),
+    seed: int = typer.Option(0, "-s", "--seed", help="Seed for the lobbies"),
+    distribution: list[str] = typer.Option(
+        list(SUITE_DISTRIBUTIONS),
+        "-d",
+        "--distribution",
+        help="Score distributions to run",
+    ),
+    save: Path = typer.Option(None, help="Write the results as a JSON baseline"),
+    baseline: Path = typer.Option(None, help="Fail on regressions against it"),
+    threshold: float = typer.Option(
+        0.25, "-t", "--threshold", help="Accepted relative slowdown"
+    ),
+):
+    """Sweep lobby sizes, score distributions and randomness levels."""
+    results = run_suite(repeat, seed, distribution)
+
+    typer.echo(
+        f"{'case':<24} {'engine':>18} {'p50':>9} {'p90':>9} {'p99':>9} {'peak':>10}"
+    )
+    for key, case in results["cases"].items():
+        typer.echo(
+            f"{key:<24} {case['engine']:>18} {case['p50_ms']:>6.2f} ms"
+            f" {case['p90_ms']:>6.2f} ms {case['p99_ms']:>6.2f} ms"
+            f" {case['peak_kib']:>6.0f} KiB"
+        )
+    typer.echo(f"Max RSS: {results['max_rss_kib'] / 1024:.1f} MiB")
+
+    if save is not None:
+        save.write_text(json.dumps(results, indent=2) + "\n")
+        typer.echo(f"Baseline written to {save}")
+    if baseline is not None:
+        baseline_results = json.loads(baseline.read_text())
+        regressions = compare_results(results, baseline_results, threshold)
+        # A single run on a busy machine has outliers: only cases that regress
+        # again on a second run fail it
+        keys = {key for key, _ in regressions if key is not None}
+        if keys:
+            typer.echo(f"Re-running {len(keys)} regressed cases")
+            rerun = run_suite(repeat, seed, distribution, only=keys)
+            rerun["max_rss_kib"] = results["max_rss_kib"]
+            regressions = [
+                regression
+                for regression in compare_results(rerun, baseline_results, threshold)
+                if regression[0] is not None
+            ] + [regression for regression in regressions if regression[0] is None]
+        for _, message in regressions:
+            typer.echo(f"Regression: {message}", err=True)
+        if regressions:
+            raise typer.Exit(1)
+        typer.echo(f"No regressions past {threshold:.0%} against {baseline}")
+
+
+@app.command()
+def database(
+    events: int = typer.Option(1_000_000, "-e", "--events", help="Synthetic events"),
+    repeat: int = typer.Option(5, "-r", "--repeat", help="Runs per query"),
+    seed: int = typer.Option(0, "-s", "--seed", help="Seed for the games"),
+):
+    """Compare the queries of the events-only schema and the current one."""
+    with tempfile.TemporaryDirectory() as directory:
+        legacy_path = Path(directory) / "legacy.sqlite"
+        start = time.perf_counter()
+        params = build_event_database(legacy_path, events, seed)
+        typer.echo(f"Built {events} events in {time.perf_counter() - start:.1f} s")
+
+        current_path = Path(directory) / "current.sqlite"
+        shutil.copy(legacy_path, current_path)
+        start = time.perf_counter()
+        db = Database(current_path)
+        typer.echo(
+            f"Migrated to schema v{len(MIGRATIONS)}"
+            f" in {time.perf_counter() - start:.1f} s"
+        )
+        with db.connection() as conn:
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        typer.echo(
+            f"Database size: {legacy_path.stat().st_size / 2**20:.1f} MiB"
+            f" -> {current_path.stat().st_size / 2**20:.1f} MiB"
+        )
+
+        legacy = sqlite3.connect(legacy_path)
+        typer.echo(f"{'query':<20} {'v2':>11} {'current':>11} {'speedup':>8}")
+        with db.connection() as conn:
+            for name, (legacy_sql, current_sql) in DATABASE_QUERIES.items():
+                before = time_call(
+                    lambda: legacy.execute(legacy_sql, params[name]).fetchall(), repeat
+                )
+                after = time_call(
+                    lambda: conn.execute(current_sql, params[name]).fetchall(), repeat
+                )
+                typer.echo(
+                    f"{name:<20} {before:>8.2f} ms {after:>8.2f} ms"
+                    f" {before / after:>7.1f}x"
+                )
+        legacy.close()
+        db.pool.close()
+
+
+if __name__ == "__main__":
+    app()
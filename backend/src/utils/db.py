@@ -3,9 +3,11 @@ Database module for SQLite support.
 This module handles all database operations for the application.
 """
 
+from contextlib import contextmanager
 from datetime import datetime
 import sqlite3
 import os
+import threading
 from pathlib import Path
 import hashlib
 from typing import Any, Dict, List
@@ -46,8 +48,305 @@ def _build_date_range_clause(start_date_str=None, end_date_str=None):
     return where_clause, params
 
 
+def create_base_tables(cursor):
+    """Create the tables of the schema left by the v3 migration script."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        player_id INTEGER NOT NULL,
+        game_datetime DATETIME NOT NULL,
+        game_name TEXT NOT NULL,
+        win BOOLEAN NOT NULL,
+        admin TEXT NOT NULL,
+        FOREIGN KEY (player_id) REFERENCES players (id)
+    )
+    """)
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS admins (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        hash TEXT NOT NULL
+    )
+    """)
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS rank_changes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        player_id INTEGER NOT NULL,
+        change_type TEXT NOT NULL CHECK(change_type IN ('promotion', 'demotion')),
+        old_rank TEXT NOT NULL,
+        new_rank TEXT NOT NULL,
+        change_date TEXT NOT NULL,
+        FOREIGN KEY (player_id) REFERENCES players(id)
+    )
+    """)
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS players (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        nickname TEXT NOT NULL UNIQUE
+    )
+    """)
+
+
+def add_event_indexes(cursor):
+    """Index events by player and by date."""
+    # Covers the per-player win and loss counts without reading the table
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_events_player_datetime
+    ON events (player_id, game_datetime, win)
+    """)
+    # Date ranges of the digest
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_events_game_datetime ON events (game_datetime)
+    """)
+
+
+def add_games_table(cursor):
+    """Move the name, datetime and admin of games from events to a games table."""
+    cursor.execute("""
+    CREATE TABLE games (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        game_datetime DATETIME NOT NULL,
+        game_name TEXT NOT NULL,
+        admin_id INTEGER NOT NULL,
+        winner TEXT CHECK(winner IN ('A', 'B')),
+        FOREIGN KEY (admin_id) REFERENCES admins (id)
+    )
+    """)
+    cursor.execute("CREATE INDEX idx_games_game_datetime ON games (game_datetime)")
+
+    # Events of one game share its datetime, name and admin
+    cursor.execute("""
+    INSERT INTO games (game_datetime, game_name, admin_id)
+    SELECT game_datetime, game_name, CAST(admin AS INTEGER)
+    FROM events
+    GROUP BY game_datetime, game_name, CAST(admin AS INTEGER)
+    ORDER BY MIN(id)
+    """)
+
+    # game_datetime stays on events, so the date range of one player's games
+    # is still read from idx_events_player_datetime alone
+    cursor.execute("""
+    CREATE TABLE events_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        player_id INTEGER NOT NULL,
+        game_id INTEGER NOT NULL,
+        game_datetime DATETIME NOT NULL,
+        win BOOLEAN NOT NULL,
+        FOREIGN KEY (player_id) REFERENCES players (id),
+        FOREIGN KEY (game_id) REFERENCES games (id)
+    )
+    """)
+    cursor.execute("""
+    INSERT INTO events_new (id, player_id, game_id, game_datetime, win)
+    SELECT e.id, e.player_id, g.id, e.game_datetime, e.win
+    FROM events e
+    JOIN games g
+        ON g.game_datetime = e.game_datetime
+        AND g.game_name = e.game_name
+        AND g.admin_id = CAST(e.admin AS INTEGER)
+    """)
+    cursor.execute("DROP TABLE events")
+    cursor.execute("ALTER TABLE events_new RENAME TO events")
+    cursor.execute("""
+    CREATE INDEX idx_events_player_datetime
+    ON events (player_id, game_datetime, win)
+    """)
+    cursor.execute("CREATE INDEX idx_events_game_datetime ON events (game_datetime)")
+    cursor.execute("CREATE INDEX idx_events_game_id ON events (game_id)")
+
+    # The winning side is the one of "TeamA|VS|TeamB" listing most winners
+    cursor.execute("""
+    SELECT g.id, g.game_name, p.nickname
+    FROM events e
+    JOIN games g ON g.id = e.game_id
+    JOIN players p ON p.id = e.player_id
+    WHERE e.win
+    """)
+    votes = {}
+    for game_id, game_name, nickname in cursor.fetchall():
+        team_a, _, team_b = game_name.partition("|VS|")
+        vote = (nickname in team_a.split(",")) - (nickname in team_b.split(","))
+        votes[game_id] = votes.get(game_id, 0) + vote
+    cursor.executemany(
+        "UPDATE games SET winner = ? WHERE id = ?",
+        [
+            ("A" if vote > 0 else "B", game_id)
+            for game_id, vote in votes.items()
+            if vote
+        ],
+    )
+
+
+def add_games_admin_index(cursor):
+    """Index games by the admin who recorded them."""
+    cursor.execute("CREATE INDEX idx_games_admin_id ON games (admin_id)")
+
+
+def add_player_daily_stats(cursor):
+    """Roll the wins and losses of every player up by day."""
+    cursor.execute("""
+    CREATE TABLE player_daily_stats (
+        player_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        wins INTEGER NOT NULL,
+        losses INTEGER NOT NULL,
+        PRIMARY KEY (player_id, day),
+        FOREIGN KEY (player_id) REFERENCES players (id)
+    ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+    INSERT INTO player_daily_stats (player_id, day, wins, losses)
+    SELECT player_id, substr(game_datetime, 1, 10), SUM(win = 1), SUM(win = 0)
+    FROM events
+    GROUP BY player_id, substr(game_datetime, 1, 10)
+    """)
+
+
+# Schema migrations in order: a database at PRAGMA user_version N has had the
+# first N applied. Only ever append to this list.
+MIGRATIONS = [
+    create_base_tables,
+    add_event_indexes,
+    add_games_table,
+    add_games_admin_index,
+    add_player_daily_stats,
+]
+
+
+def migrate(conn, migrations=MIGRATIONS):
+    """
+    Apply the migrations a database has not had yet.
+
+    Every migration runs in one transaction with its user_version bump, so a
+    failing one leaves the database at the previous version. The write lock is
+    taken before reading the version, so workers starting together apply
+    each migration once.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the database
+        migrations (list): Functions taking a cursor, in order
+
+    Returns:
+        int: Schema version of the database
+
+    Raises:
+        RuntimeError: If the database is newer than the known migrations
+    """
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= len(migrations):
+                conn.rollback()
+                break
+            migrations[version](conn.cursor())
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Applied migration {version + 1}: {migrations[version].__doc__}")
+
+    if version > len(migrations):
+        raise RuntimeError(
+            f"Database schema v{version} is newer than v{len(migrations)}"
+        )
+    return version
+
+
+# Applied once to every pooled connection
+SQLITE_PRAGMAS = (
+    ("journal_mode", "WAL"),  # Readers no longer wait for a writer
+    ("synchronous", "NORMAL"),  # Safe with WAL, fsync only at checkpoints
+    ("mmap_size", 256 * 1024 * 1024),
+    ("cache_size", -16 * 1024),  # Negative values are in KiB
+    ("temp_store", "MEMORY"),
+)
+DEFAULT_POOL_SIZE = 8
+
+
+class ConnectionPool:
+    """
+    Long-lived SQLite connections shared by the threads of one process.
+
+    Connections are opened on demand, configured with SQLITE_PRAGMAS once and
+    kept idle between uses, up to `size` of them. A process forked after
+    connections were opened (e.g. a gunicorn worker of a preloading master)
+    starts with an empty pool: SQLite connections must not cross a fork, so
+    the inherited ones are left untouched rather than used or closed.
+    """
+
+    def __init__(self, db_file, size=DEFAULT_POOL_SIZE):
+        """
+        Args:
+            db_file (Path): SQLite database file
+            size (int): Idle connections kept open
+        """
+        self.db_file = db_file
+        self.size = size
+        self.idle = []
+        self._inherited = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        conn.row_factory = sqlite3.Row  # This enables column access by name
+        for name, value in SQLITE_PRAGMAS:
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._inherited.extend(self.idle)
+                self.idle = []
+                self._pid = os.getpid()
+            if self.idle:
+                return self.idle.pop()
+        return self.connect()
+
+    def release(self, conn):
+        try:
+            # Leave no transaction open for the next borrower
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
+        with self._lock:
+            if self._pid == os.getpid() and len(self.idle) < self.size:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for the duration of the block.
+
+        Changes the block did not commit are rolled back when it exits.
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Close the idle connections of this process."""
+        with self._lock:
+            idle, self.idle = self.idle, []
+        if self._pid == os.getpid():
+            for conn in idle:
+                conn.close()
+
+
 class Database:
-    def __init__(self, db_file=None):
+    def __init__(self, db_file=None, pool_size=DEFAULT_POOL_SIZE):
         # Load environment variables
         load_dotenv()
 
@@ -59,75 +358,35 @@ class Database:
             else:
                 raise Exception("DB_PATH environment variable not set")
         self.db_file = Path(db_file)
+        self.db_file.parent.mkdir(parents=True, exist_ok=True)
+        self.pool = ConnectionPool(self.db_file, pool_size)
 
         self.init_db()
 
-    def get_db_connection(self):
+    def connection(self):
         """
-        Create a connection to the SQLite database.
+        Borrow a pooled connection to the SQLite database.
+
+        Usage:
+            with db.connection() as conn:
+                ...
+
         Returns:
-            sqlite3.Connection: Database connection object
+            ContextManager[sqlite3.Connection]: Yields a connection that goes
+                                                back to the pool afterwards
         """
-        self.db_file.parent.mkdir(parents=True, exist_ok=True)
-        conn = sqlite3.connect(self.db_file)
-        conn.row_factory = sqlite3.Row  # This enables column access by name
-        return conn
+        return self.pool.connection()
 
     def init_db(self):
         """
-        Initialize the database by creating necessary tables if they don't exist.
+        Initialize the database by applying the schema migrations it lacks.
         """
-        conn = self.get_db_connection()
-        try:
-            cursor = conn.cursor()
-
-            # Create events table
-            cursor.execute("""
-            CREATE TABLE IF NOT EXISTS events (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                player_id INTEGER NOT NULL,
-                game_datetime DATETIME NOT NULL,
-                game_name TEXT NOT NULL,
-                win BOOLEAN NOT NULL,
-                admin TEXT NOT NULL,
-                FOREIGN KEY (player_id) REFERENCES players (id)
-            )
-            """)
-
-            # Create admins table
-            cursor.execute("""
-            CREATE TABLE IF NOT EXISTS admins (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL UNIQUE,
-                hash TEXT NOT NULL
-            )
-            """)
-
-            cursor.execute("""
-            CREATE TABLE IF NOT EXISTS rank_changes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                player_id INTEGER NOT NULL,
-                change_type TEXT NOT NULL CHECK(change_type IN ('promotion', 'demotion')),
-                old_rank TEXT NOT NULL,
-                new_rank TEXT NOT NULL,
-                change_date TEXT NOT NULL,
-                FOREIGN KEY (player_id) REFERENCES players(id)
-            )
-            """)
-
-            cursor.execute("""
-            CREATE TABLE IF NOT EXISTS players (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                nickname TEXT NOT NULL UNIQUE
-            )
-            """)
-
-            conn.commit()
-            print(f"Database initialized at {self.db_file}")
-        except Exception as e:
-            print(f"Error initializing database: {e}")
-        finally:
-            conn.close()
+        with self.connection() as conn:
+            try:
+                version = migrate(conn)
+                print(f"Database initialized at {self.db_file} (schema v{version})")
+            except Exception as e:
+                print(f"Error initializing database: {e}")
 
     def verify_admin_credentials(self, admin_passcode):
         """
@@ -153,43 +412,45 @@ class Database:
         if not password:
             return False, None, "Admin password cannot be empty"
 
-        conn = self.get_db_connection()
-        try:
-            cursor = conn.cursor()
+        with self.connection() as conn:
+            try:
+                cursor = conn.cursor()
 
-            # Check if admin exists
-            cursor.execute("SELECT hash, id FROM admins WHERE name = ?", (name,))
-            result = cursor.fetchone()
+                # Check if admin exists
+                cursor.execute("SELECT hash, id FROM admins WHERE name = ?", (name,))
+                result = cursor.fetchone()
 
-            if not result:
-                return False, None, f"Admin '{name}' not found"
+                if not result:
+                    return False, None, f"Admin '{name}' not found"
 
-            stored_hash = result["hash"]
+                stored_hash = result["hash"]
 
-            # Check if the stored hash contains a salt (format: hash:salt)
-            if ":" in stored_hash:
-                stored_password_hash, salt = stored_hash.split(":", 1)
+                # Check if the stored hash contains a salt (format: hash:salt)
+                if ":" in stored_hash:
+                    stored_password_hash, salt = stored_hash.split(":", 1)
 
-                # Hash the provided password with the stored salt
-                password_with_salt = password + salt
-                provided_hash = hashlib.sha256(password_with_salt.encode()).hexdigest()
+                    # Hash the provided password with the stored salt
+                    password_with_salt = password + salt
+                    provided_hash = hashlib.sha256(
+                        password_with_salt.encode()
+                    ).hexdigest()
 
-                # Compare the hashes
-                if provided_hash != stored_password_hash:
-                    return False, None, "Invalid admin password"
-            else:
-                return False, None, "Admin password is not hashed correctly"
+                    # Compare the hashes
+                    if provided_hash != stored_password_hash:
+                        return False, None, "Invalid admin password"
+                else:
+                    return False, None, "Admin password is not hashed correctly"
 
-            return True, result["id"], ""
-        except Exception as e:
-            print(f"Error verifying admin credentials: {e}")
-            return False, None, f"Error verifying admin credentials: {str(e)}"
-        finally:
-            conn.close()
+                return True, result["id"], ""
+            except Exception as e:
+                print(f"Error verifying admin credentials: {e}")
+                return False, None, f"Error verifying admin credentials: {str(e)}"
 
-    def add_events_batch(self, ids, game_datetime, game_name, wins, admin_passcode):
+    def add_events_batch(
+        self, ids, game_datetime, game_name, wins, admin_passcode, winner=None
+    ):
         """
-        Add multiple events with the same game and admin.
+        Add a game and one event per player who played it.
 
         Args:
             ids (list): List of player IDs)
@@ -197,6 +458,7 @@ class Database:
             game_name (str): Name of the game in "TeamA|VS|TeamB" format
             wins (list): List of boolean values indicating win/loss for each player
             admin_passcode (str): Admin passcode
+            winner (str): Winning side of game_name, 'A' or 'B', if known
 
         Returns:
             int: Number of events added
@@ -213,77 +475,168 @@ class Database:
         if not is_valid:
             raise ValueError(error_message)
 
-        conn = self.get_db_connection()
-        try:
-            cursor = conn.cursor()
-
-            batch_params = [
-                (player_id, game_datetime, game_name, win, admin_id)
-                for player_id, win in zip(ids, wins)
-            ]
-
-            cursor.executemany(
-                "INSERT INTO events (player_id, game_datetime, game_name, win, admin) VALUES (?, ?, ?, ?, ?)",
-                batch_params,
-            )
-            conn.commit()
-            return len(batch_params)
-        except Exception as e:
-            conn.rollback()
-            print(f"Error adding batch events: {e}")
-            raise
-        finally:
-            conn.close()
+        with self.connection() as conn:
+            try:
+                cursor = conn.cursor()
+
+                cursor.execute(
+                    "INSERT INTO games (game_datetime, game_name, admin_id, winner) VALUES (?, ?, ?, ?)",
+                    (game_datetime, game_name, admin_id, winner),
+                )
+                game_id = cursor.lastrowid
+
+                batch_params = [
+                    (player_id, game_id, game_datetime, win)
+                    for player_id, win in zip(ids, wins)
+                ]
+
+                cursor.executemany(
+                    "INSERT INTO events (player_id, game_id, game_datetime, win) VALUES (?, ?, ?, ?)",
+                    batch_params,
+                )
+
+                # Keep the daily rollup in step, days are the date part of
+                # game_datetime as in rebuild_player_daily_stats
+                cursor.executemany(
+                    """
+                    INSERT INTO player_daily_stats (player_id, day, wins, losses)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (player_id, day) DO UPDATE SET
+                        wins = wins + excluded.wins,
+                        losses = losses + excluded.losses
+                    """,
+                    [
+                        (player_id, game_datetime[:10], int(win), int(not win))
+                        for player_id, win in zip(ids, wins)
+                    ],
+                )
+                conn.commit()
+                return len(batch_params)
+            except Exception as e:
+                conn.rollback()
+                print(f"Error adding batch events: {e}")
+                raise
 
     def get_all_player_stats(self) -> Dict[str, Any]:
         """
         Get total wins and losses over the last 30 days for ALL players.
 
-        This function joins the players and events tables to calculate statistics,
-        ensuring all players are returned, even those with no recent activity.
+        This function sums the daily rollup of each player, at most 30 rows
+        per player, ensuring all players are returned, even those with no
+        recent activity.
 
         Returns:
             list: A list of dictionaries, where each dictionary contains a player's
                   id, nickname, and their win/loss stats.
                   Format: [{'id': 1, 'nickname': 'p1', 'stats': {'wins': 10, 'losses': 5}}, ...]
         """
-        conn = self.get_db_connection()
-        try:
-            cursor = conn.cursor()
-
-            # A LEFT JOIN ensures all players are included, even if they have no events.
-            # The date filter is applied to the JOIN condition to correctly calculate stats.
-            query = """
-                SELECT
-                    p.id,
-                    p.nickname,
-                    SUM(CASE WHEN e.win = 1 THEN 1 ELSE 0 END) as wins,
-                    SUM(CASE WHEN e.win = 0 THEN 1 ELSE 0 END) as losses
-                FROM
-                    players AS p
-                LEFT JOIN
-                    events AS e ON p.id = e.player_id AND e.game_datetime >= ?
-                GROUP BY
-                    p.id;
-            """
-
-            cursor.execute(query, [date_month_ago()])
-
-            results = {}
-            for row in cursor.fetchall():
-                results[row["nickname"]] = {
-                    "id": row["id"],
-                    "nickname": row["nickname"],
-                    "wins": row["wins"] or 0,
-                    "losses": row["losses"] or 0,
-                }
+        with self.connection() as conn:
+            try:
+                cursor = conn.cursor()
+
+                # A LEFT JOIN ensures all players are included, even if they have no events.
+                # The date filter is applied to the JOIN condition to correctly calculate stats.
+                query = """
+                    SELECT
+                        p.id,
+                        p.nickname,
+                        SUM(s.wins) as wins,
+                        SUM(s.losses) as losses
+                    FROM
+                        players AS p
+                    LEFT JOIN
+                        player_daily_stats AS s ON p.id = s.player_id AND s.day >= ?
+                    GROUP BY
+                        p.id;
+                """
 
-            return results
-        except Exception as e:
-            print(f"Error getting all player stats: {e}")
-            return []
-        finally:
-            conn.close()
+                cursor.execute(query, [date_month_ago()])
+
+                results = {}
+                for row in cursor.fetchall():
+                    results[row["nickname"]] = {
+                        "id": row["id"],
+                        "nickname": row["nickname"],
+                        "wins": row["wins"] or 0,
+                        "losses": row["losses"] or 0,
+                    }
+
+                return results
+            except Exception as e:
+                print(f"Error getting all player stats: {e}")
+                return []
+
+    def rebuild_player_daily_stats(self):
+        """
+        Recompute the daily rollup of wins and losses from the events.
+
+        Returns:
+            int: Number of (player, day) rows in the rollup
+        """
+        with self.connection() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM player_daily_stats")
+                cursor.execute("""
+                    INSERT INTO player_daily_stats (player_id, day, wins, losses)
+                    SELECT
+                        player_id,
+                        substr(game_datetime, 1, 10),
+                        SUM(win = 1),
+                        SUM(win = 0)
+                    FROM events
+                    GROUP BY player_id, substr(game_datetime, 1, 10)
+                """)
+                conn.commit()
+                return cursor.rowcount
+            except Exception as e:
+                conn.rollback()
+                print(f"Error rebuilding player daily stats: {e}")
+                raise
+
+    def get_game_results(self, after_id=0):
+        """
+        Get the teams of every game recorded after an event id, oldest first.
+
+        Players who won a game form one team and the others the opposing team.
+
+        Args:
+            after_id (int): Only events with a larger id are read
+
+        Returns:
+            tuple: (games, last_id) where games is a list of
+                   (winner_ids, loser_ids) tuples and last_id is the largest
+                   event id read, or after_id when there are none
+        """
+        with self.connection() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute(
+                    """
+                    SELECT id, player_id, game_id, win
+                    FROM events
+                    WHERE id > ?
+                    ORDER BY id
+                    """,
+                    (after_id,),
+                )
+
+                games = {}
+                last_id = after_id
+                for row in cursor.fetchall():
+                    winners, losers = games.setdefault(row["game_id"], ([], []))
+                    (winners if row["win"] else losers).append(row["player_id"])
+                    last_id = row["id"]
+
+                # Games missing a side carry no comparison between players
+                return [
+                    (winners, losers)
+                    for winners, losers in games.values()
+                    if winners and losers
+                ], last_id
+            except Exception as e:
+                print(f"Error getting game results: {e}")
+                return [], after_id
 
     def admin_exists(self, name):
         """
@@ -295,17 +648,15 @@ class Database:
         Returns:
             bool: True if admin exists, False otherwise
         """
-        conn = self.get_db_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute("SELECT id FROM admins WHERE name = ?", (name,))
-            result = cursor.fetchone()
-            return result is not None
-        except Exception as e:
-            print(f"Error checking if admin exists: {e}")
-            return False
-        finally:
-            conn.close()
+        with self.connection() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT id FROM admins WHERE name = ?", (name,))
+                result = cursor.fetchone()
+                return result is not None
+            except Exception as e:
+                print(f"Error checking if admin exists: {e}")
+                return False
 
     def add_admin(self, name, saled_passcode_hash):
         """
@@ -325,22 +676,20 @@ class Database:
         if self.admin_exists(name):
             raise ValueError(f"Admin with name '{name}' already exists")
 
-        conn = self.get_db_connection()
-        try:
-            cursor = conn.cursor()
-
-            cursor.execute(
-                "INSERT INTO admins (name, hash) VALUES (?, ?)",
-                (name, saled_passcode_hash),
-            )
-            conn.commit()
-            return cursor.lastrowid
-        except Exception as e:
-            conn.rollback()
-            print(f"Error adding admin: {e}")
-            raise
-        finally:
-            conn.close()
+        with self.connection() as conn:
+            try:
+                cursor = conn.cursor()
+
+                cursor.execute(
+                    "INSERT INTO admins (name, hash) VALUES (?, ?)",
+                    (name, saled_passcode_hash),
+                )
+                conn.commit()
+                return cursor.lastrowid
+            except Exception as e:
+                conn.rollback()
+                print(f"Error adding admin: {e}")
+                raise
 
     def remove_admin_by_name(self, name):
         """
@@ -352,28 +701,26 @@ class Database:
         Returns:
             bool: True if admin was removed, False if admin was not found
         """
-        conn = self.get_db_connection()
-        try:
-            cursor = conn.cursor()
-
-            # Check if admin exists
-            cursor.execute("SELECT * FROM admins WHERE name = ?", (name,))
-            admin = cursor.fetchone()
-
-            if not admin:
+        with self.connection() as conn:
+            try:
+                cursor = conn.cursor()
+
+                # Check if admin exists
+                cursor.execute("SELECT * FROM admins WHERE name = ?", (name,))
+                admin = cursor.fetchone()
+
+                if not admin:
+                    return False
+
+                # Delete the admin
+                cursor.execute("DELETE FROM admins WHERE name = ?", (name,))
+                conn.commit()
+                return True
+            except Exception as e:
+                conn.rollback()
+                print(f"Error removing admin: {e}")
                 return False
 
-            # Delete the admin
-            cursor.execute("DELETE FROM admins WHERE name = ?", (name,))
-            conn.commit()
-            return True
-        except Exception as e:
-            conn.rollback()
-            print(f"Error removing admin: {e}")
-            return False
-        finally:
-            conn.close()
-
     def delete_user_events(self, nickname):
         """
         Delete all events for a specific user by nickname.
@@ -384,31 +731,41 @@ class Database:
         Returns:
             int: Number of events deleted
         """
-        conn = self.get_db_connection()
-        try:
-            cursor = conn.cursor()
-
-            # Get count of events to be deleted for return value
-            cursor.execute(
-                "SELECT COUNT(*) FROM events WHERE nickname = ?", (nickname,)
-            )
-            events_count = cursor.fetchone()[0]
-
-            if events_count == 0:
-                # No events found for this nickname
-                return 0
-
-            # Delete all events for the specified nickname
-            cursor.execute("DELETE FROM events WHERE nickname = ?", (nickname,))
-            conn.commit()
-
-            return events_count
-        except Exception as e:
-            conn.rollback()
-            print(f"Error deleting user events: {e}")
-            return -1
-        finally:
-            conn.close()
+        with self.connection() as conn:
+            try:
+                cursor = conn.cursor()
+
+                cursor.execute("SELECT id FROM players WHERE nickname = ?", (nickname,))
+                player = cursor.fetchone()
+                if player is None:
+                    return 0
+
+                # Get count of events to be deleted for return value
+                cursor.execute(
+                    "SELECT COUNT(*) FROM events WHERE player_id = ?", (player["id"],)
+                )
+                events_count = cursor.fetchone()[0]
+
+                if events_count == 0:
+                    # No events found for this nickname
+                    return 0
+
+                # Delete all events of the player and, in the same transaction,
+                # the daily stats rolled up from them
+                cursor.execute(
+                    "DELETE FROM events WHERE player_id = ?", (player["id"],)
+                )
+                cursor.execute(
+                    "DELETE FROM player_daily_stats WHERE player_id = ?",
+                    (player["id"],),
+                )
+                conn.commit()
+
+                return events_count
+            except Exception as e:
+                conn.rollback()
+                print(f"Error deleting user events: {e}")
+                return -1
 
     def add_rank_change(self, player_id, change_type, old_rank, new_rank, change_date):
         """
@@ -432,25 +789,23 @@ class Database:
         if change_type not in ["promotion", "demotion"]:
             raise ValueError("change_type must be either 'promotion' or 'demotion'")
 
-        conn = self.get_db_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                INSERT INTO rank_changes 
-                    (player_id, change_type, old_rank, new_rank, change_date)
-                VALUES (?, ?, ?, ?, ?)
-                """,
-                (player_id, change_type, old_rank, new_rank, change_date),
-            )
-            conn.commit()
-            return cursor.lastrowid
-        except Exception as e:
-            conn.rollback()
-            print(f"Error adding rank change: {e}")
-            raise
-        finally:
-            conn.close()
+        with self.connection() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute(
+                    """
+                    INSERT INTO rank_changes 
+                        (player_id, change_type, old_rank, new_rank, change_date)
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
+                    (player_id, change_type, old_rank, new_rank, change_date),
+                )
+                conn.commit()
+                return cursor.lastrowid
+            except Exception as e:
+                conn.rollback()
+                print(f"Error adding rank change: {e}")
+                raise
 
     def get_player_rank_history(self, player_id):
         """
@@ -463,26 +818,24 @@ class Database:
             list: A list of dictionaries, where each dictionary is a rank change event.
                 Returns an empty list if no history is found.
         """
-        conn = self.get_db_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                SELECT rc.change_type, rc.old_rank, rc.new_rank, rc.change_date
-                FROM rank_changes rc
-                WHERE rc.player_id = ?
-                ORDER BY rc.change_date DESC
-                """,
-                (player_id,),
-            )
-            # Convert rows to dictionaries for easier use
-            history = [dict(row) for row in cursor.fetchall()]
-            return history
-        except Exception as e:
-            print(f"Error getting player rank history: {e}")
-            return []
-        finally:
-            conn.close()
+        with self.connection() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute(
+                    """
+                    SELECT rc.change_type, rc.old_rank, rc.new_rank, rc.change_date
+                    FROM rank_changes rc
+                    WHERE rc.player_id = ?
+                    ORDER BY rc.change_date DESC
+                    """,
+                    (player_id,),
+                )
+                # Convert rows to dictionaries for easier use
+                history = [dict(row) for row in cursor.fetchall()]
+                return history
+            except Exception as e:
+                print(f"Error getting player rank history: {e}")
+                return []
 
     def get_player_games_history(self, player_id):
         """
@@ -495,26 +848,25 @@ class Database:
             list: A list of dictionaries, where each dictionary is a game event.
                 Returns an empty list if no history is found.
         """
-        conn = self.get_db_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                SELECT game_datetime, game_name, win, a.name as admin_name
-                FROM events e
-                JOIN admins a ON e.admin = CAST(a.id AS TEXT)
-                WHERE e.player_id = ? and e.game_datetime >= ?
-                ORDER BY e.game_datetime DESC
-                """,
-                (player_id, date_days_ago(60)),
-            )
-            history = [dict(row) for row in cursor.fetchall()]
-            return history
-        except Exception as e:
-            print(f"Error getting player games history: {e}")
-            return []
-        finally:
-            conn.close()
+        with self.connection() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute(
+                    """
+                    SELECT g.game_datetime, g.game_name, e.win, a.name as admin_name
+                    FROM events e
+                    JOIN games g ON g.id = e.game_id
+                    JOIN admins a ON a.id = g.admin_id
+                    WHERE e.player_id = ? and e.game_datetime >= ?
+                    ORDER BY e.game_datetime DESC
+                    """,
+                    (player_id, date_days_ago(60)),
+                )
+                history = [dict(row) for row in cursor.fetchall()]
+                return history
+            except Exception as e:
+                print(f"Error getting player games history: {e}")
+                return []
 
     def get_or_create_player_ids(self, nicknames: List[str]) -> Dict[str, int]:
         """
@@ -530,46 +882,41 @@ class Database:
         if not unique_nicknames:
             return {}
 
-        connection = None
-        try:
-            connection = self.get_db_connection()
-            cursor = connection.cursor()
-
-            # Start a transaction for atomicity
-            cursor.execute("BEGIN")
-
-            # Step 1: UPSERT all nicknames.
-            # This single operation ensures every nickname exists in the table.
-            # It's faster because we don't need to check for existence first.
-            new_players_data = [(name,) for name in unique_nicknames]
-            cursor.executemany(
-                "INSERT OR IGNORE INTO players (nickname) VALUES (?)", new_players_data
-            )
+        with self.connection() as connection:
+            try:
+                cursor = connection.cursor()
 
-            # Step 2: SELECT all IDs at once.
-            # Now that all players are guaranteed to exist, fetch their IDs in one go.
-            placeholders = ", ".join(["?"] * len(unique_nicknames))
-            query = (
-                f"SELECT id, nickname FROM players WHERE nickname IN ({placeholders})"
-            )
+                # Start a transaction for atomicity
+                cursor.execute("BEGIN")
 
-            cursor.execute(query, unique_nicknames)
+                # Step 1: UPSERT all nicknames.
+                # This single operation ensures every nickname exists in the table.
+                # It's faster because we don't need to check for existence first.
+                new_players_data = [(name,) for name in unique_nicknames]
+                cursor.executemany(
+                    "INSERT OR IGNORE INTO players (nickname) VALUES (?)",
+                    new_players_data,
+                )
 
-            # Commit the transaction after all operations are queued
-            connection.commit()
+                # Step 2: SELECT all IDs at once.
+                # Now that all players are guaranteed to exist, fetch their IDs in one go.
+                placeholders = ", ".join(["?"] * len(unique_nicknames))
+                query = f"SELECT id, nickname FROM players WHERE nickname IN ({placeholders})"
 
-            # Use a dictionary comprehension for a concise and fast mapping
-            return {nickname: player_id for player_id, nickname in cursor.fetchall()}
+                cursor.execute(query, unique_nicknames)
 
-        except sqlite3.Error as e:
-            print(f"❌ An error occurred: {e}")
-            if connection:
-                connection.rollback()
-            return {}
+                # Commit the transaction after all operations are queued
+                connection.commit()
 
-        finally:
-            if connection:
-                connection.close()
+                # Use a dictionary comprehension for a concise and fast mapping
+                return {
+                    nickname: player_id for player_id, nickname in cursor.fetchall()
+                }
+
+            except sqlite3.Error as e:
+                print(f"❌ An error occurred: {e}")
+                connection.rollback()
+                return {}
 
     def get_player_nickname(self, player_id):
         """
@@ -581,16 +928,14 @@ class Database:
         Returns:
             The player's nickname, or None if not found.
         """
-        connection = None
-        try:
-            connection = self.get_db_connection()
-            cursor = connection.cursor()
-            cursor.execute("SELECT nickname FROM players WHERE id = ?", (player_id,))
-            result = cursor.fetchone()
-            return result[0] if result else None
-        except sqlite3.Error as e:
-            print(f"❌ An error occurred: {e}")
-            return None
-        finally:
-            if connection:
-                connection.close()
+        with self.connection() as connection:
+            try:
+                cursor = connection.cursor()
+                cursor.execute(
+                    "SELECT nickname FROM players WHERE id = ?", (player_id,)
+                )
+                result = cursor.fetchone()
+                return result[0] if result else None
+            except sqlite3.Error as e:
+                print(f"❌ An error occurred: {e}")
+                return None
@@ -44,58 +44,52 @@ def get_top_active_players(start_date_str, end_date_str, top_n=10):
     query_start_datetime = f"{start_date_str} 00:00:00"
     query_end_datetime = f"{end_date_str} 23:59:59"
 
-    conn = None
     results = []
     try:
-        conn = db.get_db_connection()
-        cursor = conn.cursor()
-
-        # MODIFIED: Join with players table to get nickname
-        sql_query = """
-            SELECT
-                p.id,
-                p.nickname,
-                COUNT(e.id) as event_count
-            FROM
-                events e
-            JOIN
-                players p ON e.player_id = p.id
-            WHERE
-                e.game_datetime BETWEEN ? AND ?
-            GROUP BY
-                p.nickname
-            ORDER BY
-                event_count DESC
-            LIMIT ?
-        """
-        cursor.execute(sql_query, (query_start_datetime, query_end_datetime, top_n))
-
-        rows = cursor.fetchall()
-        for row in rows:
-            results.append(
-                {
-                    "nickname": row["nickname"],
-                    "game_count": row["event_count"],
-                    "id": row["id"],
-                }
-            )
+        with db.connection() as conn:
+            cursor = conn.cursor()
+
+            # MODIFIED: Join with players table to get nickname
+            sql_query = """
+                SELECT
+                    p.id,
+                    p.nickname,
+                    COUNT(e.id) as event_count
+                FROM
+                    events e
+                JOIN
+                    players p ON e.player_id = p.id
+                WHERE
+                    e.game_datetime BETWEEN ? AND ?
+                GROUP BY
+                    p.nickname
+                ORDER BY
+                    event_count DESC
+                LIMIT ?
+            """
+            cursor.execute(sql_query, (query_start_datetime, query_end_datetime, top_n))
+
+            rows = cursor.fetchall()
+            for row in rows:
+                results.append(
+                    {
+                        "nickname": row["nickname"],
+                        "game_count": row["event_count"],
+                        "id": row["id"],
+                    }
+                )
 
     except sqlite3.Error as e:
         print(f"Database error: {e}")
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
-    finally:
-        if conn:
-            conn.close()
 
     return results
 
 
 def get_top_admins_by_contribution(start_date_str=None, end_date_str=None, top_n=10):
     """
-    Retrieves the top N admins based on the number of distinct games they are
-    associated with (i.e., for which they recorded events).
-    Assumes 'events.admin' stores the admin's ID as a TEXT string.
+    Retrieves the top N admins based on the number of games they recorded.
 
     Args:
         start_date_str (str, optional): Start date of the period (YYYY-MM-DD).
@@ -115,11 +109,11 @@ def get_top_admins_by_contribution(start_date_str=None, end_date_str=None, top_n
     base_sql = """
         SELECT
             a.name AS admin_name,
-            COUNT(DISTINCT e.game_name || '|' || e.game_datetime) AS distinct_games_count
+            COUNT(*) AS distinct_games_count
         FROM
-            events e
+            games g
         JOIN
-            admins a ON e.admin = CAST(a.id AS TEXT)
+            admins a ON a.id = g.admin_id
     """
 
     final_query_parts = [base_sql]
@@ -143,45 +137,40 @@ def get_top_admins_by_contribution(start_date_str=None, end_date_str=None, top_n
 
     sql_query = " ".join(final_query_parts)
 
-    conn = None
     results = []
     try:
-        conn = db.get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(sql_query, tuple(final_params))
-        rows = cursor.fetchall()
-        for row in rows:
-            results.append(
-                {
-                    "admin_name": row["admin_name"],
-                    "distinct_games_count": row["distinct_games_count"],
-                }
-            )
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_query, tuple(final_params))
+            rows = cursor.fetchall()
+            for row in rows:
+                results.append(
+                    {
+                        "admin_name": row["admin_name"],
+                        "distinct_games_count": row["distinct_games_count"],
+                    }
+                )
     except sqlite3.Error as e:
         print(f"Database error in get_top_admins_by_contribution: {e}")
     except Exception as e:
         print(f"An unexpected error occurred in get_top_admins_by_contribution: {e}")
-    finally:
-        if conn:
-            conn.close()
 
     return results
 
 
 def get_all_unique_games(start_date_str=None, end_date_str=None):
     """
-    Retrieves all unique game events, including game name, datetime,
-    and admin name.
+    Retrieves all games, including game name, datetime, and admin name.
     """
     base_sql = """
-        SELECT DISTINCT
-            e.game_name,
-            e.game_datetime,
+        SELECT
+            g.game_name,
+            g.game_datetime,
             a.name AS admin_name
         FROM
-            events e
+            games g
         JOIN
-            admins a ON e.admin = CAST(a.id AS TEXT)
+            admins a ON a.id = g.admin_id
     """
 
     final_query_parts = [base_sql]
@@ -196,30 +185,23 @@ def get_all_unique_games(start_date_str=None, end_date_str=None):
 
     final_query_parts.append("""
         ORDER BY
-            e.game_datetime DESC
+            g.game_datetime DESC
     """)
 
     sql_query = " ".join(final_query_parts)
 
-    conn = None
     results = []
     try:
-        conn = db.get_db_connection()
-        if not conn:
-            return []
-
-        cursor = conn.cursor()
-        cursor.execute(sql_query, tuple(final_params))
-        rows = cursor.fetchall()
-        for row in rows:
-            results.append(dict(row))
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_query, tuple(final_params))
+            rows = cursor.fetchall()
+            for row in rows:
+                results.append(dict(row))
     except sqlite3.Error as e:
         print(f"Database error in get_all_unique_games: {e}")
     except Exception as e:
         print(f"An unexpected error occurred in get_all_unique_games: {e}")
-    finally:
-        if conn:
-            conn.close()
 
     return results
 
@@ -230,25 +212,24 @@ def get_game_activity_by_hour(start_date_str=None, end_date_str=None):
     """
     hourly_activity = [{"hour_of_day": f"{h:02d}", "game_count": 0} for h in range(24)]
 
-    base_sql = "SELECT strftime('%H', game_datetime) as hour_str, COUNT(DISTINCT game_name || '|' || game_datetime) as game_count FROM events"
+    base_sql = "SELECT strftime('%H', game_datetime) as hour_str, COUNT(*) as game_count FROM games"
 
     where_clause, params = db_utils._build_date_range_clause(
         start_date_str, end_date_str
     )
     sql_query = base_sql + where_clause + " GROUP BY hour_str ORDER BY hour_str"
 
-    conn = None
     try:
-        conn = db.get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(sql_query, params)
-        rows = cursor.fetchall()
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_query, params)
+            rows = cursor.fetchall()
 
-        db_results = {row["hour_str"]: row["game_count"] for row in rows}
+            db_results = {row["hour_str"]: row["game_count"] for row in rows}
 
-        for item in hourly_activity:
-            if item["hour_of_day"] in db_results:
-                item["game_count"] = db_results[item["hour_of_day"]]
+            for item in hourly_activity:
+                if item["hour_of_day"] in db_results:
+                    item["game_count"] = db_results[item["hour_of_day"]]
 
     except sqlite3.Error as e:
         print(f"Database error in get_game_activity_by_hour: {e}")
@@ -256,9 +237,6 @@ def get_game_activity_by_hour(start_date_str=None, end_date_str=None):
     except Exception as e:
         print(f"An unexpected error in get_game_activity_by_hour: {e}")
         return []
-    finally:
-        if conn:
-            conn.close()
 
     return hourly_activity
 
@@ -283,25 +261,24 @@ def get_game_activity_by_day_of_week(
     ]
     time_shift_modifier = f"-{int(hours_shift)} hours"
 
-    base_sql = "SELECT strftime('%w', datetime(game_datetime, ?)) as day_w_str, COUNT(DISTINCT game_name || '|' || game_datetime) as game_count FROM events"
+    base_sql = "SELECT strftime('%w', datetime(game_datetime, ?)) as day_w_str, COUNT(*) as game_count FROM games"
     where_clause, date_filter_params = db_utils._build_date_range_clause(
         start_date_str, end_date_str
     )
     sql_query = base_sql + where_clause + " GROUP BY day_w_str ORDER BY day_w_str"
     final_params = [time_shift_modifier] + date_filter_params
 
-    conn = None
     try:
-        conn = db.get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(sql_query, final_params)
-        rows = cursor.fetchall()
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_query, final_params)
+            rows = cursor.fetchall()
 
-        db_results = {int(row["day_w_str"]): row["game_count"] for row in rows}
+            db_results = {int(row["day_w_str"]): row["game_count"] for row in rows}
 
-        for item in weekly_activity:
-            if item["day_numeric"] in db_results:
-                item["game_count"] = db_results[item["day_numeric"]]
+            for item in weekly_activity:
+                if item["day_numeric"] in db_results:
+                    item["game_count"] = db_results[item["day_numeric"]]
 
     except sqlite3.Error as e:
         print(f"Database error in get_game_activity_by_day_of_week: {e}")
@@ -309,9 +286,6 @@ def get_game_activity_by_day_of_week(
     except Exception as e:
         print(f"An unexpected error in get_game_activity_by_day_of_week: {e}")
         return []
-    finally:
-        if conn:
-            conn.close()
 
     return weekly_activity
 
@@ -327,7 +301,7 @@ def get_game_activity_by_day_of_month(
     ]
 
     time_shift_modifier = f"-{int(hours_shift)} hours"
-    base_sql = "SELECT strftime('%d', datetime(game_datetime, ?)) as day_m_str, COUNT(DISTINCT game_name || '|' || game_datetime) as game_count FROM events"
+    base_sql = "SELECT strftime('%d', datetime(game_datetime, ?)) as day_m_str, COUNT(*) as game_count FROM games"
 
     where_clause, date_filter_params = db_utils._build_date_range_clause(
         start_date_str, end_date_str
@@ -335,18 +309,17 @@ def get_game_activity_by_day_of_month(
     sql_query = base_sql + where_clause + " GROUP BY day_m_str ORDER BY day_m_str"
     final_params = [time_shift_modifier] + date_filter_params
 
-    conn = None
     try:
-        conn = db.get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(sql_query, final_params)
-        rows = cursor.fetchall()
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_query, final_params)
+            rows = cursor.fetchall()
 
-        db_results = {row["day_m_str"]: row["game_count"] for row in rows}
+            db_results = {row["day_m_str"]: row["game_count"] for row in rows}
 
-        for item in monthly_activity_by_day:
-            if item["day_of_month"] in db_results:
-                item["game_count"] = db_results[item["day_of_month"]]
+            for item in monthly_activity_by_day:
+                if item["day_of_month"] in db_results:
+                    item["game_count"] = db_results[item["day_of_month"]]
 
     except sqlite3.Error as e:
         print(f"Database error in get_game_activity_by_day_of_month: {e}")
@@ -354,9 +327,6 @@ def get_game_activity_by_day_of_month(
     except Exception as e:
         print(f"An unexpected error in get_game_activity_by_day_of_month: {e}")
         return []
-    finally:
-        if conn:
-            conn.close()
 
     return monthly_activity_by_day
 
@@ -418,63 +388,61 @@ def get_player_promotion_demotion_candidates(
     final_query_parts.append("GROUP BY p.id, p.nickname")
     sql_query = " ".join(final_query_parts)
 
-    conn = None
     players_for_status_change = []
     try:
-        conn = db.get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(sql_query, tuple(params))
-        player_stats = cursor.fetchall()
-
-        for row in player_stats:
-            # MODIFIED: Get player_id from the query result
-            player_id = row["player_id"]
-            nickname = row["nickname"]
-            total_games = int(row["total_games"])
-            total_wins = int(row["total_wins"] if row["total_wins"] is not None else 0)
-
-            if total_games >= min_games_threshold:
-                win_rate_percentage = 0.0
-                if total_games > 0:
-                    win_rate_percentage = (total_wins / total_games) * 100.0
-
-                status = "Maintain"
-                if win_rate_percentage > promotion_win_rate_pct:
-                    status = "Promote"
-                elif win_rate_percentage < demotion_win_rate_pct:
-                    status = "Demote"
-
-                if status in ["Promote", "Demote"]:
-                    score = scores.get(nickname, None)
-                    if score:
-                        ix = SCORES.index(score)
-                        new_ix = ix + (1 if status == "Promote" else -1)
-                        new_score = SCORES[new_ix]
-                    else:
-                        continue
-
-                    # MODIFIED: Include player_id in the result
-                    players_for_status_change.append(
-                        {
-                            "player_id": player_id,
-                            "nickname": nickname,
-                            "total_games_played": total_games,
-                            "wins": total_wins,
-                            "losses": total_games - total_wins,
-                            "win_rate_percentage": round(win_rate_percentage, 2),
-                            "status": status,
-                            "current_score": score,
-                            "new_score": new_score,
-                        }
-                    )
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_query, tuple(params))
+            player_stats = cursor.fetchall()
+
+            for row in player_stats:
+                # MODIFIED: Get player_id from the query result
+                player_id = row["player_id"]
+                nickname = row["nickname"]
+                total_games = int(row["total_games"])
+                total_wins = int(
+                    row["total_wins"] if row["total_wins"] is not None else 0
+                )
+
+                if total_games >= min_games_threshold:
+                    win_rate_percentage = 0.0
+                    if total_games > 0:
+                        win_rate_percentage = (total_wins / total_games) * 100.0
+
+                    status = "Maintain"
+                    if win_rate_percentage > promotion_win_rate_pct:
+                        status = "Promote"
+                    elif win_rate_percentage < demotion_win_rate_pct:
+                        status = "Demote"
+
+                    if status in ["Promote", "Demote"]:
+                        score = scores.get(nickname, None)
+                        if score:
+                            ix = SCORES.index(score)
+                            new_ix = ix + (1 if status == "Promote" else -1)
+                            new_score = SCORES[new_ix]
+                        else:
+                            continue
+
+                        # MODIFIED: Include player_id in the result
+                        players_for_status_change.append(
+                            {
+                                "player_id": player_id,
+                                "nickname": nickname,
+                                "total_games_played": total_games,
+                                "wins": total_wins,
+                                "losses": total_games - total_wins,
+                                "win_rate_percentage": round(win_rate_percentage, 2),
+                                "status": status,
+                                "current_score": score,
+                                "new_score": new_score,
+                            }
+                        )
 
     except sqlite3.Error as e:
         print(f"Database error in get_player_promotion_demotion_candidates: {e}")
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
-    finally:
-        if conn:
-            conn.close()
 
     return players_for_status_change
 
@@ -0,0 +1,195 @@
+"""
+Executors that run team balancing off the request thread.
+"""
+
+from collections import deque
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import partial
+import multiprocessing
+import os
+import threading
+
+
+class QueueFullError(Exception):
+    """Raised when every worker is busy and the queue is at its depth."""
+
+
+class DeadlineExceededError(Exception):
+    """Raised when a task did not finish before its deadline."""
+
+
+class InlineExecutor:
+    """Runs tasks on the calling thread. Deadlines are left to the task."""
+
+    max_workers = 1
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def run(self, fn, *args, timeout=None, **kwargs):
+        return fn(*args, **kwargs)
+
+    def shutdown(self):
+        pass
+
+
+class ProcessExecutor:
+    """
+    Runs tasks on a bounded pool of worker processes, so a long balance does
+    not hold the GIL of the web worker serving other requests.
+
+    At most max_workers tasks run and max_queue more wait; anything beyond
+    that is rejected immediately with QueueFullError instead of piling up.
+    Waiting tasks are kept here rather than in the pool, which would mark
+    them as running and make them impossible to cancel.
+
+    The pool is started lazily, after the web server has forked its workers,
+    and every process runs `initializer` once to warm up (e.g. map the
+    balancer tables) before taking tasks. Workers come from a forkserver
+    rather than a fork of the web worker, whose other threads may hold locks
+    that the child would inherit held forever.
+    """
+
+    def __init__(self, max_workers=2, max_queue=8, initializer=None):
+        """
+        Args:
+            max_workers (int): Worker processes
+            max_queue (int): Tasks allowed to wait for a free worker
+            initializer (callable): Run once in every worker process
+        """
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.initializer = initializer
+        self.pool = None
+        self.pending = deque()
+        self.running = 0
+        self._lock = threading.RLock()
+        self._pid = None
+
+    def get_pool(self):
+        with self._lock:
+            # A pool inherited through fork has no live workers in this process
+            if self.pool is None or self._pid != os.getpid():
+                self.pool = ProcessPoolExecutor(
+                    self.max_workers,
+                    mp_context=multiprocessing.get_context("forkserver"),
+                    initializer=self.initializer,
+                )
+                self._pid = os.getpid()
+                self.pending.clear()
+                self.running = 0
+                # Start every worker now rather than on the first busy moment
+                for future in [
+                    self.pool.submit(os.getpid) for _ in range(self.max_workers)
+                ]:
+                    future.result()
+            return self.pool
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue fn(*args, **kwargs) for the next free worker.
+
+        Returns:
+            Future: Can be cancelled until a worker picks the task up
+
+        Raises:
+            QueueFullError: When no worker or queue slot is free
+        """
+        future = Future()
+        with self._lock:
+            self.get_pool()
+            self.pending = deque(
+                task for task in self.pending if not task[0].cancelled()
+            )
+            if self.running + len(self.pending) >= self.max_workers + self.max_queue:
+                raise QueueFullError("Too many balance requests in progress")
+            self.pending.append((future, fn, args, kwargs))
+            self.dispatch()
+        return future
+
+    def dispatch(self):
+        """Hand waiting tasks to the pool while workers are free."""
+        with self._lock:
+            while self.running < self.max_workers and self.pending:
+                future, fn, args, kwargs = self.pending.popleft()
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self.running += 1
+                task = self.pool.submit(fn, *args, **kwargs)
+                task.add_done_callback(partial(self.finish, future))
+
+    def finish(self, future, task):
+        with self._lock:
+            self.running -= 1
+        # Shutting the pool down cancels tasks it has not started, and
+        # exception() would raise CancelledError inside this callback. The
+        # future is already running, so it can only fail.
+        if task.cancelled():
+            future.set_exception(CancelledError("The balance pool was shut down"))
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
+        self.dispatch()
+
+    def run(self, fn, *args, timeout=None, **kwargs):
+        """
+        Run fn(*args, **kwargs) on a worker and wait for its result.
+
+        Args:
+            timeout (float): Seconds to wait before giving up on the task
+
+        Raises:
+            QueueFullError: When no worker or queue slot is free
+            DeadlineExceededError: When the task missed the timeout
+        """
+        return wait_for(self.submit(fn, *args, **kwargs), timeout)
+
+    def shutdown(self):
+        with self._lock:
+            for future, *_ in self.pending:
+                future.cancel()
+            self.pending.clear()
+            if self.pool is not None:
+                self.pool.shutdown(wait=False, cancel_futures=True)
+                self.pool = None
+
+
+def wait_for(future, timeout):
+    """
+    Result of a submitted task, waiting at most timeout seconds.
+
+    Raises:
+        DeadlineExceededError: When the task missed the timeout. A task still
+                               waiting for a worker is cancelled; a running one
+                               is expected to honour its own time budget.
+    """
+    try:
+        return future.result(timeout)
+    except (FutureTimeoutError, CancelledError):
+        future.cancel()
+        raise DeadlineExceededError("Balancing did not finish in time")
+
+
+def create_executor(kind, max_workers=2, max_queue=8, initializer=None):
+    """
+    Build the executor selected by configuration.
+
+    Args:
+        kind (str): "process" for a ProcessExecutor, "inline" to run tasks on
+                    the request thread
+
+    Returns:
+        InlineExecutor | ProcessExecutor
+    """
+    if kind == "process":
+        return ProcessExecutor(max_workers, max_queue, initializer)
+    if kind == "inline":
+        return InlineExecutor()
+    raise ValueError(f"Unknown balance executor: {kind}")
@@ -0,0 +1,115 @@
+"""
+In-process measurements of team balancing cost.
+"""
+
+from collections import Counter, deque
+from contextlib import contextmanager
+import threading
+import tracemalloc
+
+import numpy as np
+
+# Upper bounds in ms of the latency histogram buckets, the last one open
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+
+
+@contextmanager
+def traced_peak():
+    """
+    Trace Python and NumPy allocations for the duration of the block.
+
+    Yields:
+        dict: Holds 'peak_bytes', the peak traced allocation since the block
+              started, once the block exits. Tracing is process-wide, so
+              blocks running concurrently on other threads share the peak.
+    """
+    global _tracing_users
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _tracing_users += 1
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+    memory = {"peak_bytes": None}
+    try:
+        yield memory
+    finally:
+        with _tracing_lock:
+            memory["peak_bytes"] = max(0, tracemalloc.get_traced_memory()[1] - start)
+            _tracing_users -= 1
+            if _tracing_users == 0:
+                tracemalloc.stop()
+
+
+class LatencyHistogram:
+    """
+    Rolling record of balancing cost by lobby size.
+
+    Keeps the last `window` balances of every lobby size, so the histogram
+    follows the current load rather than the whole uptime of the process.
+    """
+
+    def __init__(self, window=1000):
+        """
+        Args:
+            window (int): Balances kept per lobby size
+        """
+        self.window = window
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, players, diagnostics):
+        """
+        Add one balance.
+
+        Args:
+            players (int): Lobby size
+            diagnostics (dict): The 'diagnostics' of a balance_teams result
+        """
+        sample = (
+            diagnostics["elapsed_ms"],
+            diagnostics["engine"],
+            diagnostics["subsets_examined"],
+        )
+        with self._lock:
+            if players not in self.samples:
+                self.samples[players] = deque(maxlen=self.window)
+            self.samples[players].append(sample)
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: Per lobby size, the number of balances, latency percentiles
+                  in ms, counts per latency bucket (keyed by upper bound, "inf"
+                  for the last), balances per engine and the mean number of
+                  half-subsets examined (None when no engine reported one)
+        """
+        with self._lock:
+            samples = {players: list(rows) for players, rows in self.samples.items()}
+
+        stats = {}
+        for players, rows in sorted(samples.items()):
+            elapsed = np.array([row[0] for row in rows])
+            examined = [row[2] for row in rows if row[2] is not None]
+            counts = np.bincount(
+                np.searchsorted(LATENCY_BUCKETS_MS, elapsed),
+                minlength=len(LATENCY_BUCKETS_MS) + 1,
+            )
+            p50, p90, p99 = np.percentile(elapsed, [50, 90, 99])
+            stats[players] = {
+                "count": len(rows),
+                "p50_ms": float(p50),
+                "p90_ms": float(p90),
+                "p99_ms": float(p99),
+                "max_ms": float(elapsed.max()),
+                "buckets": {
+                    str(bound): int(count)
+                    for bound, count in zip(LATENCY_BUCKETS_MS + ("inf",), counts)
+                },
+                "engines": dict(Counter(row[1] for row in rows)),
+                "mean_subsets_examined": float(np.mean(examined)) if examined else None,
+            }
+        return stats
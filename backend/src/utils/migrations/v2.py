@@ -2,7 +2,12 @@ import argparse
 from pathlib import Path
 import re
 import sqlite3
-from utils.db import get_db_connection
+
+
+def get_db_connection(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    return conn
 
 
 def parse_and_transform_game_name(old_game_name):
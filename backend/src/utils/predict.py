@@ -0,0 +1,251 @@
+"""
+Win probability of two teams, fitted on the recorded game history.
+"""
+
+import threading
+
+import numpy as np
+
+DEFAULT_PRIOR_VARIANCE = 1.0
+DEFAULT_REFIT_GAMES = 500
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def win_probability(masks, ratings):
+    """
+    Probability that team A wins, for one split or a batch of candidate splits.
+
+    Args:
+        masks (np.ndarray): Boolean team A mask, or a (k, n) matrix of them
+        ratings (np.ndarray): Rating of every player, see WinPredictor
+
+    Returns:
+        float | np.ndarray: sigmoid(sum of team A ratings - sum of team B
+                            ratings) for every mask
+    """
+    ratings = np.asarray(ratings, dtype=np.float64)
+    strength = 2 * (np.asarray(masks, dtype=bool) @ ratings) - ratings.sum()
+    return sigmoid(strength)
+
+
+def game_matrix(games):
+    """
+    The games as a sparse (games x players) matrix in coordinate form, +1 for
+    every winner and -1 for every loser, so memory grows with the recorded
+    events rather than with games x players.
+
+    Returns:
+        tuple: (players, rows, cols, signs) with the sorted player ids and the
+               game, player index and sign of every non-zero entry
+    """
+    players = sorted({player for game in games for team in game for player in team})
+    index = {player: i for i, player in enumerate(players)}
+    rows, cols, signs = [], [], []
+    for row, (winners, losers) in enumerate(games):
+        for team, sign in ((winners, 1.0), (losers, -1.0)):
+            rows.extend([row] * len(team))
+            cols.extend(index[player] for player in team)
+            signs.extend([sign] * len(team))
+    return (
+        players,
+        np.array(rows, dtype=np.int64),
+        np.array(cols, dtype=np.int64),
+        np.array(signs),
+    )
+
+
+def conjugate_gradient(matvec, b, diagonal, tol=1e-10):
+    """
+    Solve A x = b for a symmetric positive definite A given only through
+    matvec(v) = A v, preconditioned by the diagonal of A.
+    """
+    x = np.zeros_like(b)
+    residual = b.copy()
+    z = residual / diagonal
+    direction = z.copy()
+    rz = residual @ z
+    for _ in range(len(b)):
+        if residual @ residual <= tol**2 * (b @ b):
+            break
+        product = matvec(direction)
+        alpha = rz / (direction @ product)
+        x += alpha * direction
+        residual -= alpha * product
+        z = residual / diagonal
+        rz, previous = residual @ z, rz
+        direction = z + (rz / previous) * direction
+    return x
+
+
+def fit_ratings(games, prior_variance, max_iter=50, tol=1e-8):
+    """
+    MAP ratings of every player in games with Newton's method.
+
+    Each Newton step is solved by conjugate gradients on Hessian-vector
+    products computed from the sparse game matrix, so neither the games x
+    players matrix nor the players x players Hessian is ever formed.
+
+    Returns:
+        tuple: (mean, variance) dicts by player id. The variance is the
+               reciprocal of the Hessian's diagonal, which stands in for the
+               diagonal of its inverse.
+    """
+    players, rows, cols, signs = game_matrix(games)
+
+    def forward(v):
+        return np.bincount(rows, weights=signs * v[cols], minlength=len(games))
+
+    def backward(u):
+        return np.bincount(cols, weights=signs * u[rows], minlength=len(players))
+
+    def curvature(ratings):
+        p = sigmoid(forward(ratings))
+        weight = p * (1 - p)
+        diagonal = np.bincount(cols, weights=weight[rows], minlength=len(players))
+        return p, weight, diagonal + 1 / prior_variance
+
+    ratings = np.zeros(len(players))
+    for _ in range(max_iter):
+        p, weight, diagonal = curvature(ratings)
+        gradient = backward(1 - p) - ratings / prior_variance
+        step = conjugate_gradient(
+            lambda v: backward(weight * forward(v)) + v / prior_variance,
+            gradient,
+            diagonal,
+        )
+        ratings += step
+        if np.abs(step).max(initial=0) < tol:
+            break
+
+    diagonal = curvature(ratings)[2]
+    return (
+        dict(zip(players, ratings.tolist())),
+        dict(zip(players, (1 / diagonal).tolist())),
+    )
+
+
+class WinPredictor:
+    """
+    Bradley-Terry model over teams: team A beats team B with probability
+    sigmoid(sum of A's ratings - sum of B's ratings), i.e. a logistic
+    regression on the players of both sides.
+
+    Ratings have a Gaussian prior N(0, prior_variance), which keeps them
+    finite for players who never lost. A full fit finds the MAP ratings of
+    all games (see fit_ratings) and keeps an approximate posterior variance of
+    every rating. update() folds in one more game with a single
+    assumed-density step on those Gaussians, so a submitted game costs
+    O(players) instead of a refit.
+
+    Full fits of the recorded history run on a background thread, started by
+    refresh() on first use and every refit_games updates to undo the drift.
+    The fitted ratings replace the current ones in one step, and the games
+    recorded while the fit ran are then replayed on top of them. Until the
+    first fit lands every player is rated 0.
+    """
+
+    def __init__(
+        self,
+        prior_variance=DEFAULT_PRIOR_VARIANCE,
+        refit_games=DEFAULT_REFIT_GAMES,
+    ):
+        """
+        Args:
+            prior_variance (float): Variance of the ratings before any game
+            refit_games (int): Incremental updates between two full fits
+        """
+        self.prior_variance = prior_variance
+        self.refit_games = refit_games
+        self.mean = {}
+        self.variance = {}
+        self.updates = 0
+        self.fitted = False
+        self.last_event_id = 0
+        self._lock = threading.RLock()
+        self._refit_thread = None
+
+    def fit(self, games, max_iter=50, tol=1e-8):
+        """
+        Fit the ratings on every game from scratch. The fit itself runs
+        without the lock, so ratings stay readable meanwhile.
+
+        Args:
+            games (list): (winner_ids, loser_ids) tuples
+        """
+        mean, variance = fit_ratings(games, self.prior_variance, max_iter, tol)
+        with self._lock:
+            self.mean, self.variance = mean, variance
+            self.updates = 0
+            self.fitted = True
+
+    def refit(self, db):
+        """
+        Fit the ratings on the whole recorded history. The next refresh
+        replays the games recorded after the ones fitted.
+        """
+        games, last_id = db.get_game_results()
+        mean, variance = fit_ratings(games, self.prior_variance)
+        with self._lock:
+            self.mean, self.variance = mean, variance
+            self.updates = 0
+            self.fitted = True
+            self.last_event_id = last_id
+
+    def start_refit(self, db):
+        """Run refit on a background thread, unless one is already running."""
+        with self._lock:
+            if self._refit_thread is not None and self._refit_thread.is_alive():
+                return self._refit_thread
+            self._refit_thread = threading.Thread(
+                target=self.refit, args=(db,), daemon=True
+            )
+            self._refit_thread.start()
+            return self._refit_thread
+
+    def update(self, winners, losers):
+        """Fold one more game into the ratings."""
+        with self._lock:
+            players = list(winners) + list(losers)
+            x = np.array([1.0] * len(winners) + [-1.0] * len(losers))
+            mean = np.array([self.mean.get(player, 0.0) for player in players])
+            variance = np.array(
+                [self.variance.get(player, self.prior_variance) for player in players]
+            )
+
+            # Newton step of the game's log-likelihood under the Gaussian
+            # ratings, with the rank-one covariance update (Sherman-Morrison)
+            # kept on the diagonal
+            p = sigmoid(x @ mean)
+            curvature = p * (1 - p)
+            denominator = 1 + curvature * (variance * x**2).sum()
+            mean += variance * x * (1 - p) / denominator
+            variance -= (variance * x) ** 2 * curvature / denominator
+
+            self.mean.update(zip(players, mean.tolist()))
+            self.variance.update(zip(players, variance.tolist()))
+            self.updates += 1
+
+    def refresh(self, db):
+        """
+        Catch up with the games recorded since the last refresh, by this or
+        any other worker process. Full fits are only started here, never
+        waited for.
+        """
+        with self._lock:
+            if not self.fitted:
+                self.start_refit(db)
+                return
+            games, last_id = db.get_game_results(self.last_event_id)
+            for winners, losers in games:
+                self.update(winners, losers)
+            self.last_event_id = last_id
+            if self.updates >= self.refit_games:
+                self.start_refit(db)
+
+    def ratings(self, player_ids):
+        """Ratings of the given players, 0 for players without games."""
+        with self._lock:
+            return np.array([self.mean.get(player, 0.0) for player in player_ids])
@@ -8,8 +8,12 @@ For cleaning user history:
     - Deletes all events for the specified nickname
     - Returns the number of events deleted
 
+For rebuilding player stats:
+    - Recomputes the daily wins and losses behind /api/users from the events
+
 Usage:
     python user.py clean "nickname"
+    python user.py rebuild-stats
 
 Environment Variables:
     DB_PATH: Path to the SQLite database file
@@ -49,5 +53,16 @@ def clean(
         )
 
 
+@app.command()
+def rebuild_stats():
+    """Recompute the daily player stats from the recorded events."""
+    try:
+        rows = db.rebuild_player_daily_stats()
+    except Exception as e:
+        typer.echo(f"Error: {e}")
+        raise typer.Exit(code=1)
+    typer.echo(f"Rebuilt {rows} daily player stats")
+
+
 if __name__ == "__main__":
     app()
@@ -0,0 +1,100 @@
+"""
+Brute-force reference solvers used as correctness oracles for the balancing
+engines in the property tests.
+"""
+
+from itertools import combinations
+import numpy as np
+from src.utils.balance import quantize
+
+
+def brute_force_splits(nums, quantum=None, constraints=None):
+    """
+    Reference solver for small lobbies: score every split into two equal
+    teams, as a correctness oracle for the fast engines.
+
+    Without pinned players every split is taken once, with the last player in
+    team A, like Balancer. Splits that break the constraints are dropped.
+
+    Args:
+        nums (list): Player scores
+        quantum (float): Score step; float sums with a 1e-9 tolerance without
+        constraints (SplitConstraints): Optional pins and links
+
+    Returns:
+        tuple: (min_diff, solutions) with every optimal split as a row of a
+               boolean team A matrix
+    """
+    nums, quantum = quantize(nums, quantum)
+    n = len(nums)
+    assert n % 2 == 0, "Number of players must be even"
+    pinned = constraints is not None and constraints.pinned.any()
+    if pinned:
+        teams = list(combinations(range(n), n // 2))
+    else:
+        teams = [team + (n - 1,) for team in combinations(range(n - 1), n // 2 - 1)]
+    members = np.array(teams, dtype=np.int64).reshape(len(teams), n // 2)
+    masks = np.zeros((len(teams), n), dtype=bool)
+    masks[np.arange(len(teams))[:, None], members] = True
+
+    if constraints is not None:
+        side = masks ^ constraints.parity
+        # Every member of a component agrees with the first one on its side
+        _, first = np.unique(constraints.component, return_index=True)
+        root_side = side[:, first]
+        valid = (side == root_side[:, constraints.component]).all(axis=1)
+        valid &= (
+            root_side[:, constraints.pinned]
+            == constraints.root_in_a[constraints.pinned]
+        ).all(axis=1)
+        masks = masks[valid]
+        assert len(masks), "No split satisfies the constraints"
+
+    values = nums.astype(np.int64) if quantum is not None else nums
+    diffs = np.abs(masks @ values - (~masks) @ values)
+    min_diff = diffs.min()
+    solutions = masks[diffs <= min_diff + (1e-9 if quantum is None else 0)]
+    if quantum is not None:
+        min_diff = min_diff * quantum
+    return float(min_diff), solutions
+
+
+def brute_force_teams(nums, teams, quantum=None):
+    """
+    Reference solver for MultiTeamBalancer on small lobbies: try every
+    assignment into `teams` equal teams, each once.
+
+    Returns:
+        tuple: (spread, assignment) with the smallest gap between the strongest
+               and weakest team total and one assignment reaching it
+    """
+    nums, quantum = quantize(nums, quantum)
+    values = nums.astype(np.int64) if quantum is not None else nums
+    team_len = len(nums) // teams
+    assert team_len * teams == len(nums), "Teams must have equal sizes"
+
+    def assignments(players):
+        # The first remaining player opens the next team, so no assignment
+        # is generated again with its teams relabelled
+        if not players:
+            yield []
+            return
+        for rest in combinations(players[1:], team_len - 1):
+            group = (players[0],) + rest
+            remaining = [player for player in players if player not in group]
+            for tail in assignments(remaining):
+                yield [group] + tail
+
+    best_spread, best = None, None
+    for groups in assignments(list(range(len(nums)))):
+        totals = [values[list(group)].sum() for group in groups]
+        spread = max(totals) - min(totals)
+        if best_spread is None or spread < best_spread:
+            best_spread, best = spread, groups
+
+    assignment = np.empty(len(nums), dtype=np.int64)
+    for team, group in enumerate(best):
+        assignment[list(group)] = team
+    if quantum is not None:
+        best_spread = best_spread * quantum
+    return float(best_spread), assignment
@@ -0,0 +1,253 @@
+from src.utils import digest
+from src.utils.benchmark import DATABASE_QUERIES, build_event_database
+from src.utils.db import (
+    MIGRATIONS,
+    Database,
+    add_event_indexes,
+    create_base_tables,
+    migrate,
+)
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import pytest
+import sqlite3
+import time
+
+
+def test_database_reuses_pooled_connections(tmp_path, monkeypatch):
+    db = Database(tmp_path / "pool.sqlite", pool_size=2)
+    with db.connection() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+        assert conn.execute("PRAGMA temp_store").fetchone()[0] == 2  # MEMORY
+    with db.connection() as again:
+        assert again is conn
+    with db.connection() as first, db.connection() as second:
+        assert first is not second
+
+    # Borrowers from other threads share the pool
+    ids = db.get_or_create_player_ids(["Player1", "Player2"])
+    with ThreadPoolExecutor(4) as pool:
+        nicknames = list(pool.map(db.get_player_nickname, [ids["Player1"]] * 8))
+    assert nicknames == ["Player1"] * 8
+    assert len(db.pool.idle) == 2
+
+    # Uncommitted changes do not leak to the next borrower
+    with db.connection() as conn:
+        conn.execute("INSERT INTO players (nickname) VALUES ('Ghost')")
+    with db.connection() as conn:
+        count = conn.execute("SELECT COUNT(*) FROM players").fetchone()[0]
+    assert count == 2
+
+    # A forked process opens its own connections
+    inherited = list(db.pool.idle)
+    monkeypatch.setattr("os.getpid", lambda: -1)
+    with db.connection() as conn:
+        assert conn not in inherited
+    assert db.get_player_nickname(ids["Player2"]) == "Player2"
+
+
+def test_migrations_upgrade_and_roll_back(tmp_path):
+    # A database from before versioning keeps its rows and gets the indexes
+    legacy = sqlite3.connect(tmp_path / "legacy.sqlite")
+    create_base_tables(legacy.cursor())
+    legacy.execute("INSERT INTO players (nickname) VALUES ('Player1')")
+    legacy.commit()
+    legacy.close()
+
+    db = Database(tmp_path / "legacy.sqlite")
+    with db.connection() as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+        assert {"idx_events_player_datetime", "idx_events_game_datetime"} <= indexes
+        assert migrate(conn) == len(MIGRATIONS)
+
+        # A failing migration leaves no trace
+        def broken(cursor):
+            cursor.execute("CREATE TABLE half_done (id INTEGER)")
+            cursor.execute("SELECT * FROM missing_table")
+
+        with pytest.raises(sqlite3.OperationalError):
+            migrate(conn, MIGRATIONS + [broken])
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+        assert "half_done" not in {
+            row[0] for row in conn.execute("SELECT name FROM sqlite_master")
+        }
+
+        with pytest.raises(RuntimeError):
+            migrate(conn, MIGRATIONS[:1])
+    assert db.get_player_nickname(1) == "Player1"
+
+
+def query_plans(db, func, *args):
+    """EXPLAIN QUERY PLAN of every SELECT that func runs, one string each."""
+    statements = []
+    # One thread borrows the same idle connection back from the pool
+    with db.connection() as conn:
+        conn.set_trace_callback(statements.append)
+    func(*args)
+    with db.connection() as conn:
+        conn.set_trace_callback(None)
+        return [
+            " ".join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql))
+            for sql in statements
+            if sql.lstrip().startswith("SELECT")
+        ]
+
+
+def test_event_queries_use_indexes(tmp_path, monkeypatch):
+    db = Database(tmp_path / "plans.sqlite")
+    monkeypatch.setattr(digest, "db", db)
+
+    [plan] = query_plans(db, db.get_all_player_stats)
+    assert "SEARCH s USING PRIMARY KEY (player_id=? AND day>?)" in plan
+    [plan] = query_plans(db, db.get_player_games_history, 1)
+    assert "SEARCH e USING INDEX idx_events_player_datetime" in plan
+
+    [plan] = query_plans(db, digest.get_top_active_players, "2025-01-01", "2025-01-31")
+    assert "SEARCH e USING INDEX idx_events_game_datetime" in plan
+    for query in (
+        digest.get_game_activity_by_hour,
+        digest.get_all_unique_games,
+        digest.get_top_admins_by_contribution,
+    ):
+        [plan] = query_plans(db, query, "2025-01-01", "2025-01-31")
+        assert "INDEX idx_games_game_datetime" in plan
+        assert "DISTINCT" not in plan
+
+
+def test_games_migration_backfills_events(tmp_path, monkeypatch):
+    path = tmp_path / "games.sqlite"
+    legacy = sqlite3.connect(path)
+    create_base_tables(legacy.cursor())
+    add_event_indexes(legacy.cursor())
+    legacy.execute("PRAGMA user_version = 2")
+    legacy.execute("INSERT INTO admins (id, name, hash) VALUES (7, 'admin', 'x:y')")
+    legacy.executemany(
+        "INSERT INTO players (id, nickname) VALUES (?, ?)",
+        [(1, "Ann"), (2, "Bob"), (3, "Cid"), (4, "Dan")],
+    )
+    # Two games with the same name on different days, won by either side
+    legacy.executemany(
+        "INSERT INTO events (player_id, game_datetime, game_name, win, admin) "
+        "VALUES (?, ?, ?, ?, '7')",
+        [
+            (1, "2025-01-01 20:00:00", "Ann,Bob|VS|Cid,Dan", True),
+            (2, "2025-01-01 20:00:00", "Ann,Bob|VS|Cid,Dan", True),
+            (3, "2025-01-01 20:00:00", "Ann,Bob|VS|Cid,Dan", False),
+            (4, "2025-01-01 20:00:00", "Ann,Bob|VS|Cid,Dan", False),
+            (1, "2025-01-02 20:00:00", "Ann,Bob|VS|Cid,Dan", False),
+            (3, "2025-01-02 20:00:00", "Ann,Bob|VS|Cid,Dan", True),
+        ],
+    )
+    legacy.commit()
+    legacy.close()
+
+    db = Database(path)
+    monkeypatch.setattr(digest, "db", db)
+    with db.connection() as conn:
+        games = conn.execute("SELECT * FROM games ORDER BY id").fetchall()
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(events)")]
+    assert [(game["admin_id"], game["winner"]) for game in games] == [
+        (7, "A"),
+        (7, "B"),
+    ]
+    assert columns == ["id", "player_id", "game_id", "game_datetime", "win"]
+
+    assert db.get_game_results() == ([([1, 2], [3, 4]), ([3], [1])], 6)
+    assert [game["game_datetime"] for game in digest.get_all_unique_games()] == [
+        "2025-01-02 20:00:00",
+        "2025-01-01 20:00:00",
+    ]
+    assert digest.get_top_admins_by_contribution() == [
+        {"admin_name": "admin", "distinct_games_count": 2}
+    ]
+    hours = digest.get_game_activity_by_hour("2025-01-01", "2025-01-31")
+    assert hours[20]["game_count"] == 2
+
+    # New games are written to both tables at once
+    salt = "salt"
+    password_hash = hashlib.sha256(("secret" + salt).encode()).hexdigest()
+    with db.connection() as conn:
+        conn.execute(
+            "UPDATE admins SET hash = ? WHERE id = 7", (f"{password_hash}:{salt}",)
+        )
+        conn.commit()
+    # Recent enough for the 60-day game history
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+    db.add_events_batch([2, 4], now, "Bob|VS|Dan", [False, True], "admin:secret", "B")
+    history = db.get_player_games_history(4)
+    assert [
+        (game["game_name"], game["win"], game["admin_name"]) for game in history
+    ] == [("Bob|VS|Dan", 1, "admin")]
+    assert db.get_game_results(6) == ([([4], [2])], 8)
+
+
+def test_player_daily_stats_match_rebuild(tmp_path):
+    db = Database(tmp_path / "stats.sqlite")
+    password_hash = hashlib.sha256(b"secretsalt").hexdigest()
+    db.add_admin("admin", f"{password_hash}:salt")
+    ids = db.get_or_create_player_ids(["Ann", "Bob", "Cid"])
+    ann, bob, cid = ids["Ann"], ids["Bob"], ids["Cid"]
+
+    today = time.strftime("%Y-%m-%d")
+    for game_datetime, players, wins in [
+        (f"{today} 20:00:00", [ann, bob], [True, False]),
+        (f"{today} 21:00:00", [ann, bob], [True, False]),
+        (today, [bob, cid], [True, False]),
+        # Outside of the 30-day window
+        ("2020-01-01 20:00:00", [ann, cid], [False, True]),
+    ]:
+        db.add_events_batch(players, game_datetime, "A|VS|B", wins, "admin:secret")
+
+    stats = db.get_all_player_stats()
+    assert {
+        nickname: (row["wins"], row["losses"]) for nickname, row in stats.items()
+    } == {
+        "Ann": (2, 0),
+        "Bob": (1, 2),
+        "Cid": (0, 1),
+    }
+
+    def rollup():
+        with db.connection() as conn:
+            return [
+                tuple(row)
+                for row in conn.execute(
+                    "SELECT * FROM player_daily_stats ORDER BY player_id, day"
+                )
+            ]
+
+    incremental = rollup()
+    assert (ann, today, 2, 0) in incremental
+    assert db.rebuild_player_daily_stats() == len(incremental) == 5
+    assert rollup() == incremental
+
+    # Cleaning a player's history drops their rollup rows with the events
+    assert db.delete_user_events("Bob") == 3
+    assert db.delete_user_events("Nobody") == 0
+    assert [row for row in rollup() if row[0] == bob] == []
+    after_delete = rollup()
+    db.rebuild_player_daily_stats()
+    assert rollup() == after_delete
+    bob_stats = db.get_all_player_stats()["Bob"]
+    assert (bob_stats["wins"], bob_stats["losses"]) == (0, 0)
+
+
+def test_benchmark_database_queries_agree_across_schemas(tmp_path):
+    legacy_path = tmp_path / "legacy.sqlite"
+    params = build_event_database(legacy_path, 4000, seed=0)
+    current_path = tmp_path / "current.sqlite"
+    current_path.write_bytes(legacy_path.read_bytes())
+    db = Database(current_path)
+
+    legacy = sqlite3.connect(legacy_path)
+    with db.connection() as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+        for name, (legacy_sql, current_sql) in DATABASE_QUERIES.items():
+            before = legacy.execute(legacy_sql, params[name]).fetchall()
+            after = [tuple(row) for row in conn.execute(current_sql, params[name])]
+            assert sorted(before) == sorted(after), name
+            # A player of the small lobby may have no recent games
+            assert after or name == "game history"
+    legacy.close()
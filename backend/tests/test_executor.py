@@ -0,0 +1,47 @@
+from src.utils.executor import (
+    DeadlineExceededError,
+    ProcessExecutor,
+    QueueFullError,
+    wait_for,
+)
+from concurrent.futures import CancelledError, Future
+import pytest
+import time
+
+
+def test_process_executor_queue_and_deadline():
+    executor = ProcessExecutor(max_workers=1, max_queue=1)
+    try:
+        assert executor.run(sum, [1, 2, 3], timeout=10) == 6
+
+        running = executor.submit(time.sleep, 0.5)
+        queued = executor.submit(time.sleep, 0)
+        with pytest.raises(QueueFullError):
+            executor.submit(time.sleep, 0)
+
+        # A task still waiting for the busy worker is cancelled at its deadline
+        with pytest.raises(DeadlineExceededError):
+            wait_for(queued, timeout=0.01)
+        assert queued.cancelled()
+
+        # ...which frees its queue slot
+        waiting = executor.submit(time.sleep, 0)
+        running.result()
+        assert waiting.result(timeout=10) is None
+    finally:
+        executor.shutdown()
+
+
+def test_process_executor_fails_tasks_cancelled_by_the_pool():
+    executor = ProcessExecutor(max_workers=1, max_queue=1)
+    future = Future()
+    future.set_running_or_notify_cancel()
+    task = Future()
+    task.cancel()
+    executor.running = 1
+
+    executor.finish(future, task)
+
+    with pytest.raises(CancelledError):
+        future.result(timeout=0)
+    assert executor.running == 0
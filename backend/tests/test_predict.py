@@ -0,0 +1,80 @@
+from src.utils.predict import WinPredictor, win_probability
+import math
+import numpy as np
+import pytest
+
+
+def simulated_games(count, players=12, seed=0):
+    """Random 3v3 games where player i has a true rating of i / 4 - 1."""
+    rng = np.random.default_rng(seed)
+    truth = np.arange(players) / 4 - 1
+    games = []
+    for _ in range(count):
+        lobby = rng.choice(players, 6, replace=False)
+        team_a, team_b = lobby[:3], lobby[3:]
+        if rng.random() < win_probability(np.isin(np.arange(players), team_a), truth):
+            games.append((team_a.tolist(), team_b.tolist()))
+        else:
+            games.append((team_b.tolist(), team_a.tolist()))
+    return games
+
+
+def test_win_predictor_learns_ratings_from_games():
+    games = simulated_games(600)
+    predictor = WinPredictor()
+    predictor.fit(games)
+    ratings = predictor.ratings(range(12))
+    assert np.corrcoef(ratings, np.arange(12))[0, 1] > 0.9
+    # Unknown players are rated like a newcomer
+    assert predictor.ratings([99])[0] == 0
+
+    # Incremental updates land close to a full fit on the same games
+    incremental = WinPredictor(refit_games=10_000)
+    incremental.fit(games[:300])
+    for winners, losers in games[300:]:
+        incremental.update(winners, losers)
+    assert np.abs(incremental.ratings(range(12)) - ratings).max() < 0.25
+
+    # A win moves the winners up and the losers down
+    before = predictor.ratings([0, 11])
+    predictor.update([0], [11])
+    after = predictor.ratings([0, 11])
+    assert after[0] > before[0] and after[1] < before[1]
+
+
+def test_win_predictor_refits_in_the_background():
+    games = simulated_games(600)
+
+    class GameLog:
+        recorded = games[:300]
+
+        def get_game_results(self, after_id=0):
+            return self.recorded[after_id:], len(self.recorded)
+
+    log = GameLog()
+    predictor = WinPredictor(refit_games=100)
+    # The first refresh only starts the fit
+    predictor.refresh(log)
+    predictor.start_refit(log).join()
+    assert predictor.fitted and predictor.last_event_id == 300
+
+    # Catching up past refit_games starts another fit of the whole history
+    log.recorded = games
+    predictor.refresh(log)
+    predictor.start_refit(log).join()
+    assert predictor.last_event_id == 600 and predictor.updates == 0
+
+    full = WinPredictor()
+    full.fit(games)
+    assert np.allclose(predictor.ratings(range(12)), full.ratings(range(12)))
+
+
+def test_win_probability_is_vectorized():
+    ratings = np.array([1.0, 0.0, 0.5, -0.5])
+    masks = np.array([[1, 1, 0, 0], [0, 0, 1, 1], [1, 0, 0, 1]], dtype=bool)
+    probabilities = win_probability(masks, ratings)
+    assert probabilities.shape == (3,)
+    assert probabilities[0] == pytest.approx(1 / (1 + math.exp(-1)))
+    assert probabilities[0] + probabilities[1] == pytest.approx(1)
+    assert probabilities[2] == pytest.approx(0.5)
+    assert win_probability(masks[0], ratings) == pytest.approx(probabilities[0])
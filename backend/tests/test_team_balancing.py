@@ -1,6 +1,26 @@
-from src.app import balance_teams
-from src.utils.balance import Balancer
+from src.app import balance_teams, rebalance_teams
+from src.utils.balance import (
+    Balancer,
+    HeuristicBalancer,
+    MultiTeamBalancer,
+    RankBalancer,
+    ResultCache,
+    SplitConstraints,
+    generate_gray_codes,
+    load_tables,
+    get_score_quantum,
+    min_swap_split,
+    quantize,
+    randomize_scores,
+)
+from src.utils.benchmark import compare_results
+from src.utils.spreadsheet import SCORES
+from oracles import brute_force_splits, brute_force_teams
+from src.utils.executor import ProcessExecutor
+import itertools
 import json
+import math
+import numpy as np
 import pytest
 import random
 
@@ -29,6 +49,9 @@ def test_balance_teams_even_players():
     # Check that teams are reasonably balanced
     assert abs(team_a_total - team_b_total) <= 2
 
+    # 10 + 5 against 8 + 7 is the only perfect split
+    assert result["solution_count"] == 1
+
 
 def test_balance_teams_odd_players():
     """Test balancing with an odd number of players."""
@@ -312,3 +335,888 @@ def test_balancer_find_solutions():
             assert sum(solution) == len(test["nums"]) // 2
         assert round(min_diff, 4) == test["diff"]
         assert len(test) % 2 == 0
+
+
+def test_balancer_tables_are_lazy_and_memory_mapped(tmp_path):
+    balancer = Balancer(tables_dir=tmp_path)
+    assert balancer.tables is None
+    assert not any(tmp_path.iterdir())
+
+    balancer.find_solutions([1, 2, 3, 4])
+    codes, popcounts = balancer.get_tables()
+    assert isinstance(codes, np.memmap) and not codes.flags.writeable
+
+    expected_codes, expected_popcounts = generate_gray_codes(15)
+    assert np.array_equal(codes, expected_codes)
+    assert np.array_equal(popcounts, expected_popcounts)
+
+    # A second worker maps the existing file instead of regenerating it
+    table_file = tmp_path / "gray_codes_15.bin"
+    mtime = table_file.stat().st_mtime_ns
+    Balancer(tables_dir=tmp_path).find_solutions([1, 2, 3, 4])
+    assert table_file.stat().st_mtime_ns == mtime
+
+
+def test_balancer_tables_skip_shared_directories(tmp_path):
+    private = tmp_path / "private" / "balancer"
+    load_tables(4, private)
+    assert private.stat().st_mode & 0o777 == 0o700
+
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    shared.chmod(0o777)
+    codes, popcounts = load_tables(4, shared)
+    assert not isinstance(codes, np.memmap)
+    assert np.array_equal(codes, generate_gray_codes(4)[0])
+    assert not any(shared.iterdir())
+
+
+def test_balancer_returns_each_split_once():
+    balancer = Balancer(quantum=0.1)
+    rng = np.random.default_rng(0)
+
+    for players in range(2, 13, 2):
+        for _ in range(10):
+            nums = rng.choice([1, 1.5, 2, 2.5, 3, 3.3, 4], size=players)
+            min_diff, solutions = balancer.find_solutions(nums)
+
+            # Brute force over every split with the last player in team A
+            optimal = set()
+            for team in itertools.combinations(range(players - 1), players // 2 - 1):
+                mask = np.zeros(players, dtype=bool)
+                mask[list(team) + [players - 1]] = True
+                if abs(nums[mask].sum() - nums[~mask].sum()) == pytest.approx(min_diff):
+                    optimal.add(mask.tobytes())
+
+            assert solutions[:, -1].all()
+            found = {solution.tobytes() for solution in solutions}
+            assert len(found) == len(solutions)
+            assert found <= optimal
+
+
+def test_optimal_splits_are_counted_and_sampled_without_listing():
+    ladder = [-1, 0, 1, 1.5, 2, 2.5, 2.7, 3, 3.3, 4]
+    balancer = Balancer(quantum=0.1)
+    rank_balancer = RankBalancer(quantum=0.1)
+    rng = np.random.default_rng(0)
+
+    for players in range(2, 13, 2):
+        for _ in range(10):
+            nums = rng.choice(ladder[: rng.integers(2, len(ladder))], size=players)
+            scaled = np.rint(nums * 10).astype(int)
+
+            # Brute force over every split with the last player in team A
+            diffs = {}
+            for team in itertools.combinations(range(players - 1), players // 2 - 1):
+                mask = np.zeros(players, dtype=bool)
+                mask[list(team) + [players - 1]] = True
+                diffs[mask.tobytes()] = abs(scaled[mask].sum() - scaled[~mask].sum())
+            best = min(diffs.values())
+            optimal = {mask for mask, diff in diffs.items() if diff == best}
+
+            min_diff, splits = balancer.find_optimal_splits(nums)
+            assert round(min_diff * 10) == best
+            assert len(splits) == len(optimal)
+            assert {solution.tobytes() for solution in splits} == optimal
+            assert splits.sample(rng).tobytes() in optimal
+
+            _, solution, count, proven = rank_balancer.sample_solution(nums, rng=rng)
+            assert proven
+            assert count == len(optimal)
+            assert abs(scaled[solution].sum() - scaled[~solution].sum()) == best
+
+
+def test_sample_solution_on_tie_heavy_lobby():
+    nums = [2.5] * 30
+
+    _, solution, count, _ = Balancer(quantum=0.1).sample_solution(nums)
+    assert solution.sum() == 15
+    assert count == math.comb(29, 14)
+    assert RankBalancer(quantum=0.1).sample_solution(nums)[2] == count
+
+
+def test_balancer_time_budget_returns_best_so_far():
+    balancer = Balancer()
+    rng = np.random.default_rng(0)
+
+    for _ in range(5):
+        nums = rng.uniform(0, 5, size=30)
+        min_diff, splits = balancer.find_optimal_splits(nums)
+        assert splits.optimal
+
+        diff, solution, count, optimal = balancer.sample_solution(nums, max_ms=0)
+        assert solution.sum() == 15 and count >= 1
+        assert abs(nums[solution].sum() - nums[~solution].sum()) == pytest.approx(diff)
+        assert diff >= min_diff - 1e-9
+        if optimal:
+            assert diff == pytest.approx(min_diff)
+
+        diff, _, _, optimal = balancer.sample_solution(nums, max_ms=10_000)
+        assert optimal and diff == pytest.approx(min_diff)
+
+
+def test_get_score_quantum():
+    assert get_score_quantum([-1, 0, 1, 1.5, 2, 2.5, 2.7, 3, 3.3, 4.5]) == 0.1
+    assert get_score_quantum([1, 2, 3]) == 1
+    assert get_score_quantum([0.25, 1]) == 0.01
+
+
+def test_off_quantum_scores_are_not_rounded():
+    assert quantize([0.1, 2.7, 4.5], 0.1)[0].tolist() == [1, 27, 45]
+    values, quantum = quantize([0.14, 0.06, 0.1, 0.1], 0.1)
+    assert quantum is None and values.dtype == np.float64
+    assert quantize([2e9, 1], 1)[1] is None
+
+    user_scores = {"a": 0.14, "b": 0.06, "c": 0.1, "d": 0.1}
+    for seed in range(8):
+        result = balance_teams(user_scores, randomness=0, seed=seed)
+        assert result["diff"] == pytest.approx(0)
+        team_a = {player["nickname"] for player in result["teamA"]}
+        assert team_a in ({"a", "b"}, {"c", "d"})
+
+
+def test_balancer_quantized_find_solutions():
+    balancer = Balancer(quantum=0.1)
+
+    with open("tests/files/balance_tests.json", "r") as f:
+        tests = json.load(f)[:500]
+
+    for test in tests:
+        min_diff, solutions = balancer.find_solutions(test["nums"])
+        scaled = [round(value * 10) for value in test["nums"]]
+        for solution in solutions:
+            team_a = sum(value for mask, value in zip(solution, scaled) if mask)
+            team_b = sum(value for mask, value in zip(solution, scaled) if not mask)
+            # Integer sums make every reported tie exact
+            assert abs(team_a - team_b) == round(min_diff * 10)
+        assert round(min_diff, 4) == test["diff"]
+
+
+def test_rank_balancer_matches_meet_in_the_middle():
+    ladder = [-1, 0, 1, 1.5, 2, 2.5, 2.7, 3, 3.3, 3.5, 4, 4.1, 4.2, 4.3, 4.4, 4.5]
+    balancer = Balancer(quantum=0.1)
+    rank_balancer = RankBalancer(quantum=0.1)
+    rng = np.random.default_rng(0)
+
+    for players in range(2, 31, 2):
+        for _ in range(10):
+            nums = rng.choice(ladder, size=players)
+            min_diff, _ = balancer.find_solutions(nums)
+            rank_diff, solutions = rank_balancer.find_solutions(nums, rng=rng)
+
+            assert rank_diff == pytest.approx(min_diff)
+            assert len(solutions) == 1
+            solution = solutions[0]
+            assert solution.sum() == players // 2
+            assert abs(nums[solution].sum() - nums[~solution].sum()) == pytest.approx(
+                rank_diff
+            )
+
+
+def test_rank_balancer_large_lobby():
+    nums = [1, 2, 2.5, 3, 3.3, 4] * 10
+    min_diff, solutions = RankBalancer(quantum=0.1).find_solutions(nums)
+
+    assert min_diff == pytest.approx(0)
+    assert solutions[0].sum() == 30
+
+
+def test_large_integer_scores_skip_the_rank_dp():
+    rng = np.random.default_rng(0)
+    rank_balancer = RankBalancer(quantum=0.1)
+    for players, engine in ((30, "meet_in_the_middle"), (40, "heuristic")):
+        nums = rng.integers(0, 10000, size=players, endpoint=True)
+        assert not rank_balancer.supports(nums)
+        with pytest.raises(ValueError):
+            rank_balancer.find_optimal_splits(nums)
+
+        user_scores = {f"p{i}": int(num) for i, num in enumerate(nums)}
+        result = balance_teams(
+            user_scores, randomness=0, seed=0, diagnostics=True, trace_memory=True
+        )
+        assert result["diagnostics"]["engine"] == engine
+        assert result["diagnostics"]["peak_bytes"] < 256 * 2**20
+        assert len(result["teamA"]) == len(result["teamB"]) == players // 2
+
+        half = players // 2
+        team_a = dict(list(user_scores.items())[:half])
+        team_b = dict(list(user_scores.items())[half:])
+        result = rebalance_teams(team_a, team_b, max_swaps=0)
+        assert len(result["teamA"]) == half
+
+
+def test_heuristic_balancer_matches_exact_on_small_lobbies():
+    balancer = Balancer(quantum=0.1)
+    heuristic_balancer = HeuristicBalancer(quantum=0.1)
+    rng = np.random.default_rng(0)
+
+    for players in range(4, 31, 2):
+        nums = rng.uniform(0, 5, size=players).round(1)
+        min_diff, _ = balancer.find_solutions(nums)
+        diff, solutions, optimal = heuristic_balancer.search(nums, max_ms=20, rng=rng)
+
+        solution = solutions[0]
+        assert solution.sum() == players // 2
+        assert abs(nums[solution].sum() - nums[~solution].sum()) == pytest.approx(diff)
+        assert diff >= min_diff - 1e-9
+        if optimal:
+            assert diff == pytest.approx(min_diff)
+
+
+def test_balance_teams_beyond_exact_threshold():
+    user_scores = {f"Player{i}": 1 + (i * 7) % 35 / 10 for i in range(40)}
+
+    result = balance_teams(user_scores, randomness=50)
+
+    assert len(result["teamA"]) == len(result["teamB"]) == 20
+    all_players = [player["nickname"] for player in result["teamA"] + result["teamB"]]
+    assert sorted(all_players) == sorted(user_scores.keys())
+    assert isinstance(result["optimal"], bool)
+
+    assert result["solution_count"] is None
+    assert result["diff"] >= 0
+
+    result = balance_teams(
+        {f"Player{i}": 1 + (i * 7) % 35 / 10 for i in range(30)},
+        randomness=50,
+        max_ms=1,
+    )
+    assert len(result["teamA"]) == len(result["teamB"]) == 15
+    assert isinstance(result["optimal"], bool)
+    assert balance_teams(user_scores, randomness=0)["optimal"] is True
+
+
+def test_multi_team_balancer_is_exact_on_small_lobbies():
+    multi_team_balancer = MultiTeamBalancer(quantum=0.1)
+    rng = np.random.default_rng(0)
+
+    for teams, players in [(3, 6), (3, 9), (4, 8)]:
+        for _ in range(5):
+            nums = rng.choice([-1, 0, 1, 1.5, 2, 2.7, 3.3, 4.5], size=players)
+            spread, assignment, optimal = multi_team_balancer.search(
+                nums, teams, max_ms=2000
+            )
+
+            team_len = players // teams
+            best_spread = min(
+                np.ptp(np.bincount(labels, weights=nums, minlength=teams))
+                for labels in map(
+                    np.array, itertools.product(range(teams), repeat=players)
+                )
+                if (np.bincount(labels, minlength=teams) == team_len).all()
+            )
+            assert optimal
+            assert spread == pytest.approx(best_spread)
+            assert (np.bincount(assignment, minlength=teams) == team_len).all()
+
+
+def test_balance_teams_multiple_teams():
+    user_scores = {f"Player{i}": 1 + (i * 7) % 35 / 10 for i in range(12)}
+
+    result = balance_teams(user_scores, randomness=0, teams=3)
+
+    assert "teamA" not in result
+    assert len(result["teams"]) == 3
+    assert all(len(team) == 4 for team in result["teams"])
+    all_players = [player["nickname"] for team in result["teams"] for player in team]
+    assert sorted(all_players) == sorted(user_scores.keys())
+
+    with pytest.raises(AssertionError):
+        balance_teams(user_scores, randomness=0, teams=5)
+
+
+def test_result_cache_evicts_least_recently_used_and_expired(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("src.utils.balance.time.monotonic", lambda: now[0])
+    cache = ResultCache(max_entries=2, ttl=10)
+
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+
+    now[0] = 11
+    assert cache.get("c") is None
+    assert cache.stats() == {
+        "entries": 1,
+        "max_entries": 2,
+        "ttl": 10,
+        "hits": 2,
+        "misses": 2,
+    }
+
+
+@pytest.mark.parametrize("engine", [Balancer, RankBalancer])
+def test_cached_search_is_shared_across_player_orders(engine):
+    cache = ResultCache()
+    balancer = engine(quantum=0.1, cache=cache)
+    rng = np.random.default_rng(0)
+    nums = np.array([1, 1.5, 2, 2.5, 3, 3, 3.3, 4, 4.5, 0])
+
+    expected_diff, _, expected_count, _ = engine(quantum=0.1).sample_solution(nums)
+    for _ in range(5):
+        shuffled = rng.permutation(nums)
+        min_diff, solution, count, _ = balancer.sample_solution(shuffled, rng=rng)
+
+        assert min_diff == pytest.approx(expected_diff)
+        assert count == expected_count
+        assert solution.sum() == len(nums) // 2
+        assert abs(
+            shuffled[solution].sum() - shuffled[~solution].sum()
+        ) == pytest.approx(min_diff)
+
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["hits"] == 4
+
+
+def test_balance_endpoint_counts_huge_tied_lobbies(client):
+    # C(70, 35) / 2 ties overflow an index-sized integer
+    users = {f"Player{i}": 2 for i in range(70)}
+    response = client.post("/api/balance", json={"users": users})
+
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result["diff"] == 0
+    assert result["solution_count"] == pytest.approx(math.comb(70, 35) / 2)
+
+
+def test_balance_cache_endpoint(client):
+    response = client.get("/api/balance/cache")
+
+    assert response.status_code == 200
+    assert {"entries", "hits", "misses"} <= response.get_json().keys()
+
+
+def test_balance_cache_endpoint_needs_inline_executor(client, monkeypatch):
+    monkeypatch.setattr("src.app.balance_executor", ProcessExecutor())
+
+    response = client.get("/api/balance/cache")
+
+    assert response.status_code == 404
+
+
+def test_balance_batch_endpoint(client):
+    lobbies = [
+        {"users": {"Player1": 10, "Player2": 8, "Player3": 5, "Player4": 7}},
+        {"users": {"Player1": 1, "Player5": 2, "Player6": 3}},
+        {
+            "users": {f"Player{i}": 1 + i % 4 for i in range(6)},
+            "randomness": 20,
+            "teams": 3,
+        },
+    ]
+
+    response = client.post("/api/balance/batch", json={"lobbies": lobbies})
+
+    assert response.status_code == 200
+    first, odd, third = response.get_json()["results"]
+    assert len(first["teamA"]) == len(first["teamB"]) == 2
+    assert "error" in odd
+    assert len(third["teams"]) == 3
+    ids = {
+        player["nickname"]: player["id"]
+        for player in first["teamA"] + first["teamB"] + sum(third["teams"], [])
+    }
+    assert len(set(ids.values())) == len(ids) == 6
+
+    response = client.post(
+        "/api/balance/batch", json={"lobbies": [lobbies[0], {"users": []}]}
+    )
+    assert response.status_code == 400
+    assert response.get_json()["error"].startswith("Lobby 1:")
+
+
+def test_balance_returns_503_when_queue_is_full(client, monkeypatch):
+    # The app imports the executor module as utils.executor
+    from src.app import QueueFullError as AppQueueFullError
+
+    class FullExecutor:
+        max_workers = 1
+
+        def run(self, fn, *args, timeout=None, **kwargs):
+            raise AppQueueFullError()
+
+        def submit(self, fn, *args, **kwargs):
+            raise AppQueueFullError()
+
+    monkeypatch.setattr("src.app.balance_executor", FullExecutor())
+    users = {"Player1": 10, "Player2": 8}
+
+    response = client.post("/api/balance", json={"users": users})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+    response = client.post("/api/balance/batch", json={"lobbies": [{"users": users}]})
+    assert response.status_code == 503
+
+    response = client.post("/api/balance", json={"users": users, "deadline_ms": 0})
+    assert response.status_code == 400
+
+
+def test_balance_teams_options_and_seed():
+    user_scores = {f"Player{i}": 1 + i % 5 for i in range(10)}
+
+    result = balance_teams(user_scores, randomness=40, options=12, seed=7)
+    again = balance_teams(user_scores, randomness=40, options=12, seed=7)
+    assert result == again
+
+    options = result["options"]
+    assert sum(option["frequency"] for option in options) == 12
+    frequencies = [option["frequency"] for option in options]
+    assert frequencies == sorted(frequencies, reverse=True)
+    assert options[0]["teamA"] == result["teamA"]
+
+    # Options are distinct splits, whichever side is called team A
+    splits = {
+        frozenset(
+            frozenset(player["nickname"] for player in option[side])
+            for side in ("teamA", "teamB")
+        )
+        for option in options
+    }
+    assert len(splits) == len(options)
+    for option in options:
+        team_a = sum(player["score"] for player in option["teamA"])
+        team_b = sum(player["score"] for player in option["teamB"])
+        assert option["score_diff"] == abs(team_a - team_b)
+
+
+def test_randomize_scores():
+    rng = np.random.default_rng(0)
+    scores = np.array([0, 1, 2.5, 4])
+
+    draws = randomize_scores(scores, 50, draws=1000, rng=rng)
+    assert draws.shape == (1000, 4)
+    assert (draws >= 0).all()
+    assert (np.abs(draws - scores) <= scores * 0.5 + 1e-12).all()
+    assert np.array_equal(randomize_scores(scores, 0, draws=3), np.tile(scores, (3, 1)))
+
+
+def test_min_swap_split_uses_fewest_swaps():
+    rng = np.random.default_rng(0)
+
+    for players in range(2, 13, 2):
+        for _ in range(10):
+            nums = rng.choice([1, 1.5, 2, 2.5, 3, 3.3, 4], size=players)
+            solution = rng.permutation(players) < players // 2
+            target = Balancer(quantum=0.1).find_solutions(nums)[0]
+
+            swaps, diff, new_solution = min_swap_split(nums, solution, target, 6, 0.1)
+
+            assert new_solution.sum() == players // 2
+            assert (new_solution & ~solution).sum() == swaps
+            assert diff == pytest.approx(target)
+            assert abs(
+                nums[new_solution].sum() - nums[~new_solution].sum()
+            ) == pytest.approx(diff)
+            # No split with fewer swaps reaches the optimum
+            if swaps:
+                assert min_swap_split(nums, solution, target, swaps - 1, 0.1) is None
+
+
+def test_rebalance_teams_keeps_players_in_place():
+    team_a = {"Player1": 4, "Player2": 3, "Player3": 2}
+    team_b = {"Player4": 4, "Player5": 2.5, "Player6": 2.5}
+
+    result = rebalance_teams(team_a, team_b, added={"Player7": 1, "Player8": 1})
+    assert result["swaps"] == 0 and result["moved"] == []
+    assert result["diff"] == 0 and result["optimal"]
+
+    result = rebalance_teams(team_a, team_b, removed=["Player1", "Player2"])
+    assert len(result["teamA"]) == len(result["teamB"]) == 2
+    assert len(result["moved"]) == 1
+    assert result["optimal"] and not result["full_rebalance"]
+
+    # Without swaps the full engine's split is used, oriented to move few players
+    result = rebalance_teams(
+        {"Player1": 4, "Player2": 4}, {"Player3": 1, "Player4": 1}, max_swaps=0
+    )
+    assert result["full_rebalance"] and result["optimal"]
+    assert result["diff"] == pytest.approx(0)
+    assert len(result["moved"]) == 2
+
+
+def test_rebalance_endpoint(client):
+    response = client.post(
+        "/api/balance/rebalance",
+        json={
+            "teamA": {"Player1": 4, "Player2": 3},
+            "teamB": {"Player3": 4, "Player4": 2},
+            "added": {"Player5": 2, "Player6": 1},
+            "removed": ["Player2", "Player4"],
+        },
+    )
+
+    assert response.status_code == 200
+    result = response.get_json()
+    players = result["teamA"] + result["teamB"]
+    assert sorted(player["nickname"] for player in players) == [
+        "Player1",
+        "Player3",
+        "Player5",
+        "Player6",
+    ]
+    assert all("id" in player for player in players)
+    assert result["diff"] == 1
+
+    response = client.post(
+        "/api/balance/rebalance",
+        json={"teamA": {"Player1": 4}, "teamB": {"Player3": 4}, "max_swaps": 9},
+    )
+    assert response.status_code == 400
+
+    for body in (
+        {"teamA": {"Player1": 4}, "teamB": {"Player3": 4}, "added": {"Player5": "4"}},
+        {"teamA": {"Player1": True}, "teamB": {"Player3": 4}},
+        {"teamA": {"Player1": 4}, "teamB": {"Player1": 4}},
+        {"teamA": {"Player1": 4}, "teamB": {"Player3": 4}, "added": {"Player1": 2}},
+        {"teamA": {"Player1": 4, "Player2": 3}, "teamB": {"Player3": 4}},
+        {"teamA": {"Player1": 4}, "teamB": {"Player3": 4}, "removed": ["Player1"]},
+        {
+            "teamA": {f"A{i}": 1 for i in range(40)},
+            "teamB": {f"B{i}": 1 for i in range(40)},
+        },
+    ):
+        response = client.post("/api/balance/rebalance", json=body)
+        assert response.status_code == 400
+
+
+def test_rebalance_teams_limits_swaps_in_large_lobbies():
+    # Three swaps would compare C(32, 3) ** 2 subset pairs
+    team_a = {f"A{i}": 4 for i in range(32)}
+    team_b = {f"B{i}": 0 for i in range(32)}
+
+    result = rebalance_teams(team_a, team_b, max_swaps=3)
+    assert result["full_rebalance"] and result["optimal"]
+    assert result["diff"] == 0
+    assert len(result["teamA"]) == len(result["teamB"]) == 32
+
+
+def test_constrained_splits_match_brute_force():
+    balancer = Balancer(quantum=0.1)
+
+    def constrained_splits_match_oracle(nums):
+        players = len(nums)
+        rng = np.random.default_rng(abs(hash(nums.tobytes())))
+        pins = {int(p): bool(rng.integers(2)) for p in rng.choice(players, 1)}
+        pins = pins if rng.random() < 0.5 else {}
+        together = [rng.choice(players, 2, replace=False).tolist()]
+        apart = [rng.choice(players, 2, replace=False).tolist()]
+        try:
+            constraints = SplitConstraints(players, pins, together, apart)
+        except ValueError:
+            return
+        best, optimal = brute_force_splits(nums, 0.1, constraints)
+
+        min_diff, splits = balancer.find_optimal_splits(nums, constraints=constraints)
+        # Unpinned splits are anchored on an item rather than the last player
+        found = {(s if pins or s[-1] else ~s).tobytes() for s in splits}
+        assert min_diff == pytest.approx(best)
+        assert len(splits) == len(optimal)
+        assert found == {solution.tobytes() for solution in optimal}
+
+    check_property(score_vectors(0, 120), constrained_splits_match_oracle)
+
+
+def test_split_constraints_reject_contradictions():
+    with pytest.raises(ValueError):
+        SplitConstraints(4, together=[[0, 1]], apart=[(0, 1)])
+    with pytest.raises(ValueError):
+        SplitConstraints(4, pins={0: True, 1: False}, together=[[0, 1]])
+    with pytest.raises(ValueError):
+        # Three players on one team of two
+        SplitConstraints(4, together=[[0, 1, 2]])
+
+
+def test_balance_teams_with_constraints():
+    user_scores = {f"Player{i}": score for i, score in enumerate([5, 5, 4, 4, 3, 1])}
+
+    for seed in range(10):
+        result = balance_teams(
+            user_scores,
+            randomness=seed * 10,
+            seed=seed,
+            pins={"Player0": "B"},
+            together=[["Player0", "Player1"]],
+            apart=[["Player2", "Player3"]],
+        )
+        team_a = {player["nickname"] for player in result["teamA"]}
+        team_b = {player["nickname"] for player in result["teamB"]}
+        assert {"Player0", "Player1"} <= team_b
+        assert len({"Player2", "Player3"} & team_a) == 1
+        assert len(team_a) == len(team_b) == 3
+
+    # Only Player0, Player1 and Player5 make 11 of 22, counted once with its
+    # mirror although no player is pinned
+    result = balance_teams(user_scores, together=[["Player0", "Player1"]])
+    assert result["diff"] == 0
+    assert result["solution_count"] == 1
+
+
+def test_balance_endpoint_validates_constraints(client):
+    users = {"Player1": 4, "Player2": 3, "Player3": 2, "Player4": 1}
+    response = client.post(
+        "/api/balance",
+        json={"users": users, "pins": {"Player1": "A", "Player2": "A"}},
+    )
+    assert response.status_code == 200
+    team_a = {player["nickname"] for player in response.get_json()["teamA"]}
+    assert team_a == {"Player1", "Player2"}
+
+    for constraints in [
+        {"pins": {"Player9": "A"}},
+        {"pins": {"Player1": "C"}},
+        {"apart": [["Player1", "Player2", "Player3"]]},
+        {"together": [["Player1", "Player2"]], "apart": [["Player1", "Player2"]]},
+        {"together": [["Player1", "Player2"]], "teams": 4},
+    ]:
+        response = client.post("/api/balance", json={"users": users, **constraints})
+        assert response.status_code == 400
+
+
+def test_balance_teams_diagnostics():
+    user_scores = {f"Player{i}": 1 + (i * 7) % 11 for i in range(30)}
+
+    result = balance_teams(user_scores, randomness=20, seed=1, diagnostics=True)
+    diagnostics = result["diagnostics"]
+    assert diagnostics["players"] == 30
+    assert diagnostics["engine"] == "meet_in_the_middle"
+    # Half-masks of 15 players plus 14 with the anchor fixed
+    assert diagnostics["subsets_examined"] == 2**15 + 2**14
+    assert diagnostics["min_diff"] == result["diff"]
+    assert diagnostics["solution_count"] == result["solution_count"]
+    assert diagnostics["elapsed_ms"] > 0
+    assert diagnostics["peak_bytes"] is None
+
+    result = balance_teams(user_scores, diagnostics=True, trace_memory=True)
+    assert result["diagnostics"]["engine"] == "rank_dp"
+    assert result["diagnostics"]["subsets_examined"] is None
+    assert result["diagnostics"]["peak_bytes"] > 0
+
+    assert "diagnostics" not in balance_teams(user_scores)
+
+
+def test_balance_metrics_endpoint(client):
+    users = {f"Player{i}": 1 + i % 4 for i in range(6)}
+    response = client.post("/api/balance", json={"users": users})
+    assert "diagnostics" not in response.get_json()
+
+    response = client.post(
+        "/api/balance", json={"users": users, "randomness": 30, "diagnostics": True}
+    )
+    diagnostics = response.get_json()["diagnostics"]
+    assert diagnostics["engine"] == "meet_in_the_middle"
+    assert diagnostics["peak_bytes"] > 0
+
+    response = client.post("/api/balance", json={"users": users, "diagnostics": 1})
+    assert response.status_code == 400
+
+    stats = client.get("/api/balance/metrics").get_json()["6"]
+    assert stats["count"] >= 2
+    assert sum(stats["buckets"].values()) == stats["count"]
+    assert stats["engines"]["meet_in_the_middle"] >= 1
+    assert stats["p50_ms"] <= stats["p99_ms"] <= stats["max_ms"]
+
+
+def test_balance_teams_prefers_even_odds():
+    # Every split of equal scores is optimal, but Player0 and Player1 are much
+    # stronger by their history and only even odds keep them apart
+    user_scores = {f"Player{i}": 2 for i in range(8)}
+    ratings = [2.0, 2.0, 0, 0, 0, 0, 0, 0]
+
+    result = balance_teams(
+        user_scores, randomness=0, ratings=ratings, prefer_even_odds=True
+    )
+    team_a = {player["nickname"] for player in result["teamA"]}
+    assert ("Player0" in team_a) != ("Player1" in team_a)
+    assert result["win_probability"] == pytest.approx(0.5)
+
+    result = balance_teams(user_scores, randomness=0, ratings=ratings)
+    assert 0 < result["win_probability"] < 1
+    assert "win_probability" not in balance_teams(user_scores, randomness=0)
+
+
+def test_balance_endpoint_reports_win_probability(client):
+    users = {f"Player{i}": 1 + i % 4 for i in range(6)}
+    response = client.post("/api/balance", json={"users": users})
+    assert 0 < response.get_json()["win_probability"] < 1
+
+    response = client.post(
+        "/api/balance", json={"users": users, "prefer_even_odds": True}
+    )
+    assert response.status_code == 200
+
+    response = client.post(
+        "/api/balance", json={"users": users, "prefer_even_odds": "yes"}
+    )
+    assert response.status_code == 400
+
+    response = client.post(
+        "/api/balance", json={"users": users, "teams": 3, "prefer_even_odds": True}
+    )
+    assert response.status_code == 400
+
+
+def test_benchmark_flags_regressions_past_threshold():
+    def run(p50, peak, rss=100_000):
+        case = {"p50_ms": p50, "p90_ms": p50, "p99_ms": p50, "peak_kib": peak}
+        return {"max_rss_kib": rss, "cases": {"ladder/r0/n30": case}}
+
+    baseline = run(p50=2.0, peak=1000)
+    assert compare_results(run(2.4, 1200), baseline, threshold=0.25) == []
+    # Relative growth under the noise floor is not a regression
+    assert compare_results(run(0.02, 1000), run(0.01, 1000), threshold=0.25) == []
+
+    regressions = compare_results(run(3.0, 2000, rss=200_000), baseline, 0.25)
+    assert [key for key, _ in regressions] == ["ladder/r0/n30"] * 3 + [None]
+
+
+def score_vectors(seed, count, max_players=12, teams=2):
+    """
+    Lobbies drawn from SCORES, like a property-based test generator: the edge
+    cases first (one score repeated, the ladder extremes), then random lobby
+    sizes over random sub-ladders, narrow ones forcing many ties, in random,
+    ascending or descending order.
+    """
+    rng = np.random.default_rng(seed)
+    ladder = np.array(sorted(SCORES), dtype=float)
+    yield np.full(teams, ladder[0])
+    yield np.full(max_players, ladder[-1])
+    yield np.resize(ladder[[0, -1]], max_players)
+    for _ in range(count):
+        players = rng.choice(np.arange(teams, max_players + 1, teams))
+        values = rng.choice(ladder, size=rng.integers(1, len(ladder) + 1))
+        nums = rng.choice(values, size=players)
+        order = rng.integers(3)
+        if order == 1:
+            nums = np.sort(nums)
+        elif order == 2:
+            nums = np.sort(nums)[::-1]
+        yield nums
+
+
+def check_property(vectors, prop, teams=2):
+    """
+    Run prop on every score vector and fail with a shrunk counterexample:
+    players are dropped a team's worth at a time and scores moved down the
+    ladder while prop still raises an AssertionError.
+    """
+    ladder = sorted(SCORES)
+
+    def failure(nums):
+        try:
+            prop(nums)
+        except AssertionError as e:
+            return e
+        return None
+
+    for nums in vectors:
+        error = failure(nums)
+        if error is None:
+            continue
+        shrunk = True
+        while shrunk:
+            shrunk = False
+            candidates = [
+                np.delete(nums, range(start, start + teams))
+                for start in range(0, len(nums) - teams, teams)
+            ]
+            for i, num in enumerate(nums):
+                lower = [score for score in ladder if score < num]
+                if lower:
+                    candidates.append(
+                        np.where(np.arange(len(nums)) == i, lower[0], nums)
+                    )
+            for candidate in candidates:
+                candidate_error = failure(candidate)
+                if candidate_error is not None:
+                    nums, error, shrunk = candidate, candidate_error, True
+                    break
+        pytest.fail(f"Counterexample {nums.tolist()}: {error}")
+
+
+def test_brute_force_oracle_matches_precomputed_diffs():
+    with open("tests/files/balance_tests.json", "r") as f:
+        tests = [test for test in json.load(f) if len(test["nums"]) <= 12][:200]
+
+    for test in tests:
+        min_diff, solutions = brute_force_splits(test["nums"], quantum=0.1)
+        assert round(min_diff, 4) == test["diff"]
+        assert solutions[:, -1].all()
+        assert (solutions.sum(axis=1) == len(test["nums"]) // 2).all()
+
+
+def test_two_team_engines_match_brute_force_oracle():
+    quantum = get_score_quantum(SCORES)
+    balancer = Balancer(quantum=quantum)
+    float_balancer = Balancer()
+    rank_balancer = RankBalancer(quantum=quantum)
+    heuristic_balancer = HeuristicBalancer(quantum=quantum)
+    rng = np.random.default_rng(0)
+
+    def engines_match_oracle(nums):
+        best, optimal = brute_force_splits(nums, quantum)
+        optimal = {solution.tobytes() for solution in optimal}
+
+        min_diff, splits = balancer.find_optimal_splits(nums)
+        assert min_diff == pytest.approx(best), "meet-in-the-middle diff"
+        assert len(splits) == len(optimal), "meet-in-the-middle count"
+        assert {s.tobytes() for s in splits} == optimal, "meet-in-the-middle splits"
+
+        float_best, float_optimal = brute_force_splits(nums)
+        min_diff, splits = float_balancer.find_optimal_splits(nums)
+        assert min_diff == pytest.approx(float_best), "float diff"
+        assert {s.tobytes() for s in splits} == {
+            solution.tobytes() for solution in float_optimal
+        }, "float splits"
+
+        min_diff, solution, count, proven = rank_balancer.sample_solution(nums, rng)
+        assert proven and min_diff == pytest.approx(best), "rank DP diff"
+        assert count == len(optimal), "rank DP count"
+        assert (solution if solution[-1] else ~solution).tobytes() in optimal
+
+        # Engines that may stop early never beat the oracle, and match it
+        # whenever they claim to be optimal
+        min_diff, splits = balancer.find_optimal_splits(nums, max_ms=0)
+        assert min_diff >= best - 1e-9, "budgeted diff"
+        assert not splits.optimal or min_diff == pytest.approx(best)
+        min_diff, _, proven = heuristic_balancer.search(nums, 5, rng=rng)
+        assert min_diff >= best - 1e-9, "heuristic diff"
+        assert not proven or min_diff == pytest.approx(best)
+
+    check_property(score_vectors(1, 300, max_players=14), engines_match_oracle)
+
+
+@pytest.mark.parametrize("teams", [3, 4])
+def test_multi_team_balancer_matches_brute_force_oracle(teams):
+    quantum = get_score_quantum(SCORES)
+    multi_team_balancer = MultiTeamBalancer(quantum=quantum)
+    rng = np.random.default_rng(teams)
+
+    def multi_team_matches_oracle(nums):
+        best, _ = brute_force_teams(nums, teams, quantum)
+        spread, assignment, optimal = multi_team_balancer.search(
+            nums, teams, 1000, rng=rng
+        )
+        assert optimal and spread == pytest.approx(best)
+        assert (np.bincount(assignment, minlength=teams) == len(nums) // teams).all()
+
+    check_property(
+        score_vectors(teams, 40, max_players=3 * teams, teams=teams),
+        multi_team_matches_oracle,
+        teams=teams,
+    )
+
+
+def test_check_property_shrinks_counterexamples():
+    def no_large_lobbies(nums):
+        assert len(nums) < 6 or nums.max() < max(SCORES)
+
+    with pytest.raises(pytest.fail.Exception, match="Counterexample") as failure:
+        check_property([np.array(sorted(SCORES)[-8:])], no_large_lobbies)
+    # Two players dropped and every score but the top one lowered to the floor
+    ladder = sorted(SCORES)
+    shrunk = [float(score) for score in [ladder[0]] * 5 + [ladder[-1]]]
+    assert f"Counterexample {shrunk}" in str(failure.value)